@@ -0,0 +1,329 @@
+"""
+Archive ingest for FreeFlow
+Reads uploaded .zip and .tar(.gz) archives entry by entry, without
+extracting them: image entries are streamed straight into the blob store on
+a thread pool and YOLO / COCO label files found alongside them are imported
+as annotations
+"""
+
+import io
+import os
+import posixpath
+import tarfile
+import threading
+import uuid
+import zipfile
+from collections import deque
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from database import db, serialized_commit, serialized_write
+from models import Project, Image, Annotation
+from blob_store import store_image_stream, blobs_root
+from bulk_insert import ImageBatchWriter, insert_annotations, chunks, IN_CLAUSE_CHUNK
+from image_probe import file_kind, stream_to_file, ImageProbeError
+from image_normalize import ingest_policy, oriented_size, store_normalized
+from near_duplicates import safe_dhash
+from label_formats import (YOLO_CLASS_FILES, parse_yolo_labels, parse_yolo_class_names,
+                           yolo_label_candidates, parse_coco, resolve_class_ids,
+                           annotation_row, is_label_file)
+
+ARCHIVE_KINDS = ('zip', 'tar', 'tgz')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+
+# Tar entries are read into memory to hand them to the pool; bigger ones are stored inline
+TAR_BUFFER_LIMIT = 64 * 1024 * 1024
+# Label files bigger than this (e.g. a runaway COCO export) are skipped
+LABEL_FILE_LIMIT = 512 * 1024 * 1024
+# Image rows are committed (and progress reported) in batches of this size
+COMMIT_EVERY = 500
+
+
+def is_archive(filename):
+    return file_kind(filename) in ARCHIVE_KINDS
+
+
+def archive_stem(filename):
+    """Archive name without its .zip / .tar / .tar.gz / .tgz suffix"""
+    for suffix in ('.tar.gz', '.tgz', '.tar', '.zip'):
+        if filename.lower().endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+def archive_image_name(stem, entry_name):
+    """
+    Image filename for an archive entry: the archive's stem, then the entry's path
+
+    Archives usually wrap everything in a folder named like the archive
+    itself; that folder isn't repeated (ds.zip's ds/images/c.jpg becomes
+    ds/images/c.jpg, not ds/ds/images/c.jpg).
+    """
+    top, sep, rest = entry_name.partition('/')
+    if sep and top == stem:
+        entry_name = rest
+    return f"{stem}/{entry_name}"[:500]
+
+
+def _skip_entry(name):
+    base = posixpath.basename(name)
+    return name.startswith('__MACOSX/') or base.startswith('.') or not base
+
+
+class _ZipEntries:
+    """Zip entries; each pool thread reads through its own handle on the archive"""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self.handles = []
+        self.lock = threading.Lock()
+        self.zf = zipfile.ZipFile(path)
+        self.image_count = sum(
+            1 for info in self.zf.infolist()
+            if not info.is_dir() and not _skip_entry(info.filename) and info.filename.lower().endswith(IMAGE_SUFFIXES)
+        )
+
+    def _handle(self):
+        zf = getattr(self.local, 'zf', None)
+        if zf is None:
+            zf = self.local.zf = zipfile.ZipFile(self.path)
+            with self.lock:
+                self.handles.append(zf)
+        return zf
+
+    def __iter__(self):
+        for info in self.zf.infolist():
+            if not info.is_dir():
+                yield info.filename, info.file_size, lambda name=info.filename: self._handle().open(name)
+
+    def close(self):
+        for zf in self.handles + [self.zf]:
+            zf.close()
+
+
+class _TarEntries:
+    """Tar entries, read strictly in order from a (possibly gzipped) stream"""
+
+    image_count = None  # Unknown until the stream has been read
+
+    def __init__(self, path):
+        self.tf = tarfile.open(path, mode='r|*')
+
+    def __iter__(self):
+        for member in self.tf:
+            if member.isfile():
+                # Only readable until the iteration moves on to the next member
+                yield member.name, member.size, lambda member=member: self.tf.extractfile(member)
+
+    def close(self):
+        self.tf.close()
+
+
+def _store_entry(app, name, open_entry, policy=None):
+    """
+    Stream one archive entry into the blob store (runs on a pool thread)
+
+    With an ingest policy the entry is staged to a temp file first, so it can
+    be normalized before it is stored.
+    """
+    try:
+        with app.app_context():
+            with open_entry() as stream:
+                if not policy:
+                    probe, filepath = store_image_stream(stream, name)
+                    width, height = oriented_size(probe)
+                    stored = {'content_hash': probe['sha256'], 'filepath': filepath, 'size': probe['size'],
+                              'width': width, 'height': height, 'original': None}
+                else:
+                    os.makedirs(blobs_root(), exist_ok=True)
+                    temp_path = os.path.join(blobs_root(), f".incoming-{uuid.uuid4().hex}")
+                    probe = stream_to_file(stream, temp_path, name)
+            if policy:
+                try:
+                    stored = store_normalized(temp_path, name, probe, policy, move=True)
+                finally:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+        stored['dhash'] = safe_dhash(stored['filepath'])
+        return name, stored, None
+    except ImageProbeError as e:
+        return name, None, str(e)
+    except Exception as e:
+        return name, None, f"Could not read entry: {e}"
+
+
+def ingest_archive(app, job, ingest_file, report_progress):
+    """
+    Ingest every image of a staged archive and import the labels found with them
+
+    Images are committed in batches so an interrupted archive can be retried;
+    entries that already produced an image in this job are skipped.
+
+    Args:
+        app: Flask app, for the pool threads' app contexts
+        job: IngestJob the archive belongs to
+        ingest_file: IngestFile of the archive
+        report_progress: Called with (images so far, total images or None)
+
+    Returns:
+        Tuple of (images from the archive, including earlier attempts;
+        annotations created; list of skipped entry errors)
+    """
+    stem = archive_stem(ingest_file.filename)
+    # Images stored by earlier attempts, by filename; matched to their entries as the archive is read
+    stored_images = dict(db.session.query(Image.filename, Image.id).filter(
+        Image.batch_id == job.batch_id, Image.filename.startswith(stem + '/', autoescape=True)
+    ))
+    # Entry name -> image id, for this attempt and earlier ones
+    image_ids = {}
+    label_files = {}
+    skipped = []
+    pending = deque()
+
+    policy = ingest_policy(Project.query.get(job.project_id))
+    kind = file_kind(ingest_file.filename)
+    entries = _ZipEntries(ingest_file.staged_path) if kind == 'zip' else _TarEntries(ingest_file.staged_path)
+    workers = current_app.config.get('INGEST_WORKERS', 4)
+
+    def checkpoint(writer):
+        image_ids.update(writer.ids)
+        writer.ids.clear()
+        ingest_file.images_created = len(image_ids)
+        report_progress(len(image_ids), entries.image_count)
+
+    writer = ImageBatchWriter(batch_size=COMMIT_EVERY, on_batch=checkpoint)
+
+    def record(result):
+        name, stored, error = result
+        if error:
+            print(f"⚠️ Skipping {name} in {ingest_file.filename}: {error}")
+            skipped.append(f"{name}: {error}")
+            return
+        writer.add(name, {
+            'filename': archive_image_name(stem, name),
+            'filepath': stored['filepath'],
+            'content_hash': stored['content_hash'],
+            'size': stored['size'],
+            'width': stored['width'],
+            'height': stored['height'],
+            'original': stored['original'],
+            'dhash': stored['dhash'],
+            'batch_id': job.batch_id,
+            'project_id': job.project_id
+        })
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, size, open_entry in entries:
+                if _skip_entry(name):
+                    continue
+                if name.lower().endswith(IMAGE_SUFFIXES):
+                    earlier = stored_images.get(archive_image_name(stem, name))
+                    if earlier is not None:
+                        image_ids[name] = earlier
+                        continue
+                    if kind != 'zip':
+                        if size > TAR_BUFFER_LIMIT:
+                            # Too big to buffer: store it here before the stream moves on
+                            record(_store_entry(app, name, open_entry, policy))
+                            continue
+                        # Tar entries must be read before the stream moves on, so buffer them for the pool
+                        with open_entry() as stream:
+                            open_entry = partial(io.BytesIO, stream.read())
+                    pending.append(executor.submit(_store_entry, app, name, open_entry, policy))
+                    # Keep a bounded number of entries in flight (tar entries are held in memory)
+                    while len(pending) > workers * 2:
+                        record(pending.popleft().result())
+                elif is_label_file(name) and size <= LABEL_FILE_LIMIT:
+                    with open_entry() as stream:
+                        label_files[name] = stream.read().decode('utf-8', errors='replace')
+
+            while pending:
+                record(pending.popleft().result())
+        writer.flush()
+    finally:
+        entries.close()
+
+    annotations = _import_labels(job, image_ids, label_files)
+    serialized_commit()
+    return len(image_ids), annotations, skipped
+
+
+def _import_labels(job, image_ids, label_files):
+    """Attach YOLO / COCO labels from the archive to its images that have no annotations yet (commits them)"""
+    if not label_files or not image_ids:
+        return 0
+
+    yolo_names = _yolo_class_names(label_files)
+    coco_categories, coco_labels = {}, {}
+    for name, text in label_files.items():
+        if name.lower().endswith('.json'):
+            parsed = parse_coco(text)
+            if parsed:
+                coco_categories.update(parsed[0])
+                for key, labels in parsed[1].items():
+                    coco_labels.setdefault(key, []).extend(labels)
+
+    # Only fill images that have no annotations yet, so retries don't duplicate labels
+    annotated = set()
+    for chunk in chunks(list(image_ids.values()), IN_CLAUSE_CHUNK):
+        annotated.update(image_id for (image_id,) in db.session.query(Annotation.image_id).filter(
+            Annotation.image_id.in_(chunk)
+        ).distinct())
+
+    labels_by_image = {}
+    for name, image_id in image_ids.items():
+        if image_id in annotated:
+            continue
+        for candidate in yolo_label_candidates(name):
+            if candidate in label_files:
+                labels_by_image[image_id] = ('yolo', parse_yolo_labels(label_files[candidate]))
+                break
+        else:
+            labels = coco_labels.get(posixpath.basename(name))
+            if labels:
+                labels_by_image[image_id] = ('coco', labels)
+
+    if not labels_by_image:
+        return 0
+
+    # YOLO labels without a names file fall back to generic class names
+    used_indices = {label[0] for fmt, labels in labels_by_image.values() if fmt == 'yolo' for label in labels}
+    yolo_names = {idx: yolo_names.get(idx, f"class_{idx}") for idx in used_indices}
+
+    # New classes, annotations and statuses are one background write transaction
+    with serialized_write():
+        project = Project.query.get(job.project_id)
+        yolo_classes = resolve_class_ids(project, yolo_names)
+        coco_classes = resolve_class_ids(project, coco_categories)
+
+        rows = []
+        for image_id, (fmt, labels) in labels_by_image.items():
+            class_ids = yolo_classes if fmt == 'yolo' else coco_classes
+            rows.extend(annotation_row(class_ids[label[0]], label, image_id) for label in labels if label[0] in class_ids)
+        count = insert_annotations(rows)
+
+        # Imported labels count as finished annotation, as with Roboflow imports
+        for chunk in chunks(list(labels_by_image), IN_CLAUSE_CHUNK):
+            Image.query.filter(Image.id.in_(chunk)).update({Image.status: 'completed'}, synchronize_session=False)
+        db.session.commit()
+    print(f"🏷️ Imported {count} annotations for {len(labels_by_image)} images")
+    return count
+
+
+def _yolo_class_names(label_files):
+    """Class names by index from the shallowest YOLO names file in the archive"""
+    candidates = sorted(
+        (name for name in label_files if posixpath.basename(name) in YOLO_CLASS_FILES),
+        key=lambda name: (name.count('/'), YOLO_CLASS_FILES.index(posixpath.basename(name)))
+    )
+    for name in candidates:
+        try:
+            names = parse_yolo_class_names(name, label_files[name])
+        except Exception as e:
+            print(f"⚠️ Could not read class names from {name}: {e}")
+            continue
+        if names:
+            return dict(enumerate(names))
+    return {}
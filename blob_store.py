@@ -0,0 +1,352 @@
+"""
+Content-addressed blob storage for FreeFlow
+Every unique file is stored once under its SHA-256; Image rows point at the
+shared blob and a reference count decides when the blob can be deleted
+"""
+
+import os
+import shutil
+import hashlib
+import threading
+import time
+import uuid
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import db
+from models import Blob
+from image_probe import stream_to_file
+from pdf_pages import remove_page_cache
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# A pin whose reference was never committed or rolled back (e.g. a failed job) stops protecting its blob after this long
+PIN_TTL = 60 * 60
+
+# Blobs handed out by store_* whose reference isn't committed yet, as sha256 -> (count, last pinned).
+# A released blob's file is kept while it is pinned, so the Image row about to point at it never
+# finds it deleted; placing and deleting blob files both happen under _pins_guard.
+_pins = {}
+_pins_guard = threading.Lock()
+
+
+def blobs_root():
+    """Root folder of the blob store"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'blobs')
+
+
+def blob_path(sha256, ext):
+    """Path of a blob, fanned out over two directory levels to keep folders small"""
+    return os.path.join(blobs_root(), sha256[:2], sha256[2:4], f"{sha256}{ext.lower()}")
+
+
+def pin_blob(sha256):
+    """
+    Keep a blob's file on disk until the caller's acquire_blob(s) commits or rolls back
+
+    Called by every store_* function before it looks for an existing copy, so
+    a reference released in the meantime can't delete the file it returns.
+    """
+    with _pins_guard:
+        count, _ = _pins.get(sha256, (0, 0))
+        _pins[sha256] = (count + 1, time.time())
+
+
+def unpin_blobs(sha256s):
+    """Drop one pin from each blob (its reference was committed, or its placement abandoned)"""
+    with _pins_guard:
+        for sha256 in sha256s:
+            count, pinned_at = _pins.get(sha256, (0, 0))
+            if count <= 1:
+                _pins.pop(sha256, None)
+            else:
+                _pins[sha256] = (count - 1, pinned_at)
+
+
+def _pinned(sha256):
+    count, pinned_at = _pins.get(sha256, (0, 0))
+    return count > 0 and time.time() - pinned_at < PIN_TTL
+
+
+def hash_file(path):
+    """Compute the SHA-256 of a file on disk"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _file_ext(filename):
+    ext = os.path.splitext(filename)[1]
+    return ext.lower() if ext else ''
+
+
+def _place_blob(temp_path, sha256, ext):
+    """Move a fully written temp file into its blob slot, or drop it if the blob already exists"""
+    existing = Blob.query.get(sha256)
+    if existing and os.path.exists(existing.filepath):
+        os.remove(temp_path)
+        return existing.filepath
+
+    path = blob_path(sha256, ext)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        os.remove(temp_path)
+    else:
+        os.replace(temp_path, path)
+    return path
+
+
+def store_stream(stream, filename):
+    """
+    Write a stream into the blob store, hashing it on the way
+
+    Args:
+        stream: Readable binary stream (e.g. a Werkzeug FileStorage stream)
+        filename: Original filename, used for the blob's extension
+
+    Returns:
+        Tuple of (sha256, blob path, size in bytes); the blob is pinned until
+        acquire_blob(s) records the caller's reference
+    """
+    os.makedirs(blobs_root(), exist_ok=True)
+    temp_path = os.path.join(blobs_root(), f".incoming-{uuid.uuid4().hex}")
+    hasher = hashlib.sha256()
+    size = 0
+
+    try:
+        with open(temp_path, 'wb') as out:
+            for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    sha256 = hasher.hexdigest()
+    pin_blob(sha256)
+    return sha256, _place_blob(temp_path, sha256, _file_ext(filename)), size
+
+
+def store_image_stream(stream, filename):
+    """
+    Write an image stream into the blob store, hashing and probing it on the way
+
+    Returns:
+        Tuple of (probe result, blob path); see image_probe.StreamProbe.finish
+
+    Raises:
+        ImageProbeError: the stream is not a complete, decodable image
+    """
+    os.makedirs(blobs_root(), exist_ok=True)
+    temp_path = os.path.join(blobs_root(), f".incoming-{uuid.uuid4().hex}")
+    probe = stream_to_file(stream, temp_path, filename)
+    pin_blob(probe['sha256'])
+    return probe, _place_blob(temp_path, probe['sha256'], _file_ext(filename))
+
+
+def store_file(source_path, filename=None, move=False, sha256=None, link=False):
+    """
+    Add a file already on disk to the blob store
+
+    Args:
+        source_path: File to store
+        filename: Name used for the blob's extension (defaults to source_path)
+        move: Consume source_path instead of copying it (for temp files)
+        link: Hardlink source_path instead of copying it where possible (for
+              imported datasets that stay on disk)
+        sha256: Hash computed while the file was received, to skip re-reading it
+
+    Returns:
+        Tuple of (sha256, blob path, size in bytes)
+    """
+    sha256 = sha256 or hash_file(source_path)
+    size = os.path.getsize(source_path)
+    ext = _file_ext(filename or source_path)
+
+    pin_blob(sha256)
+    existing = Blob.query.get(sha256)
+    if existing and os.path.exists(existing.filepath):
+        if move:
+            os.remove(source_path)
+        return sha256, existing.filepath, size
+
+    os.makedirs(blobs_root(), exist_ok=True)
+    temp_path = os.path.join(blobs_root(), f".incoming-{uuid.uuid4().hex}")
+    if move:
+        shutil.move(source_path, temp_path)
+    elif link:
+        link_or_copy(source_path, temp_path)
+    else:
+        shutil.copyfile(source_path, temp_path)
+    return sha256, _place_blob(temp_path, sha256, ext), size
+
+
+def blob_upsert():
+    """
+    Dialect insert() with on_conflict_do_update for the session's database
+
+    Returns:
+        The insert construct, or None where the database has no ON CONFLICT
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def acquire_blob(sha256, path, size=None):
+    """Record one more reference to a blob (caller commits); its pin is dropped once that transaction ends"""
+    unpin_when_done([sha256])
+    insert = blob_upsert()
+    if insert:
+        # One statement, so two writers adding the same new blob can't both try to insert it
+        statement = insert(Blob).values(sha256=sha256, filepath=path, size=size, ref_count=1)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={'ref_count': Blob.ref_count + 1}
+        ))
+        return
+
+    for attempt in range(2):
+        updated = Blob.query.filter_by(sha256=sha256).update(
+            {Blob.ref_count: Blob.ref_count + 1},
+            synchronize_session=False
+        )
+        if updated:
+            return
+        try:
+            with db.session.begin_nested():
+                db.session.add(Blob(sha256=sha256, filepath=path, size=size, ref_count=1))
+            return
+        except IntegrityError:
+            # Another writer inserted the row first; count this reference on it
+            if attempt:
+                raise
+
+
+def after_commit(action):
+    """Run action() once the session's current transaction commits (dropped on rollback)"""
+    db.session.info.setdefault('after_commit', []).append(action)
+
+
+def unpin_when_done(sha256s):
+    """Unpin blobs once the session's current transaction commits or rolls back"""
+    db.session.info.setdefault('unpin', []).extend(sha256s)
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_after_commit(session):
+    unpin_blobs(session.info.pop('unpin', []))
+    for action in session.info.pop('after_commit', []):
+        try:
+            action()
+        except Exception as e:
+            print(f"⚠️ Post-commit cleanup failed: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _drop_after_commit(session):
+    unpin_blobs(session.info.pop('unpin', []))
+    session.info.pop('after_commit', None)
+
+
+def _blob_exists(sha256):
+    with db.engine.connect() as connection:
+        return connection.execute(select(Blob.sha256).where(Blob.sha256 == sha256)).first() is not None
+
+
+def _delete_blob_file(sha256, path):
+    """Remove a released blob's file, unless the blob was re-added or handed out again since"""
+    with _pins_guard:
+        if _pinned(sha256) or _blob_exists(sha256):
+            return
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except Exception as e:
+            print(f"⚠️ Failed to delete blob {sha256}: {e}")
+
+
+def release_blob(sha256, on_deleted=None):
+    """
+    Drop one reference to a blob, deleting the file when none remain
+
+    The row update is flushed but not committed; the file (and on_deleted,
+    if given) is only removed after the caller's commit succeeds, so a
+    rolled-back delete never leaves a Blob row pointing at a missing file.
+
+    Returns:
+        True if that was the last reference and the blob is gone
+    """
+    blob = Blob.query.get(sha256)
+    if not blob:
+        return False
+
+    Blob.query.filter_by(sha256=sha256).update(
+        {Blob.ref_count: Blob.ref_count - 1},
+        synchronize_session=False
+    )
+    db.session.flush()
+    db.session.refresh(blob)
+
+    if blob.ref_count <= 0:
+        path = blob.filepath
+        db.session.delete(blob)
+        after_commit(lambda: _delete_blob_file(sha256, path))
+        if on_deleted:
+            after_commit(on_deleted)
+        return True
+    return False
+
+
+def abandon_blobs(blobs, pinned=True):
+    """
+    Give up placed blobs that no Image row will reference (e.g. after a failed ingest)
+
+    Args:
+        blobs: (sha256, path) pairs returned by store_*
+        pinned: Their pins are still held (acquire_blob never ran for them)
+    """
+    if pinned:
+        unpin_blobs([sha256 for sha256, _ in blobs])
+    for sha256, path in blobs:
+        _delete_blob_file(sha256, path)
+
+
+def release_image_file(image):
+    """Release the file behind an Image row (blob reference or legacy per-image file)"""
+    if image.original_hash:
+        # Original kept in cold storage by the project's ingest policy
+        release_blob(image.original_hash)
+    if image.content_hash:
+        release_blob(image.content_hash)
+        return
+    if image.source_hash:
+        # Lazily rendered PDF page: the PDF is the blob, its cached pages go with it
+        source_hash = image.source_hash
+        release_blob(source_hash, on_deleted=lambda: remove_page_cache(source_hash))
+        return
+
+    try:
+        if os.path.exists(image.filepath):
+            os.remove(image.filepath)
+    except Exception as e:
+        print(f"Failed to delete image file: {e}")
+
+
+def link_or_copy(source_path, dest_path):
+    """Hardlink a blob into place (e.g. a YOLO dataset), copying across filesystems"""
+    if os.path.exists(dest_path):
+        os.remove(dest_path)
+    try:
+        os.link(source_path, dest_path)
+    except OSError:
+        shutil.copy(source_path, dest_path)
@@ -0,0 +1,187 @@
+"""
+Bulk insert layer for FreeFlow imports
+Inserts Image and Annotation rows with executemany-style Core inserts in
+bounded batches instead of one ORM object (and one flush) per row. Image ids
+come back in bulk via RETURNING where the database supports it, and each
+batch is committed on its own so large imports never hold one long write
+transaction.
+"""
+
+from collections import Counter
+from sqlalchemy import insert, bindparam, select
+from database import db, serialized_write
+from models import Image, Annotation, Blob
+from blob_store import blob_upsert, unpin_when_done
+
+# Images per committed batch
+IMAGE_BATCH_SIZE = 500
+# Annotations per executemany call
+ANNOTATION_BATCH_SIZE = 5000
+# Keep IN (...) lists well under SQLite's bound-parameter limit
+IN_CLAUSE_CHUNK = 500
+
+
+def chunks(items, size):
+    """Consecutive slices of items, at most size long"""
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _group_by_keys(rows):
+    """Split rows into runs with the same columns; executemany needs one shape per call"""
+    groups = {}
+    for index, row in enumerate(rows):
+        groups.setdefault(tuple(sorted(row)), []).append((index, row))
+    return groups.values()
+
+
+def insert_images(rows):
+    """
+    Insert Image rows in one round of executemany inserts (caller commits)
+
+    Args:
+        rows: List of dicts of Image column values
+
+    Returns:
+        List of new Image ids, in the order of rows
+    """
+    ids = [None] * len(rows)
+    dialect = db.session.get_bind().dialect
+    for group in _group_by_keys(rows):
+        params = [row for _, row in group]
+        if dialect.insert_executemany_returning_sort_by_parameter_order:
+            result = db.session.execute(
+                insert(Image).returning(Image.id, sort_by_parameter_order=True), params
+            )
+            new_ids = result.scalars().all()
+        else:
+            # No ordered RETURNING for executemany here; fall back to single-row inserts
+            new_ids = [db.session.execute(insert(Image).values(**row)).inserted_primary_key[0] for row in params]
+        for (index, _), image_id in zip(group, new_ids):
+            ids[index] = image_id
+    return ids
+
+
+def insert_annotations(rows, batch_size=ANNOTATION_BATCH_SIZE):
+    """Insert Annotation rows (dicts with image_id) with executemany, in chunks (caller commits)"""
+    for chunk in chunks(rows, batch_size):
+        for group in _group_by_keys(chunk):
+            db.session.execute(insert(Annotation), [row for _, row in group])
+    return len(rows)
+
+
+def acquire_blobs(entries):
+    """
+    Record one reference per entry to each blob, in bulk (caller commits)
+
+    Their pins are dropped once the transaction commits or rolls back.
+
+    Args:
+        entries: List of (sha256, blob path, size) tuples, one per new Image row
+    """
+    counts = Counter(sha256 for sha256, _, _ in entries)
+    unpin_when_done(counts)
+    info = {sha256: (path, size) for sha256, path, size in entries}
+    rows = [
+        {'sha256': sha256, 'filepath': info[sha256][0], 'size': info[sha256][1], 'ref_count': count}
+        for sha256, count in counts.items()
+    ]
+
+    upsert = blob_upsert()
+    if upsert:
+        # Insert-or-add in one statement, so a concurrent writer adding the same blob can't collide
+        statement = upsert(Blob)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[Blob.sha256],
+            set_={'ref_count': Blob.ref_count + statement.excluded.ref_count}
+        ), rows)
+        return
+
+    existing = set()
+    for chunk in chunks(list(counts), IN_CLAUSE_CHUNK):
+        existing.update(db.session.execute(select(Blob.sha256).where(Blob.sha256.in_(chunk))).scalars())
+
+    table = Blob.__table__
+    if existing:
+        db.session.execute(
+            table.update()
+            .where(table.c.sha256 == bindparam('b_sha256'))
+            .values(ref_count=table.c.ref_count + bindparam('b_count')),
+            [{'b_sha256': sha256, 'b_count': counts[sha256]} for sha256 in existing]
+        )
+    new = [row for row in rows if row['sha256'] not in existing]
+    if new:
+        db.session.execute(insert(Blob), new)
+
+
+class ImageBatchWriter:
+    """
+    Buffer new images (with their annotations) and write them in committed batches
+
+    Usage:
+        writer = ImageBatchWriter(on_batch=report)
+        writer.add(key, image_row, annotation_rows)
+        ...
+        writer.flush()
+        writer.ids[key]  # id of the inserted Image
+
+    Image rows are dicts of Image columns and must include content_hash,
+    filepath and a 'size' (bytes, used for the blob's reference count, not
+    stored on the image). A row may also carry 'original', the (sha256, path,
+    size) of an original kept by the ingest policy; it is stored as
+    original_hash and reference-counted like the image's blob. Annotation rows are dicts of Annotation columns
+    without image_id. on_batch is called with the writer after each batch is
+    inserted, inside the batch's transaction, so bookkeeping it does is
+    committed together with the rows.
+    """
+
+    def __init__(self, batch_size=IMAGE_BATCH_SIZE, on_batch=None):
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.pending = []
+        self.ids = {}
+        self.images_written = 0
+        self.annotations_written = 0
+
+    def add(self, key, image_row, annotations=None):
+        self.pending.append((key, image_row, annotations or []))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Insert and commit everything buffered so far"""
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        # One background writer at a time; the batch is a single short transaction
+        with serialized_write():
+            # Anything added through the ORM (e.g. status changes) goes out in the same transaction
+            db.session.flush()
+            image_rows = []
+            blobs = []
+            for _, row, _ in batch:
+                row = dict(row)
+                blobs.append((row['content_hash'], row['filepath'], row.pop('size', None)))
+                original = row.pop('original', None)
+                if original:
+                    row['original_hash'] = original[0]
+                    blobs.append(original)
+                image_rows.append(row)
+
+            image_ids = insert_images(image_rows)
+            acquire_blobs(blobs)
+            annotation_rows = [
+                {**annotation, 'image_id': image_id}
+                for (_, _, annotations), image_id in zip(batch, image_ids)
+                for annotation in annotations
+            ]
+            insert_annotations(annotation_rows)
+
+            for (key, _, _), image_id in zip(batch, image_ids):
+                self.ids[key] = image_id
+            self.images_written += len(batch)
+            self.annotations_written += len(annotation_rows)
+            if self.on_batch:
+                self.on_batch(self)
+            db.session.commit()
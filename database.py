@@ -1,4 +1,71 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from contextlib import contextmanager
+import threading
 
 db = SQLAlchemy()
 
+# Background threads (training, ingest, imports) write one at a time on SQLite
+_write_lock = threading.RLock()
+_serialize_writes = True
+
+
+def configure_sqlite(app):
+    """
+    Apply the SQLITE_* settings to every new connection of the app's engine
+
+    WAL lets readers (the annotate page, the early-stop check) run alongside
+    the single writer, and the busy timeout makes writers wait for the lock
+    instead of failing with 'database is locked'.
+    """
+    global _serialize_writes
+
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        # Server databases lock rows, not the whole file, so background writers needn't queue
+        _serialize_writes = False
+        return
+
+    pragmas = {
+        'journal_mode': app.config['SQLITE_JOURNAL_MODE'],
+        'busy_timeout': app.config['SQLITE_BUSY_TIMEOUT_MS'],
+        'synchronous': app.config['SQLITE_SYNCHRONOUS'],
+        # Negative sizes are KiB rather than pages
+        'cache_size': -app.config['SQLITE_CACHE_SIZE_KB'],
+        'temp_store': 'MEMORY'
+    }
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+@contextmanager
+def serialized_write():
+    """
+    Hold the background write lock across a write transaction
+
+    Usage:
+        with serialized_write():
+            ... inserts and updates ...
+            db.session.commit()
+
+    Background writers queue on this lock instead of all polling SQLite's
+    busy timeout, so a request handler never waits behind more than one of
+    their transactions at a time.
+    """
+    if not _serialize_writes:
+        yield
+        return
+    with _write_lock:
+        yield
+
+
+def serialized_commit():
+    """Commit the session's pending changes through the background write lock"""
+    with serialized_write():
+        db.session.commit()
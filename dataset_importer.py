@@ -0,0 +1,306 @@
+"""
+Local dataset importer for FreeFlow
+Imports a YOLO, COCO or Pascal VOC dataset from a folder on the server (e.g. a
+mounted volume) as a background ingest job: images are hardlinked (or copied)
+into the blob store in parallel, dataset classes are mapped onto the
+project's classes and images and annotations are bulk-inserted
+"""
+
+import os
+import posixpath
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from flask import current_app
+from database import db, serialized_commit, serialized_write
+from models import Project, Image, IngestJob
+from image_normalize import ingest_policy, store_normalized
+from near_duplicates import safe_dhash
+from bulk_insert import ImageBatchWriter
+from image_probe import probe_file, ImageProbeError
+from ingest import emit_ingest_progress
+from label_formats import (YOLO_CLASS_FILES, parse_yolo_labels, parse_yolo_class_names,
+                           yolo_label_candidates, parse_coco, parse_voc, voc_labels,
+                           resolve_class_ids, annotation_row)
+
+DATASET_FORMATS = ('auto', 'yolo', 'coco', 'voc')
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff')
+# Folders that never hold dataset files
+SKIP_DIRS = {'__MACOSX', '.git', '.cache'}
+
+# Images per committed batch
+IMPORT_BATCH_SIZE = 500
+
+
+class DatasetImportError(Exception):
+    """The requested folder can't be imported; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def import_roots():
+    """Folders datasets may be imported from, from DATASET_IMPORT_ROOTS"""
+    configured = current_app.config.get('DATASET_IMPORT_ROOTS') or ''
+    return [os.path.realpath(entry.strip()) for entry in configured.split(',') if entry.strip()]
+
+
+def resolve_dataset_dir(path):
+    """
+    Resolve a requested dataset folder, checking it lies inside an import root
+
+    Raises:
+        DatasetImportError: local import is disabled, or the folder is outside
+                            the roots or doesn't exist
+    """
+    roots = import_roots()
+    if not roots:
+        raise DatasetImportError('Local dataset import is disabled (set DATASET_IMPORT_ROOTS)', status=403)
+
+    resolved = os.path.realpath(path)
+    if not any(os.path.commonpath([resolved, root]) == root for root in roots):
+        raise DatasetImportError(f'{path} is not inside an allowed import folder', status=403)
+    if not os.path.isdir(resolved):
+        raise DatasetImportError(f'{path} is not a folder')
+    return resolved
+
+
+def scan_dataset(dataset_dir, dataset_format='auto'):
+    """
+    Find a dataset's images and label files in one walk of the folder
+
+    Returns:
+        Dict with 'images' (relative POSIX paths), 'labels' (relative paths of
+        .txt label files), 'yolo_names' (class names by index), 'yolo_indices'
+        (class indices the YOLO labels use), 'coco' ((categories, labels by
+        basename) or None) and 'voc' (labels by image basename, with pixel
+        boxes and the size from the XML)
+    """
+    images, label_paths, yaml_files, json_files, xml_files = [], set(), [], [], []
+    for root, dirs, files in os.walk(dataset_dir):
+        dirs[:] = sorted(d for d in dirs if d not in SKIP_DIRS and not d.startswith('.'))
+        rel_root = os.path.relpath(root, dataset_dir).replace(os.sep, '/')
+        rel_root = '' if rel_root == '.' else rel_root + '/'
+        for name in sorted(files):
+            rel = rel_root + name
+            lower = name.lower()
+            if name.startswith('.'):
+                continue
+            if lower.endswith(IMAGE_SUFFIXES):
+                images.append(rel)
+            elif lower in YOLO_CLASS_FILES:
+                yaml_files.append(rel)
+            elif lower.endswith('.txt'):
+                label_paths.add(rel)
+            elif lower.endswith('.json'):
+                json_files.append(rel)
+            elif lower.endswith('.xml'):
+                xml_files.append(rel)
+
+    scan = {'images': images, 'labels': set(), 'yolo_names': {}, 'yolo_indices': set(), 'coco': None, 'voc': {}}
+
+    if dataset_format in ('auto', 'yolo'):
+        scan['labels'] = label_paths
+        # Shallowest names file wins, data.yaml before classes.txt
+        for rel in sorted(yaml_files, key=lambda r: (r.count('/'), YOLO_CLASS_FILES.index(posixpath.basename(r).lower()))):
+            with open(os.path.join(dataset_dir, rel), 'r', errors='replace') as f:
+                names = parse_yolo_class_names(rel, f.read())
+            if names:
+                scan['yolo_names'] = dict(enumerate(names))
+                break
+        # Indices missing from the names file get a class too; finding them now lets every class be created up front
+        for rel in images:
+            for candidate in yolo_label_candidates(rel):
+                if candidate in label_paths:
+                    with open(os.path.join(dataset_dir, candidate), 'r', errors='replace') as f:
+                        scan['yolo_indices'].update(label[0] for label in parse_yolo_labels(f.read()))
+                    break
+
+    if dataset_format in ('auto', 'coco'):
+        categories, labels = {}, {}
+        for rel in json_files:
+            with open(os.path.join(dataset_dir, rel), 'r', errors='replace') as f:
+                parsed = parse_coco(f.read())
+            if parsed:
+                categories.update(parsed[0])
+                for key, image_labels in parsed[1].items():
+                    labels.setdefault(key, []).extend(image_labels)
+        if categories:
+            scan['coco'] = (categories, labels)
+
+    if dataset_format in ('auto', 'voc'):
+        for rel in xml_files:
+            try:
+                with open(os.path.join(dataset_dir, rel), 'r', errors='replace') as f:
+                    filename, width, height, objects = parse_voc(f.read())
+            except Exception as e:
+                print(f"⚠️ Skipping {rel}: {e}")
+                continue
+            # VOC files name their image; fall back to the XML's own stem
+            key = posixpath.basename(filename) or posixpath.splitext(posixpath.basename(rel))[0]
+            scan['voc'][key] = (width, height, objects)
+
+    return scan
+
+
+def _read_labels(dataset_dir, rel, scan):
+    """Labels for one image as (format, [(dataset class key, box..., polygon)])"""
+    for candidate in yolo_label_candidates(rel):
+        if candidate in scan['labels']:
+            with open(os.path.join(dataset_dir, candidate), 'r', errors='replace') as f:
+                return 'yolo', parse_yolo_labels(f.read())
+
+    basename = posixpath.basename(rel)
+    if scan['coco'] and basename in scan['coco'][1]:
+        return 'coco', scan['coco'][1][basename]
+
+    voc = scan['voc'].get(basename) or scan['voc'].get(posixpath.splitext(basename)[0])
+    if voc:
+        return 'voc', voc
+    return None, []
+
+
+def _import_one(app, dataset_dir, rel, scan, policy):
+    """Hash, probe and link (or normalize) one image into the blob store and read its labels (runs on a pool thread)"""
+    path = os.path.join(dataset_dir, rel)
+    try:
+        probe = probe_file(path)
+        with app.app_context():
+            stored = store_normalized(path, rel, probe, policy, link=True)
+        stored['dhash'] = safe_dhash(path)
+        fmt, labels = _read_labels(dataset_dir, rel, scan)
+        if fmt == 'voc':
+            # VOC boxes are in the pixels of the file as it was labelled
+            width, height, objects = labels
+            labels = voc_labels(objects, width or probe['width'], height or probe['height'])
+        return rel, stored, fmt, labels, None
+    except ImageProbeError as e:
+        return rel, None, None, None, str(e)
+    except Exception as e:
+        return rel, None, None, None, f"Could not import: {e}"
+
+
+def create_dataset_import_job(project_id, socket_id=None):
+    """Record a queued IngestJob for a local dataset import (caller commits)"""
+    job = IngestJob(
+        project_id=project_id,
+        batch_id=str(uuid.uuid4()),
+        status='queued',
+        socket_id=socket_id,
+        total_files=0
+    )
+    db.session.add(job)
+    return job
+
+
+def run_dataset_import(app, socketio, job_id, dataset_dir, dataset_format='auto'):
+    """Import a local dataset folder into the job's project"""
+    with app.app_context():
+        job = IngestJob.query.get(job_id)
+        project = Project.query.get(job.project_id)
+        print(f"📂 Importing local dataset {dataset_dir} ({dataset_format}) into project {project.id}")
+
+        try:
+            job.status = 'processing'
+            job.started_at = datetime.utcnow()
+            scan = scan_dataset(dataset_dir, dataset_format)
+            job.total_files = len(scan['images'])
+            serialized_commit()
+            emit_ingest_progress(socketio, job)
+
+            # Every class is known from the scan; VOC names come from the XML objects, and YOLO
+            # indices without a names entry fall back to generic class names
+            yolo_names = {idx: f"class_{idx}" for idx in scan['yolo_indices']}
+            yolo_names.update(scan['yolo_names'])
+            with serialized_write():
+                class_ids = {
+                    'yolo': resolve_class_ids(project, yolo_names),
+                    'coco': resolve_class_ids(project, scan['coco'][0]) if scan['coco'] else {},
+                    'voc': resolve_class_ids(project, {
+                        obj[0]: obj[0] for _, _, objects in scan['voc'].values() for obj in objects
+                    })
+                }
+                db.session.commit()
+
+            def report(writer):
+                job.processed_files = writer.images_written
+                job.images_created = writer.images_written
+                emit_ingest_progress(socketio, job, annotations=writer.annotations_written)
+
+            writer = ImageBatchWriter(batch_size=IMPORT_BATCH_SIZE, on_batch=report)
+            failed = 0
+
+            def record(result):
+                nonlocal failed
+                rel, stored, fmt, labels, error = result
+                if error:
+                    print(f"⚠️ Skipping {rel}: {error}")
+                    failed += 1
+                    job.failed_files = failed
+                    return
+
+                annotations = []
+                for label in labels:
+                    class_id = class_ids[fmt].get(label[0])
+                    if class_id:
+                        annotations.append(annotation_row(class_id, label))
+
+                row = {
+                    'filename': rel[:500],
+                    'filepath': stored['filepath'],
+                    'content_hash': stored['content_hash'],
+                    'size': stored['size'],
+                    'width': stored['width'],
+                    'height': stored['height'],
+                    'original': stored['original'],
+                    'dhash': stored['dhash'],
+                    'batch_id': job.batch_id,
+                    'project_id': project.id
+                }
+                if annotations:
+                    row['status'] = 'completed'
+                writer.add(rel, row, annotations)
+                # Ids aren't needed afterwards; don't keep 50k of them around
+                writer.ids.clear()
+
+            policy = ingest_policy(project)
+            workers = current_app.config.get('INGEST_WORKERS', 4)
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for rel in scan['images']:
+                    pending.append(executor.submit(_import_one, app, dataset_dir, rel, scan, policy))
+                    while len(pending) > workers * 4:
+                        record(pending.popleft().result())
+                while pending:
+                    record(pending.popleft().result())
+            writer.flush()
+
+            job.processed_files = writer.images_written
+            job.images_created = writer.images_written
+            job.failed_files = failed
+            job.status = 'completed' if not failed else ('completed_with_errors' if writer.images_written else 'failed')
+            job.completed_at = datetime.utcnow()
+            project.updated_at = datetime.utcnow()
+            serialized_commit()
+
+            if not project.thumbnail_image_id and not project.thumbnail_path:
+                first_image = Image.query.filter_by(project_id=project.id).order_by(Image.id).first()
+                if first_image:
+                    project.thumbnail_image_id = first_image.id
+                    serialized_commit()
+
+            print(f"✅ Local import #{job.id}: {writer.images_written} images, "
+                  f"{writer.annotations_written} annotations, {failed} skipped")
+        except Exception as e:
+            print(f"❌ Local import #{job_id} failed: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.completed_at = datetime.utcnow()
+            serialized_commit()
+
+        emit_ingest_progress(socketio, job)
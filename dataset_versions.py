@@ -0,0 +1,63 @@
+"""
+Dataset version membership for FreeFlow
+Which images are in a dataset version, and in which split, is stored one
+row per image in DatasetVersionImage rather than as JSON id lists, so a
+split is materialized with one joined query and the versions that contain
+an image are found through an index.
+"""
+
+from sqlalchemy import insert
+from database import db
+from models import Image, DatasetVersionImage
+
+SPLITS = ('train', 'val', 'test')
+# Membership rows per executemany call
+INSERT_BATCH_SIZE = 5000
+
+
+def add_version_images(version, splits):
+    """
+    Record a version's image assignments and its split counts
+
+    Args:
+        version: DatasetVersion (flushed, so it has an id)
+        splits: {split: [image ids]}; an image listed twice keeps its first split
+
+    Returns:
+        {split: count}
+    """
+    rows = {}
+    for split in SPLITS:
+        for image_id in splits.get(split, []):
+            rows.setdefault(image_id, {'version_id': version.id, 'image_id': image_id, 'split': split})
+    rows = list(rows.values())
+
+    for start in range(0, len(rows), INSERT_BATCH_SIZE):
+        db.session.execute(insert(DatasetVersionImage), rows[start:start + INSERT_BATCH_SIZE])
+
+    counts = {split: 0 for split in SPLITS}
+    for row in rows:
+        counts[row['split']] += 1
+    version.train_count = counts['train']
+    version.val_count = counts['val']
+    version.test_count = counts['test']
+    return counts
+
+
+def version_splits(version_id):
+    """{split: [image ids]} of a version, in image id order"""
+    splits = {split: [] for split in SPLITS}
+    rows = db.session.query(DatasetVersionImage.split, DatasetVersionImage.image_id).filter(
+        DatasetVersionImage.version_id == version_id
+    ).order_by(DatasetVersionImage.image_id)
+    for split, image_id in rows:
+        splits.setdefault(split, []).append(image_id)
+    return splits
+
+
+def split_images(version_id, split):
+    """Images in one split of a version, with their annotations loaded"""
+    return Image.query.join(DatasetVersionImage, DatasetVersionImage.image_id == Image.id).filter(
+        DatasetVersionImage.version_id == version_id,
+        DatasetVersionImage.split == split
+    ).options(db.selectinload(Image.annotations)).order_by(Image.id).all()
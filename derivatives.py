@@ -0,0 +1,395 @@
+"""
+Image derivatives for FreeFlow
+Generates and caches deep-zoom (DZI-style) tile pyramids for very large images,
+display-resolution copies for the annotate canvas, grid thumbnails and packed
+thumbnail sprites
+"""
+
+import os
+import json
+import math
+import glob
+import hashlib
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from PIL import Image as PILImage, ImageOps
+from file_serving import image_version
+
+TILE_SIZE = 256
+TILE_FORMAT = 'jpg'
+TILE_QUALITY = 85
+
+THUMBNAIL_MAX_SIDE = 320
+THUMBNAIL_QUALITY = 80
+
+DISPLAY_QUALITY = 90
+
+# Sprites are packed into shelves no wider than this
+SPRITE_MAX_WIDTH = 2048
+SPRITE_QUALITY = 80
+# Oldest sprites are pruned once the cache holds more than this many
+SPRITE_CACHE_LIMIT = 500
+
+# Bumped when derivatives are rendered differently, so cached copies (and the
+# immutable URLs pointing at them) are replaced; 2 = EXIF orientation applied
+DERIVATIVE_REVISION = 2
+
+# Marker written once a pyramid is complete, so half-written pyramids are never served
+PYRAMID_COMPLETE_MARKER = '.complete'
+
+# Striped locks by image and derivative kind, so concurrent requests don't generate
+# the same derivative twice or clear a folder another request is writing into. A
+# fixed set keeps memory flat however many images are served; derivatives that
+# share a stripe only wait for each other, since no caller holds two at once
+DERIVATIVE_LOCK_STRIPES = 64
+_derivative_locks = [threading.Lock() for _ in range(DERIVATIVE_LOCK_STRIPES)]
+
+
+def _derivative_lock(kind, image_id):
+    return _derivative_locks[hash((kind, image_id)) % DERIVATIVE_LOCK_STRIPES]
+
+
+def derivative_version(image):
+    """Version token of an image's derivatives: its file version plus the rendering revision"""
+    return f"{image_version(image)}-r{DERIVATIVE_REVISION}"
+
+
+def derivatives_root():
+    """Root folder for all cached derivatives"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'derivatives')
+
+
+def needs_tiles(image):
+    """Whether an image is large enough to be served as a tile pyramid"""
+    min_side = current_app.config.get('TILE_PYRAMID_MIN_SIDE', 4096)
+    return max(image.width or 0, image.height or 0) > min_side
+
+
+def pyramid_levels(width, height, tile_size=TILE_SIZE):
+    """
+    Describe every level of a DZI pyramid
+
+    Level 0 is 1x1 pixel and the top level is the full-resolution image;
+    each level is half the size of the next one (rounded up).
+    """
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    levels = []
+    for level in range(max_level + 1):
+        factor = 2 ** (max_level - level)
+        level_width = max(1, math.ceil(width / factor))
+        level_height = max(1, math.ceil(height / factor))
+        levels.append({
+            'level': level,
+            'width': level_width,
+            'height': level_height,
+            'cols': math.ceil(level_width / tile_size),
+            'rows': math.ceil(level_height / tile_size)
+        })
+    return levels
+
+
+def tile_descriptor(image):
+    """Describe an image's tile pyramid for the annotate canvas"""
+    levels = pyramid_levels(image.width, image.height)
+    return {
+        'image_id': image.id,
+        'width': image.width,
+        'height': image.height,
+        'tile_size': TILE_SIZE,
+        'overlap': 0,
+        'format': TILE_FORMAT,
+        'max_level': len(levels) - 1,
+        'levels': levels,
+        'version': derivative_version(image),
+        'url': f'/api/images/{image.id}/tiles/{{level}}/{{col}}_{{row}}.{TILE_FORMAT}'
+    }
+
+
+def tile_pyramid_dir(image):
+    """Folder holding an image's pyramid, keyed by the image version"""
+    return os.path.join(derivatives_root(), 'tiles', str(image.id), derivative_version(image))
+
+
+def tile_path(image, level, col, row):
+    """Path of a single tile inside the image's pyramid"""
+    return os.path.join(tile_pyramid_dir(image), str(level), f'{col}_{row}.{TILE_FORMAT}')
+
+
+def generate_tile_pyramid(source_path, output_dir):
+    """
+    Render every tile of the pyramid for source_path into output_dir
+
+    The source is decoded once and turned upright by its EXIF orientation, so
+    the levels follow the displayed size (Image.width/height) that annotations
+    are drawn against. Each lower level is downsampled from the level above
+    it, so the cost is roughly one full decode plus 4/3 of the pixels in
+    resampling.
+    """
+    # Write into a scratch folder and rename at the end so readers never see partial pyramids
+    temp_dir = f"{output_dir}.tmp-{uuid.uuid4().hex[:8]}"
+    os.makedirs(temp_dir, exist_ok=True)
+
+    try:
+        with PILImage.open(source_path) as img:
+            upright = ImageOps.exif_transpose(img)
+        # Both of these copy the full-size pixels; don't pay for a third copy on RGB sources
+        current = upright if upright.mode == 'RGB' else upright.convert('RGB')
+        levels = pyramid_levels(*current.size)
+
+        for info in reversed(levels):
+            size = (info['width'], info['height'])
+            if current.size != size:
+                current = current.resize(size, PILImage.Resampling.LANCZOS)
+
+            level_dir = os.path.join(temp_dir, str(info['level']))
+            os.makedirs(level_dir, exist_ok=True)
+
+            for row in range(info['rows']):
+                for col in range(info['cols']):
+                    box = (
+                        col * TILE_SIZE,
+                        row * TILE_SIZE,
+                        min((col + 1) * TILE_SIZE, info['width']),
+                        min((row + 1) * TILE_SIZE, info['height'])
+                    )
+                    current.crop(box).save(
+                        os.path.join(level_dir, f'{col}_{row}.{TILE_FORMAT}'),
+                        'JPEG',
+                        quality=TILE_QUALITY
+                    )
+
+        open(os.path.join(temp_dir, PYRAMID_COMPLETE_MARKER), 'w').close()
+
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(os.path.dirname(output_dir), exist_ok=True)
+        os.replace(temp_dir, output_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def ensure_tile_pyramid(image):
+    """Generate the image's tile pyramid if it is not cached yet and return its folder"""
+    output_dir = tile_pyramid_dir(image)
+    marker = os.path.join(output_dir, PYRAMID_COMPLETE_MARKER)
+    if os.path.exists(marker):
+        return output_dir
+
+    with _derivative_lock('tiles', image.id):
+        if not os.path.exists(marker):
+            print(f"🧩 Generating tile pyramid for image {image.id} ({image.width}x{image.height})")
+            # Drop pyramids built from an older version of the file
+            image_tiles_root = os.path.dirname(output_dir)
+            if os.path.exists(image_tiles_root):
+                shutil.rmtree(image_tiles_root, ignore_errors=True)
+            generate_tile_pyramid(image.filepath, output_dir)
+            print(f"✅ Tile pyramid ready for image {image.id}")
+
+    return output_dir
+
+
+def generate_tiles_in_background(app, image_ids):
+    """Pre-generate tile pyramids for newly ingested large images"""
+    def worker():
+        from models import Image
+        with app.app_context():
+            for image_id in image_ids:
+                image = Image.query.get(image_id)
+                if not image or not needs_tiles(image) or not os.path.exists(image.filepath):
+                    continue
+                try:
+                    ensure_tile_pyramid(image)
+                except Exception as e:
+                    print(f"⚠️ Tile generation failed for image {image_id}: {e}")
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+
+
+def thumbnail_path(image):
+    """Path of an image's cached grid thumbnail, keyed by the image version"""
+    return os.path.join(derivatives_root(), 'thumbs', str(image.id), f'{derivative_version(image)}.jpg')
+
+
+def generate_thumbnail(source_path, output_path, max_side=THUMBNAIL_MAX_SIDE, quality=THUMBNAIL_QUALITY):
+    """Render a downscaled, upright JPEG whose longest side is at most max_side"""
+    with PILImage.open(source_path) as img:
+        # Let the JPEG decoder downscale while decoding instead of decoding full size
+        # (the bound is square, so it holds whichever way the image is turned)
+        img.draft('RGB', (max_side, max_side))
+        # Browsers show the original turned by its EXIF orientation; derivatives must match it
+        img = ImageOps.exif_transpose(img)
+        img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), PILImage.Resampling.LANCZOS)
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        temp_path = f"{output_path}.tmp-{uuid.uuid4().hex[:8]}"
+        img.save(temp_path, 'JPEG', quality=quality)
+        os.replace(temp_path, output_path)
+
+
+def _refresh_thumbnail(kind, image_id, source_path, path, max_side=THUMBNAIL_MAX_SIDE, quality=THUMBNAIL_QUALITY):
+    """Generate a thumbnail, dropping thumbnails built from older versions of the file"""
+    with _derivative_lock(kind, image_id):
+        if os.path.exists(path):
+            return
+        image_thumbs_dir = os.path.dirname(path)
+        if os.path.exists(image_thumbs_dir):
+            shutil.rmtree(image_thumbs_dir, ignore_errors=True)
+        generate_thumbnail(source_path, path, max_side, quality)
+
+
+def ensure_thumbnail(image):
+    """Generate the image's grid thumbnail if it is not cached yet and return its path"""
+    path = thumbnail_path(image)
+    if not os.path.exists(path):
+        _refresh_thumbnail('thumbs', image.id, image.filepath, path)
+    return path
+
+
+def display_max_side():
+    """Longest side of the images drawn on the annotate canvas"""
+    return current_app.config.get('DISPLAY_MAX_SIDE', 2048)
+
+
+def needs_display_derivative(image):
+    """Whether an image is larger than the display resolution"""
+    return max(image.width or 0, image.height or 0) > display_max_side()
+
+
+def display_version(image):
+    """Version token of the image served to the annotate canvas"""
+    if needs_display_derivative(image):
+        return f"{derivative_version(image)}-d{display_max_side()}"
+    return image_version(image)
+
+
+def display_path(image):
+    """Path of an image's cached display-resolution copy"""
+    return os.path.join(
+        derivatives_root(), 'display', str(image.id),
+        f'{derivative_version(image)}-{display_max_side()}.jpg'
+    )
+
+
+def ensure_display_image(image):
+    """
+    Return the file to draw on the annotate canvas
+
+    Images within DISPLAY_MAX_SIDE are served as they are; larger ones get a
+    cached downscaled copy. Annotations are stored normalized, so they line
+    up with either.
+    """
+    if not needs_display_derivative(image):
+        return image.filepath
+
+    path = display_path(image)
+    if not os.path.exists(path):
+        _refresh_thumbnail('display', image.id, image.filepath, path, display_max_side(), DISPLAY_QUALITY)
+    return path
+
+
+def sprite_key(images):
+    """Cache key for a sprite: the ordered image ids and their derivative versions"""
+    parts = [f"{img.id}:{derivative_version(img)}" for img in images]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def sprite_paths(key):
+    """Paths of a sprite image and its JSON offset index"""
+    sprites_dir = os.path.join(derivatives_root(), 'sprites')
+    return os.path.join(sprites_dir, f'{key}.jpg'), os.path.join(sprites_dir, f'{key}.json')
+
+
+def _prune_sprites():
+    """Keep the sprite cache bounded by deleting the least recently built sprites"""
+    sprite_files = glob.glob(os.path.join(derivatives_root(), 'sprites', '*.json'))
+    if len(sprite_files) <= SPRITE_CACHE_LIMIT:
+        return
+    sprite_files.sort(key=os.path.getmtime)
+    for index_path in sprite_files[:len(sprite_files) - SPRITE_CACHE_LIMIT]:
+        for path in (index_path, index_path[:-len('.json')] + '.jpg'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def build_sprite(images):
+    """
+    Pack the thumbnails of images into one sprite and return its offset index
+
+    Thumbnails are placed left to right in shelves; the index maps each
+    image id to the x, y, width and height of its thumbnail in the sprite.
+    Sprites are cached by the ordered image ids and file versions, so an
+    unchanged grid page is served straight from disk.
+    """
+    key = sprite_key(images)
+    sprite_path, index_path = sprite_paths(key)
+
+    if os.path.exists(sprite_path) and os.path.exists(index_path):
+        with open(index_path, 'r') as f:
+            return json.load(f)
+
+    # Generate missing thumbnails in parallel - PIL releases the GIL while decoding
+    thumb_paths = [thumbnail_path(image) for image in images]
+    missing = [('thumbs', image.id, image.filepath, path) for image, path in zip(images, thumb_paths) if not os.path.exists(path)]
+    if missing:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda job: _refresh_thumbnail(*job), missing))
+
+    thumbs = []
+    for image, path in zip(images, thumb_paths):
+        with PILImage.open(path) as thumb:
+            thumb.load()
+            thumbs.append((image.id, thumb.copy()))
+
+    # Shelf packing
+    offsets = {}
+    x = y = shelf_height = sprite_width = 0
+    for image_id, thumb in thumbs:
+        w, h = thumb.size
+        if x > 0 and x + w > SPRITE_MAX_WIDTH:
+            x = 0
+            y += shelf_height
+            shelf_height = 0
+        offsets[image_id] = {'x': x, 'y': y, 'width': w, 'height': h}
+        x += w
+        shelf_height = max(shelf_height, h)
+        sprite_width = max(sprite_width, x)
+    sprite_height = y + shelf_height
+
+    sprite = PILImage.new('RGB', (max(sprite_width, 1), max(sprite_height, 1)), (255, 255, 255))
+    for image_id, thumb in thumbs:
+        offset = offsets[image_id]
+        sprite.paste(thumb, (offset['x'], offset['y']))
+
+    index = {
+        'key': key,
+        'width': sprite.width,
+        'height': sprite.height,
+        'images': {str(image_id): offset for image_id, offset in offsets.items()}
+    }
+
+    os.makedirs(os.path.dirname(sprite_path), exist_ok=True)
+    temp_path = f"{sprite_path}.tmp-{uuid.uuid4().hex[:8]}"
+    sprite.save(temp_path, 'JPEG', quality=SPRITE_QUALITY)
+    os.replace(temp_path, sprite_path)
+    with open(index_path, 'w') as f:
+        json.dump(index, f)
+
+    _prune_sprites()
+    return index
+
+
+def remove_image_derivatives(image_id):
+    """Delete every cached derivative of an image"""
+    for kind in ('tiles', 'thumbs', 'display'):
+        derivative_dir = os.path.join(derivatives_root(), kind, str(image_id))
+        with _derivative_lock(kind, image_id):
+            if os.path.exists(derivative_dir):
+                shutil.rmtree(derivative_dir, ignore_errors=True)
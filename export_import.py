@@ -13,6 +13,10 @@ from zipfile import ZipFile, ZIP_DEFLATED
 from flask import current_app
 from database import db
 from models import Project, Class, Image, Annotation, DatasetVersion, TrainingJob, CustomModel
+from blob_store import store_file, acquire_blob
+from pdf_pages import ensure_image_file
+from polygon_codec import encode_polygon, decode_polygon
+from dataset_versions import add_version_images, version_splits
 
 
 def serialize_model(model):
@@ -80,17 +84,21 @@ def export_projects(project_ids):
             for img in project.images:
                 project_data['images'].append(serialize_model(img))
                 
-                # Copy image file
-                if os.path.exists(img.filepath):
+                # Copy image file (lazy PDF pages are rendered for the export)
+                if ensure_image_file(img):
                     rel_path = f'project_{project_id}/images/{os.path.basename(img.filepath)}'
                     dest_path = files_dir / rel_path
                     dest_path.parent.mkdir(parents=True, exist_ok=True)
                     shutil.copy2(img.filepath, dest_path)
                     project_data['files']['images'].append(rel_path)
                 
-                # Export annotations for this image
-                for ann in img.annotations:
-                    project_data['annotations'].append(serialize_model(ann))
+                # Export annotations for this image (polygons as JSON, as in older exports)
+                annotations = Annotation.query.options(db.undefer(Annotation.polygon_data)).filter_by(image_id=img.id)
+                for ann in annotations:
+                    ann_data = serialize_model(ann)
+                    polygon = decode_polygon(ann_data.pop('polygon_data'))
+                    ann_data['polygon_points'] = json.dumps(polygon) if polygon else None
+                    project_data['annotations'].append(ann_data)
             
             # Copy thumbnail if exists
             if project.thumbnail_path and os.path.exists(project.thumbnail_path):
@@ -102,7 +110,10 @@ def export_projects(project_ids):
             
             # Export dataset versions
             for ds in project.dataset_versions:
-                project_data['dataset_versions'].append(serialize_model(ds))
+                # Splits as JSON id lists, as in older exports
+                ds_data = serialize_model(ds)
+                ds_data['image_splits'] = json.dumps(version_splits(ds.id))
+                project_data['dataset_versions'].append(ds_data)
                 
                 # Copy dataset files if they exist
                 dataset_dir = Path('datasets') / str(project_id) / f'job_{ds.id}'
@@ -272,18 +283,22 @@ def import_projects(zip_path, merge_strategy='rename'):
                 del img_dict['id']
                 img_dict['project_id'] = new_project_id
                 
-                # Update file path
+                # Move image file into the blob store (re-imports of the same export are deduplicated)
                 old_filepath = img_dict['filepath']
-                new_filepath = upload_folder / str(new_project_id) / os.path.basename(old_filepath)
-                new_filepath.parent.mkdir(parents=True, exist_ok=True)
-                
-                # Copy image file
                 old_rel_path = f'project_{old_project_id}/images/{os.path.basename(old_filepath)}'
                 source_path = files_dir / old_rel_path
                 if source_path.exists():
-                    shutil.copy2(source_path, new_filepath)
-                
-                img_dict['filepath'] = str(new_filepath)
+                    content_hash, new_filepath, size = store_file(str(source_path), move=True)
+                    acquire_blob(content_hash, new_filepath, size)
+                    img_dict['filepath'] = new_filepath
+                    img_dict['content_hash'] = content_hash
+                else:
+                    img_dict['filepath'] = str(upload_folder / str(new_project_id) / os.path.basename(old_filepath))
+                    img_dict['content_hash'] = None
+                # Kept originals and source PDFs aren't exported; the image file stands on its own
+                img_dict['original_hash'] = None
+                img_dict['source_hash'] = None
+                img_dict['page_index'] = None
                 
                 # Convert datetime
                 if 'uploaded_at' in img_dict:
@@ -305,6 +320,9 @@ def import_projects(zip_path, merge_strategy='rename'):
                 if 'created_at' in ann_dict:
                     ann_dict['created_at'] = datetime.fromisoformat(ann_dict['created_at'])
                 
+                polygon_points = ann_dict.pop('polygon_points', None)
+                ann_dict['polygon_data'] = encode_polygon(json.loads(polygon_points)) if polygon_points else None
+                
                 new_annotation = Annotation(**ann_dict)
                 db.session.add(new_annotation)
             
@@ -316,16 +334,14 @@ def import_projects(zip_path, merge_strategy='rename'):
                 ds_dict['project_id'] = new_project_id
                 
                 # Update image IDs in splits
-                if 'image_splits' in ds_dict:
-                    splits = json.loads(ds_dict['image_splits'])
-                    for split_type in ['train', 'val', 'test']:
-                        if split_type in splits:
-                            splits[split_type] = [
-                                id_mappings['images'].get(img_id, img_id) 
-                                for img_id in splits[split_type]
-                                if img_id in id_mappings['images']
-                            ]
-                    ds_dict['image_splits'] = json.dumps(splits)
+                splits = json.loads(ds_dict.pop('image_splits', None) or '{}')
+                for split_type in ['train', 'val', 'test']:
+                    if split_type in splits:
+                        splits[split_type] = [
+                            id_mappings['images'][img_id]
+                            for img_id in splits[split_type]
+                            if img_id in id_mappings['images']
+                        ]
                 
                 # Convert datetime
                 if 'created_at' in ds_dict:
@@ -334,6 +350,7 @@ def import_projects(zip_path, merge_strategy='rename'):
                 new_ds = DatasetVersion(**ds_dict)
                 db.session.add(new_ds)
                 db.session.flush()
+                add_version_images(new_ds, splits)
                 id_mappings['dataset_versions'][old_ds_id] = new_ds.id
                 
                 # Copy dataset files
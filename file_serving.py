@@ -0,0 +1,169 @@
+"""
+File delivery helpers for FreeFlow
+Serves images, models and training artifacts with HTTP caching validators,
+conditional requests (304 Not Modified) and byte-range support.
+
+Behind nginx or Apache the bytes can be handed off to the proxy with
+X-Accel-Redirect / X-Sendfile, so the Python process only authorizes requests.
+"""
+
+import os
+import hashlib
+from urllib.parse import quote
+from flask import request, send_file, current_app
+from werkzeug.utils import send_file as werkzeug_send_file
+
+# One year - the longest max-age browsers honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+# FILE_DELIVERY_MODE values
+DELIVERY_DIRECT = 'direct'
+DELIVERY_X_SENDFILE = 'x-sendfile'
+DELIVERY_X_ACCEL = 'x-accel-redirect'
+
+# Internal nginx locations used when FILE_DELIVERY_ROOTS doesn't name one
+DEFAULT_ACCEL_PREFIX = '/_protected'
+
+
+def file_version(filepath):
+    """Return a short version token derived from a file's mtime and size"""
+    stat = os.stat(filepath)
+    return hashlib.sha1(f"{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest()[:16]
+
+
+def image_version(image):
+    """
+    Version token for an Image row
+
+    Content-addressed images use a prefix of their SHA-256, so the token
+    needs no filesystem access; legacy files fall back to mtime and size.
+    """
+    if image.content_hash:
+        return image.content_hash[:16]
+    if image.source_hash and image.page_index is not None:
+        # Lazily rendered PDF page: rendering is deterministic, so the PDF and page identify it
+        return f"{image.source_hash[:12]}-{image.page_index + 1}"
+    if os.path.exists(image.filepath):
+        return file_version(image.filepath)
+    return None
+
+
+def delivery_roots():
+    """
+    Folders the fronting proxy may serve, as (absolute path, internal URI prefix) pairs
+
+    Read from FILE_DELIVERY_ROOTS ("/srv/uploads=/_protected/uploads,/srv/runs");
+    a root without "=prefix" maps to /_protected/<folder name>. Defaults to the
+    upload folder and training_runs.
+    """
+    configured = current_app.config.get('FILE_DELIVERY_ROOTS') or ''
+    entries = [entry.strip() for entry in configured.split(',') if entry.strip()]
+    if not entries:
+        entries = [current_app.config['UPLOAD_FOLDER'], 'training_runs']
+
+    roots = []
+    for entry in entries:
+        path, _, prefix = entry.partition('=')
+        path = os.path.realpath(path.strip())
+        prefix = prefix.strip() or f"{DEFAULT_ACCEL_PREFIX}/{os.path.basename(path)}"
+        roots.append((path, prefix.rstrip('/')))
+    return roots
+
+
+def offload_target(filepath):
+    """
+    Resolve a file to (absolute path, internal URI) if a proxy may serve it
+
+    Returns None for files outside every whitelisted root, including paths
+    that escape a root through ``..`` or symlinks; those are sent directly.
+    """
+    real_path = os.path.realpath(filepath)
+    for root, prefix in delivery_roots():
+        if real_path.startswith(root + os.sep):
+            relative = os.path.relpath(real_path, root).replace(os.sep, '/')
+            return real_path, f"{prefix}/{quote(relative)}"
+    return None
+
+
+def _send_offloaded_file(target, mode, version, mimetype, as_attachment, download_name, max_age):
+    """Build a bodiless response that tells the proxy which file to send"""
+    real_path, internal_uri = target
+
+    response = werkzeug_send_file(
+        real_path,
+        request.environ,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name,
+        conditional=False,
+        etag=version,
+        max_age=max_age,
+        use_x_sendfile=True,
+        response_class=current_app.response_class,
+        _root_path=current_app.root_path
+    )
+
+    # 304/412 are answered here; byte ranges are left to the proxy
+    response = response.make_conditional(request.environ)
+    response.headers['Accept-Ranges'] = 'bytes'
+
+    if response.status_code != 200:
+        del response.headers['X-Sendfile']
+    elif mode == DELIVERY_X_ACCEL:
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = internal_uri
+
+    return response
+
+
+def send_cached_file(filepath, version=None, mimetype=None, as_attachment=False, download_name=None):
+    """
+    Send a file with a strong ETag, Last-Modified, 304 handling and Range support
+
+    Args:
+        filepath: Path of the file to send
+        version: Version token used as the ETag (defaults to file_version(filepath))
+        mimetype: Optional mimetype override
+        as_attachment: Send with Content-Disposition: attachment
+        download_name: Filename to suggest to the browser
+
+    If the request carries ``?v=<version>`` matching the current version, the URL
+    is content-addressed and the response is cached as immutable. Otherwise the
+    browser must revalidate, which costs a 304 instead of the full body.
+
+    With FILE_DELIVERY_MODE set to x-sendfile or x-accel-redirect, files under
+    a whitelisted root are handed to the proxy instead of being streamed.
+    Direct responses go through the server's wsgi.file_wrapper, which
+    gunicorn and most WSGI servers implement with the sendfile syscall.
+    """
+    if version is None:
+        version = file_version(filepath)
+
+    immutable = request.args.get('v') == version
+    max_age = IMMUTABLE_MAX_AGE if immutable else 0
+
+    mode = current_app.config.get('FILE_DELIVERY_MODE', DELIVERY_DIRECT)
+    target = offload_target(filepath) if mode in (DELIVERY_X_SENDFILE, DELIVERY_X_ACCEL) else None
+
+    if target:
+        response = _send_offloaded_file(target, mode, version, mimetype, as_attachment, download_name, max_age)
+    else:
+        response = send_file(
+            filepath,
+            mimetype=mimetype,
+            as_attachment=as_attachment,
+            download_name=download_name,
+            conditional=True,
+            etag=version,
+            max_age=max_age
+        )
+
+    # Project data may sit behind an authenticating proxy (private HF Spaces),
+    # so never let shared caches keep a copy
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.immutable = True
+
+    return response
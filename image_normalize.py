@@ -0,0 +1,189 @@
+"""
+Ingest-time image normalization for FreeFlow
+Applies a project's ingest policy (EXIF orientation, output format and
+quality, longest-side cap) before an image enters the blob store, optionally
+keeping the untouched original in cold storage
+"""
+
+import os
+import shutil
+import uuid
+from flask import current_app
+from PIL import Image as PILImage, ImageOps
+from models import Blob
+from blob_store import store_file, blobs_root, link_or_copy, pin_blob
+
+# Formats a policy may convert to, with the extension their blobs get
+OUTPUT_FORMATS = {'JPEG': '.jpg', 'PNG': '.png', 'WEBP': '.webp'}
+DEFAULT_QUALITY = 90
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def oriented_size(probe):
+    """(width, height) of a probed image as it is displayed, i.e. turned by its EXIF orientation"""
+    if (probe.get('orientation') or 1) in TRANSPOSED_ORIENTATIONS:
+        return probe['height'], probe['width']
+    return probe['width'], probe['height']
+
+
+def ingest_policy(project):
+    """
+    A project's ingest policy as a plain dict (safe to hand to worker threads)
+
+    Returns None when the project stores uploads as they are.
+    """
+    policy = {
+        'apply_orientation': bool(project.ingest_apply_orientation),
+        'format': project.ingest_format or None,
+        'quality': project.ingest_quality or DEFAULT_QUALITY,
+        'max_side': project.ingest_max_side or None,
+        'keep_originals': bool(project.ingest_keep_originals)
+    }
+    if not (policy['apply_orientation'] or policy['format'] or policy['max_side']):
+        return None
+    return policy
+
+
+def serialize_ingest_policy(project):
+    return {
+        'apply_orientation': bool(project.ingest_apply_orientation),
+        'format': project.ingest_format,
+        'quality': project.ingest_quality or DEFAULT_QUALITY,
+        'max_side': project.ingest_max_side,
+        'keep_originals': bool(project.ingest_keep_originals)
+    }
+
+
+def plan_normalization(policy, probe):
+    """
+    What has to change for a probed image to satisfy a policy
+
+    Decided from the header probe alone, so images that already comply are
+    stored without being decoded.
+
+    Returns:
+        Dict with rotate, transposed, resize, size (target width, height after
+        rotation) and format, or None to store the image as it is
+    """
+    if not policy:
+        return None
+
+    width, height = probe['width'], probe['height']
+    rotate = policy['apply_orientation'] and (probe.get('orientation') or 1) != 1
+    transposed = rotate and probe['orientation'] in TRANSPOSED_ORIENTATIONS
+    if transposed:
+        width, height = height, width
+
+    max_side = policy['max_side']
+    if max_side and max(width, height) > max_side:
+        scale = max_side / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+        resize = True
+    else:
+        resize = False
+
+    target_format = policy['format'] or probe['format']
+    convert = target_format != probe['format']
+    if not (rotate or resize or convert):
+        return None
+    if target_format not in OUTPUT_FORMATS and target_format not in ('TIFF', 'BMP'):
+        # e.g. MPO from phone cameras: re-encode as JPEG
+        target_format = 'JPEG'
+
+    return {'rotate': rotate, 'transposed': transposed, 'resize': resize, 'size': (width, height), 'format': target_format}
+
+
+def normalize_image(source_path, dest_path, plan, quality=DEFAULT_QUALITY):
+    """Write the normalized version of source_path to dest_path; returns its (width, height)"""
+    with PILImage.open(source_path) as img:
+        if plan['resize'] and img.format == 'JPEG':
+            # Let libjpeg decode at a reduced scale instead of decoding full size and shrinking
+            img.draft('RGB', plan['size'][::-1] if plan['transposed'] else plan['size'])
+        img = ImageOps.exif_transpose(img) if plan['rotate'] else img
+        if plan['resize']:
+            img = img.resize(plan['size'], PILImage.Resampling.LANCZOS)
+
+        if plan['format'] == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        save_args = {'optimize': True} if plan['format'] in ('JPEG', 'PNG') else {}
+        if plan['format'] in ('JPEG', 'WEBP'):
+            save_args['quality'] = quality
+        img.save(dest_path, plan['format'], **save_args)
+        return img.size
+
+
+def originals_root():
+    """Cold storage folder for originals replaced by a normalized copy"""
+    return current_app.config.get('ORIGINALS_FOLDER') or os.path.join(current_app.config['UPLOAD_FOLDER'], 'originals')
+
+
+def store_normalized(source_path, filename, probe, policy, move=False, link=False):
+    """
+    Put an image into the blob store, normalized according to policy
+
+    Args:
+        source_path: Probed image on disk
+        filename: Original filename (for the blob's extension)
+        probe: Result of image_probe for source_path
+        policy: ingest_policy() dict or None
+        move: Consume source_path (staged uploads and temp files)
+        link: Hardlink instead of copying when nothing needs to change
+
+    Returns:
+        Dict with content_hash, filepath, size, width, height and, when the
+        original was kept, original (sha256, path, size)
+    """
+    plan = plan_normalization(policy, probe)
+    if not plan:
+        content_hash, filepath, size = store_file(source_path, filename, move=move, sha256=probe['sha256'], link=link)
+        width, height = oriented_size(probe)
+        return {'content_hash': content_hash, 'filepath': filepath, 'size': size,
+                'width': width, 'height': height, 'original': None}
+
+    os.makedirs(blobs_root(), exist_ok=True)
+    ext = OUTPUT_FORMATS.get(plan['format'], os.path.splitext(filename)[1])
+    temp_path = os.path.join(blobs_root(), f".normalized-{uuid.uuid4().hex}{ext}")
+    try:
+        width, height = normalize_image(source_path, temp_path, plan, policy['quality'])
+        content_hash, filepath, size = store_file(temp_path, f"normalized{ext}", move=True)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    original = None
+    if policy['keep_originals']:
+        original = _keep_original(source_path, filename, probe, move)
+    elif move:
+        os.remove(source_path)
+
+    return {'content_hash': content_hash, 'filepath': filepath, 'size': size,
+            'width': width, 'height': height, 'original': original}
+
+
+def _keep_original(source_path, filename, probe, move):
+    """
+    Move, link or copy an original into cold storage, content-addressed like the blob store
+
+    Originals are reference-counted Blob rows too, so they are deleted with
+    the last image that kept them.
+    """
+    sha256 = probe['sha256']
+    pin_blob(sha256)
+    existing = Blob.query.get(sha256)
+    if existing and os.path.exists(existing.filepath):
+        # The same file is already stored (e.g. uploaded to a project without a policy)
+        if move:
+            os.remove(source_path)
+        return sha256, existing.filepath, probe['size']
+
+    path = os.path.join(originals_root(), sha256[:2], f"{sha256}{os.path.splitext(filename)[1].lower()}")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        if move:
+            os.remove(source_path)
+    elif move:
+        shutil.move(source_path, path)
+    else:
+        link_or_copy(source_path, path)
+    return sha256, path, probe['size']
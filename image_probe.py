@@ -0,0 +1,260 @@
+"""
+Header-only image probing for FreeFlow ingest
+Files are streamed to disk once while their SHA-256 is computed and their
+width, height, format and EXIF orientation are read from the header bytes.
+Truncated or undecodable uploads (and PDFs or archives) are rejected before
+any row is created.
+"""
+
+import io
+import os
+import hashlib
+from PIL import Image as PILImage
+
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Header bytes buffered while waiting for PIL to recognise the format
+HEADER_PROBE_START = 16 * 1024
+HEADER_PROBE_LIMIT = 4 * 1024 * 1024
+# Bytes kept from the end of the stream for trailer checks
+TAIL_SIZE = 64 * 1024
+# Files whose trailer check is inconclusive are fully decoded if they are at most this large
+DECODE_CHECK_MAX_PIXELS = 50_000_000
+
+EXIF_ORIENTATION_TAG = 0x0112
+JPEG_EOI = b'\xff\xd9'
+PNG_IEND = b'IEND\xaeB`\x82'
+GIF_TRAILER = b'\x3b'
+PDF_EOF = b'%%EOF'
+ZIP_END_OF_DIRECTORY = b'PK\x05\x06'
+GZIP_MAGIC = b'\x1f\x8b'
+TAR_BLOCK_SIZE = 512
+TIFF_STRIP_OFFSETS, TIFF_STRIP_BYTE_COUNTS = 273, 279
+TIFF_TILE_OFFSETS, TIFF_TILE_BYTE_COUNTS = 324, 325
+
+
+class ImageProbeError(Exception):
+    """The upload is not a complete, decodable image (or PDF or archive)"""
+
+
+def file_kind(filename):
+    """'pdf', 'zip', 'tar', 'tgz' or 'image', from the filename"""
+    name = filename.lower()
+    if name.endswith('.pdf'):
+        return 'pdf'
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith('.tar'):
+        return 'tar'
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'tgz'
+    return 'image'
+
+
+class StreamProbe:
+    """
+    Hash a byte stream and sniff its image header as the bytes go past
+
+    Feed every block with feed(), then call finish(). Only the header prefix
+    and the last TAIL_SIZE bytes are kept in memory.
+    """
+
+    def __init__(self, filename):
+        self.kind = file_kind(filename)
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.header = bytearray()
+        self.head = b''  # First bytes, for magic-number checks
+        self.next_attempt = HEADER_PROBE_START
+        self.tail = b''
+        self.info = None
+        self.data_end = 0
+
+    def feed(self, block):
+        self.hasher.update(block)
+        self.size += len(block)
+        self.tail = (self.tail + block)[-TAIL_SIZE:]
+        self.sniff(block)
+
+    def wants_header(self):
+        return self.kind == 'image' and self.info is None and len(self.header) < HEADER_PROBE_LIMIT
+
+    def sniff(self, block):
+        """Add the next header block and try to read the image info from it"""
+        if len(self.head) < 16:
+            self.head += block[:16 - len(self.head)]
+        if not self.wants_header():
+            return
+        self.header += block[:HEADER_PROBE_LIMIT - len(self.header)]
+        if len(self.header) >= self.next_attempt:
+            self._try_open()
+            # Retry at doubling sizes so large headers don't cost quadratic time
+            self.next_attempt = len(self.header) * 2
+
+    def _try_open(self, path=None):
+        try:
+            with PILImage.open(path or io.BytesIO(bytes(self.header))) as img:
+                orientation = None
+                try:
+                    orientation = img.getexif().get(EXIF_ORIENTATION_TAG)
+                except Exception:
+                    pass
+                self.info = {
+                    'width': img.width,
+                    'height': img.height,
+                    'format': img.format,
+                    'orientation': orientation or 1
+                }
+                self.data_end = _tiff_data_end(img) if img.format == 'TIFF' else 0
+        except Exception:
+            # Not enough header yet (or not an image at all); decided in finish()
+            self.info = None
+
+    def finish(self, path=None, sha256=None):
+        """
+        Check the stream was complete and return its probe result
+
+        Args:
+            path: Where the bytes were written, for the rare full-decode fallback
+            sha256: Hash computed elsewhere (the blocks were only sniffed, not fed)
+
+        Returns:
+            Dictionary with sha256, size and, for images, width, height, format
+            and orientation
+
+        Raises:
+            ImageProbeError: the file is empty, truncated or not decodable
+        """
+        if self.size == 0:
+            raise ImageProbeError('File is empty')
+
+        result = {'sha256': sha256 or self.hasher.hexdigest(), 'size': self.size}
+
+        if self.kind != 'image':
+            self._check_container()
+            return result
+
+        if self.info is None:
+            self._try_open()
+        if self.info is None and path is not None and len(self.header) >= HEADER_PROBE_LIMIT:
+            # e.g. a large TIFF with its directory at the end; open lazily by seeking
+            self._try_open(path)
+        if self.info is None:
+            raise ImageProbeError('Unrecognized or corrupt image')
+
+        if not self._trailer_ok(path):
+            raise ImageProbeError(f"{self.info['format']} image is truncated")
+
+        result.update(self.info)
+        return result
+
+    def _check_container(self):
+        """Cheap completeness checks for PDFs and archives (their entries are checked at ingest)"""
+        if self.kind == 'pdf' and PDF_EOF not in self.tail[-1024:]:
+            raise ImageProbeError('PDF is truncated (no %%EOF marker)')
+        if self.kind == 'zip' and ZIP_END_OF_DIRECTORY not in self.tail:
+            raise ImageProbeError('ZIP archive is truncated (no central directory)')
+        if self.kind == 'tar' and self.size % TAR_BLOCK_SIZE:
+            raise ImageProbeError('TAR archive is truncated')
+        if self.kind == 'tgz' and not self.head.startswith(GZIP_MAGIC):
+            raise ImageProbeError('Not a gzip-compressed TAR archive')
+
+    def _trailer_ok(self, path):
+        image_format = self.info['format']
+        tail = self.tail.rstrip(b'\x00\r\n ')
+
+        if image_format == 'JPEG':
+            complete = tail.endswith(JPEG_EOI)
+        elif image_format == 'PNG':
+            complete = PNG_IEND in self.tail
+        elif image_format == 'GIF':
+            complete = tail.endswith(GIF_TRAILER)
+        elif image_format == 'BMP':
+            # bfSize in the file header is the full file length
+            complete = self.size >= int.from_bytes(bytes(self.header[2:6]), 'little')
+        elif image_format == 'TIFF':
+            # Every strip or tile has to end inside the file
+            complete = self.size >= self.data_end
+        else:
+            complete = True
+
+        if complete or image_format != 'JPEG':
+            return complete
+
+        # Some cameras append data after the EOI marker (e.g. motion photos); decode to be sure
+        if path is None or self.info['width'] * self.info['height'] > DECODE_CHECK_MAX_PIXELS:
+            return False
+        try:
+            with PILImage.open(path) as img:
+                img.load()
+            return True
+        except Exception:
+            return False
+
+
+def _tiff_data_end(img):
+    """End offset of the last strip or tile of a TIFF's first page"""
+    tags = img.tag_v2
+    offsets = tags.get(TIFF_STRIP_OFFSETS) or tags.get(TIFF_TILE_OFFSETS) or ()
+    counts = tags.get(TIFF_STRIP_BYTE_COUNTS) or tags.get(TIFF_TILE_BYTE_COUNTS) or ()
+    if isinstance(offsets, int):
+        offsets, counts = (offsets,), (counts,)
+    return max((o + c for o, c in zip(offsets, counts)), default=0)
+
+
+def stream_to_file(stream, dest_path, filename):
+    """
+    Write a stream to dest_path in one pass while hashing and probing it
+
+    The destination is removed again if the upload turns out to be
+    truncated or undecodable.
+
+    Returns:
+        Probe result (see StreamProbe.finish)
+
+    Raises:
+        ImageProbeError: the upload was rejected
+    """
+    probe = StreamProbe(filename)
+    try:
+        with open(dest_path, 'wb') as out:
+            for block in iter(lambda: stream.read(STREAM_BLOCK_SIZE), b''):
+                out.write(block)
+                probe.feed(block)
+        return probe.finish(dest_path)
+    except Exception:
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        raise
+
+
+def probe_file(path, filename=None):
+    """Hash and probe a file already on disk in a single read"""
+    probe = StreamProbe(filename or path)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_BLOCK_SIZE), b''):
+            probe.feed(block)
+    return probe.finish(path)
+
+
+def probe_hashed_file(path, sha256, filename=None):
+    """
+    Probe a file whose hash is already known, reading only its header and tail
+
+    Used for chunked uploads, which are hashed as their chunks arrive.
+
+    Raises:
+        ImageProbeError: the file is truncated or not decodable
+    """
+    probe = StreamProbe(filename or path)
+    probe.size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        probe.sniff(f.read(STREAM_BLOCK_SIZE))
+        while probe.wants_header():
+            block = f.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            probe.sniff(block)
+        f.seek(max(0, probe.size - TAIL_SIZE))
+        probe.tail = f.read(TAIL_SIZE)
+    return probe.finish(path, sha256=sha256)
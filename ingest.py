@@ -0,0 +1,571 @@
+"""
+Asynchronous ingest pipeline for FreeFlow
+Uploads are staged on disk and recorded as an IngestJob; a background worker
+then rasterizes PDFs, unpacks archives, stores files in the blob store,
+creates Image rows and reports per-file progress over Socket.IO to the
+uploading client
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from werkzeug.utils import secure_filename
+from database import db, serialized_commit, serialized_write
+from models import Project, Image, IngestJob, IngestFile
+from blob_store import store_file, acquire_blob, abandon_blobs, after_commit
+from pdf_render import render_pdf_pages, count_pages, page_sizes
+from pdf_pages import lazy_pdf_pages, page_cache_path
+from derivatives import needs_tiles, generate_tiles_in_background
+from image_probe import stream_to_file, probe_file, ImageProbeError
+from archive_ingest import is_archive, ingest_archive
+from bulk_insert import ImageBatchWriter, insert_images, acquire_blobs, chunks, IMAGE_BATCH_SIZE
+from image_normalize import ingest_policy, store_normalized
+from near_duplicates import DuplicateFilter, safe_dhash
+
+# Uploaded images are inserted and committed in batches of this size
+INGEST_BATCH_SIZE = 100
+
+# Jobs with a worker thread currently attached, so a retry can't start a second one
+_running_jobs = set()
+_running_jobs_lock = threading.Lock()
+
+
+def staging_root():
+    """Folder where uploads wait until the ingest worker picks them up"""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'staging')
+
+
+def job_staging_dir(job_id):
+    return os.path.join(staging_root(), str(job_id))
+
+
+def is_pdf(filename):
+    return filename.lower().endswith('.pdf')
+
+
+def create_ingest_job(project_id, files, socket_id=None, dedupe_distance=None):
+    """
+    Stream uploaded files to disk and record them as a queued ingest job
+
+    Each file is written once while its SHA-256 and image header are read,
+    so truncated or undecodable uploads are turned away before any row exists.
+
+    Args:
+        project_id: Project the files are uploaded to
+        files: Werkzeug FileStorage objects that passed the extension check
+        socket_id: Socket.IO session id of the uploading client
+        dedupe_distance: Skip images within this many hash bits of an
+                         existing image (None keeps everything)
+
+    Returns:
+        Tuple of (committed IngestJob or None if every file was rejected,
+        list of {filename, error} for rejected files)
+    """
+    job = _new_job(project_id, 0, socket_id, dedupe_distance)
+    staging_dir = job_staging_dir(job.id)
+    rejected = []
+
+    for index, file in enumerate(files):
+        filename = secure_filename(file.filename)
+        staged_path = os.path.join(staging_dir, f"{index:06d}_{filename}")
+        try:
+            probe = stream_to_file(file.stream, staged_path, filename)
+        except ImageProbeError as e:
+            print(f"⚠️ Rejected upload {filename}: {e}")
+            rejected.append({'filename': filename, 'error': str(e)})
+            continue
+        db.session.add(_staged_file(job, filename, staged_path, probe))
+
+    if len(rejected) == len(files):
+        db.session.rollback()
+        remove_ingest_staging(job.id)
+        return None, rejected
+
+    job.total_files = len(files) - len(rejected)
+    db.session.commit()
+    return job, rejected
+
+
+def create_ingest_job_from_staged(project_id, staged_files, socket_id=None, dedupe_distance=None):
+    """
+    Record files that are already on disk (finished chunked uploads) as a queued ingest job
+
+    Args:
+        project_id: Project the files are uploaded to
+        staged_files: List of (filename, path, probe result) tuples; the files
+                      are moved into the job's staging folder
+        socket_id: Socket.IO session id of the uploading client
+        dedupe_distance: See create_ingest_job
+
+    Returns:
+        The committed IngestJob
+    """
+    job = _new_job(project_id, len(staged_files), socket_id, dedupe_distance)
+    staging_dir = job_staging_dir(job.id)
+
+    for index, (filename, path, probe) in enumerate(staged_files):
+        staged_path = os.path.join(staging_dir, f"{index:06d}_{filename}")
+        os.replace(path, staged_path)
+        db.session.add(_staged_file(job, filename, staged_path, probe))
+
+    db.session.commit()
+    return job
+
+
+def _staged_file(job, filename, staged_path, probe):
+    return IngestFile(
+        job_id=job.id,
+        filename=filename,
+        staged_path=staged_path,
+        content_hash=probe['sha256'],
+        width=probe.get('width'),
+        height=probe.get('height'),
+        image_format=probe.get('format'),
+        orientation=probe.get('orientation')
+    )
+
+
+def _new_job(project_id, total_files, socket_id, dedupe_distance=None):
+    job = IngestJob(
+        project_id=project_id,
+        batch_id=str(uuid.uuid4()),
+        status='queued',
+        socket_id=socket_id,
+        dedupe_distance=dedupe_distance,
+        total_files=total_files
+    )
+    db.session.add(job)
+    db.session.flush()
+    os.makedirs(job_staging_dir(job.id), exist_ok=True)
+    return job
+
+
+def start_ingest_job(app, socketio, job_id, runner=None):
+    """
+    Process an ingest job on a background thread; returns False if it is already running
+
+    runner(app, socketio, job_id) replaces run_ingest_job for jobs that
+    don't ingest staged files (e.g. local dataset imports).
+    """
+    runner = runner or run_ingest_job
+    with _running_jobs_lock:
+        if job_id in _running_jobs:
+            return False
+        _running_jobs.add(job_id)
+
+    def worker():
+        try:
+            runner(app, socketio, job_id)
+        finally:
+            with _running_jobs_lock:
+                _running_jobs.discard(job_id)
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+    return True
+
+
+def is_job_running(job_id):
+    with _running_jobs_lock:
+        return job_id in _running_jobs
+
+
+def serialize_ingest_job(job, include_files=True):
+    """Job status as returned by the API and progress events"""
+    data = {
+        'job_id': job.id,
+        'project_id': job.project_id,
+        'batch_id': job.batch_id,
+        'status': job.status,
+        'total': job.total_files,
+        'processed': job.processed_files,
+        'failed': job.failed_files,
+        'images_created': job.images_created,
+        'dedupe_distance': job.dedupe_distance,
+        'error': job.error_message,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'completed_at': job.completed_at.isoformat() if job.completed_at else None
+    }
+    if include_files:
+        data['files'] = [serialize_ingest_file(f) for f in job.files]
+    return data
+
+
+def serialize_ingest_file(ingest_file):
+    return {
+        'id': ingest_file.id,
+        'filename': ingest_file.filename,
+        'status': ingest_file.status,
+        'error': ingest_file.error_message,
+        'attempts': ingest_file.attempts,
+        'images_created': ingest_file.images_created
+    }
+
+
+def emit_ingest_progress(socketio, job, **extra):
+    """Send an ingest_progress event to the uploading client (everyone if it didn't say who it is)"""
+    if not socketio:
+        return
+    data = serialize_ingest_job(job, include_files=False)
+    data.update(extra)
+    if job.socket_id:
+        socketio.emit('ingest_progress', data, to=job.socket_id)
+    else:
+        socketio.emit('ingest_progress', data)
+
+
+def _refresh_counts(job):
+    files = job.files
+    job.processed_files = sum(1 for f in files if f.status == 'completed')
+    job.failed_files = sum(1 for f in files if f.status == 'failed')
+    job.images_created = sum(f.images_created or 0 for f in files)
+
+
+def _prepare_image(app, staged_path, filename, probe, policy, dhash=None):
+    """
+    Hash a probed image and link it into the blob store, normalized by the project's ingest policy (runs on a pool thread)
+
+    The staged file is left in place; it is only removed once its Image row
+    is committed, so a failed batch can be retried.
+
+    Returns:
+        Tuple of (prepared dict, error message)
+    """
+    try:
+        if probe['sha256'] is None or probe['width'] is None:
+            # Staged before probing existed
+            probe = probe_file(staged_path, filename)
+        probe = {**probe, 'size': os.path.getsize(staged_path)}
+        dhash = dhash or safe_dhash(staged_path)
+        with app.app_context():
+            prepared = store_normalized(staged_path, filename, probe, policy, link=True)
+        prepared['dhash'] = dhash
+        return prepared, None
+    except Exception as e:
+        return None, str(e)
+
+
+def _remove_files(paths):
+    for path in paths:
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Failed to delete staged file {path}: {e}")
+
+
+def _skip_near_duplicates(socketio, job, images, hashes):
+    """
+    Drop uploads that are near-duplicates of an existing image or of an earlier file in the job
+
+    Skipped files are completed without an image and their staged copy is
+    removed. Returns the (ingest file, dhash) pairs to keep.
+    """
+    duplicates = DuplicateFilter(job.project_id, job.dedupe_distance)
+    kept = []
+    for ingest_file, dhash in zip(images, hashes):
+        match = duplicates.match(dhash)
+        if not match:
+            duplicates.accept(dhash)
+            kept.append((ingest_file, dhash))
+            continue
+
+        distance, image_id = match
+        of = f"image #{image_id}" if image_id else "an earlier file in this upload"
+        print(f"⏭️ Skipping {ingest_file.filename}: near-duplicate of {of} (distance {distance})")
+        ingest_file.status = 'completed'
+        ingest_file.images_created = 0
+        ingest_file.error_message = f"Skipped: near-duplicate of {of} ({distance} bits apart)"
+        ingest_file.completed_at = datetime.utcnow()
+        if os.path.exists(ingest_file.staged_path):
+            os.remove(ingest_file.staged_path)
+
+    if len(kept) < len(images):
+        _refresh_counts(job)
+        serialized_commit()
+        emit_ingest_progress(socketio, job)
+    return kept
+
+
+def _mark_failed(job, ingest_file, error):
+    print(f"❌ Ingest of {ingest_file.filename} failed: {error}")
+    ingest_file.status = 'failed'
+    ingest_file.error_message = error
+    _refresh_counts(job)
+    serialized_commit()
+
+
+def _ingest_pdf(socketio, job, ingest_file):
+    """Rasterize a staged PDF into one Image per page"""
+    pages_dir = os.path.join(job_staging_dir(job.id), f"pages_{ingest_file.id}")
+    os.makedirs(pages_dir, exist_ok=True)
+    source_name = ingest_file.filename
+    pages = []
+    acquiring = False
+
+    try:
+        total_pages = count_pages(ingest_file.staged_path)
+        if lazy_pdf_pages(total_pages):
+            _ingest_pdf_lazily(socketio, job, ingest_file, total_pages)
+            return
+        emit_ingest_progress(socketio, job, pdf={'filename': source_name, 'current': 0, 'total': total_pages})
+
+        # Pages go into the blob store as they are rendered; their rows are written together at the end
+        for page in render_pdf_pages(ingest_file.staged_path, pages_dir, total_pages,
+                                     workers=current_app.config.get('PDF_RENDER_WORKERS')):
+            page_num = page['page_index'] + 1
+            dhash = safe_dhash(page['filepath'])
+            content_hash, filepath, size = store_file(page['filepath'], move=True)
+            pages.append((page, dhash, content_hash, filepath, size))
+            emit_ingest_progress(socketio, job, pdf={'filename': source_name, 'current': page_num, 'total': total_pages})
+
+        acquiring = True
+        with serialized_write():
+            for page, dhash, content_hash, filepath, size in pages:
+                acquire_blob(content_hash, filepath, size)
+                db.session.add(Image(
+                    filename=f"{source_name} - Page {page['page_index'] + 1}",
+                    filepath=filepath,
+                    content_hash=content_hash,
+                    dhash=dhash,
+                    width=page['width'],
+                    height=page['height'],
+                    batch_id=job.batch_id,
+                    project_id=job.project_id
+                ))
+
+            ingest_file.status = 'completed'
+            ingest_file.images_created = total_pages
+            ingest_file.completed_at = datetime.utcnow()
+            _refresh_counts(job)
+            db.session.commit()
+        os.remove(ingest_file.staged_path)
+    except Exception as e:
+        db.session.rollback()
+        # Page blobs placed before the failure have no Blob row to keep them (the rollback unpinned acquired ones)
+        abandon_blobs([(content_hash, filepath) for _, _, content_hash, filepath, _ in pages], pinned=not acquiring)
+        _mark_failed(job, ingest_file, str(e))
+    finally:
+        shutil.rmtree(pages_dir, ignore_errors=True)
+
+
+def _ingest_pdf_lazily(socketio, job, ingest_file, total_pages):
+    """
+    Store a long PDF once and create its page Images without rendering them
+
+    Page sizes come from the page metadata; pages are rendered on first
+    access (see pdf_pages). Every page holds one reference to the PDF blob.
+    """
+    source_name = ingest_file.filename
+    emit_ingest_progress(socketio, job, pdf={'filename': source_name, 'current': 0, 'total': total_pages})
+
+    # Copied rather than moved, so a failed job can still be retried from the staged file
+    content_hash, pdf_path, size = store_file(ingest_file.staged_path, source_name, sha256=ingest_file.content_hash)
+    rows = [{
+        'filename': f"{source_name} - Page {page_index + 1}",
+        'filepath': page_cache_path(content_hash, page_index),
+        'source_hash': content_hash,
+        'page_index': page_index,
+        'width': width,
+        'height': height,
+        'batch_id': job.batch_id,
+        'project_id': job.project_id
+    } for page_index, (width, height) in enumerate(page_sizes(pdf_path))]
+
+    # One transaction, so a retry never finds half of the pages
+    with serialized_write():
+        for chunk in chunks(rows, IMAGE_BATCH_SIZE):
+            insert_images(chunk)
+        acquire_blobs([(content_hash, pdf_path, size)] * len(rows))
+
+        ingest_file.status = 'completed'
+        ingest_file.images_created = len(rows)
+        ingest_file.completed_at = datetime.utcnow()
+        _refresh_counts(job)
+        db.session.commit()
+    os.remove(ingest_file.staged_path)
+    emit_ingest_progress(socketio, job, pdf={'filename': source_name, 'current': total_pages, 'total': total_pages})
+    print(f"📄 {source_name}: {len(rows)} pages added, rendered on first access")
+
+
+def _ingest_archive(app, socketio, job, ingest_file):
+    """Ingest the images and labels of a staged ZIP or TAR archive"""
+    source_name = ingest_file.filename
+
+    def report_progress(current, total):
+        _refresh_counts(job)
+        emit_ingest_progress(socketio, job, archive={'filename': source_name, 'current': current, 'total': total})
+
+    try:
+        images_created, annotations, skipped = ingest_archive(app, job, ingest_file, report_progress)
+        ingest_file.status = 'completed'
+        ingest_file.images_created = images_created
+        ingest_file.completed_at = datetime.utcnow()
+        if skipped:
+            ingest_file.error_message = f"Skipped {len(skipped)} unreadable entries: " + '; '.join(skipped[:5])
+        _refresh_counts(job)
+        serialized_commit()
+        os.remove(ingest_file.staged_path)
+        print(f"✅ Archive {source_name}: {images_created} images, {annotations} annotations, {len(skipped)} skipped")
+    except Exception as e:
+        db.session.rollback()
+        _mark_failed(job, ingest_file, str(e))
+
+
+def _finish_job(app, job):
+    """Final bookkeeping once every file has been attempted"""
+    _refresh_counts(job)
+    if job.failed_files == 0:
+        job.status = 'completed'
+    elif job.processed_files == 0:
+        job.status = 'failed'
+    else:
+        job.status = 'completed_with_errors'
+    job.completed_at = datetime.utcnow()
+
+    project = Project.query.get(job.project_id)
+    project.updated_at = datetime.utcnow()
+    serialized_commit()
+
+    # Set first uploaded image as project thumbnail if no thumbnail exists
+    if not project.thumbnail_image_id and not project.thumbnail_path:
+        first_image = Image.query.filter_by(project_id=project.id).order_by(Image.uploaded_at).first()
+        if first_image:
+            project.thumbnail_image_id = first_image.id
+            serialized_commit()
+            print(f"✅ Set project thumbnail to first image (ID: {first_image.id})")
+
+    # Optionally build deep-zoom tiles for very large scans up front
+    if current_app.config.get('TILE_PYRAMID_AT_INGEST'):
+        large_image_ids = [img.id for img in Image.query.filter_by(batch_id=job.batch_id).all() if needs_tiles(img)]
+        if large_image_ids:
+            generate_tiles_in_background(app, large_image_ids)
+
+    # Failed files stay staged so they can be retried
+    if job.failed_files == 0:
+        shutil.rmtree(job_staging_dir(job.id), ignore_errors=True)
+
+
+def run_ingest_job(app, socketio, job_id):
+    """Process every pending or failed file of an ingest job"""
+    with app.app_context():
+        job = IngestJob.query.get(job_id)
+        if not job:
+            print(f"❌ Ingest job #{job_id} not found!")
+            return
+
+        print(f"📥 Starting ingest job #{job.id}: {job.total_files} files for project {job.project_id}")
+
+        try:
+            job.status = 'processing'
+            job.started_at = job.started_at or datetime.utcnow()
+            job.error_message = None
+            to_process = [f for f in job.files if f.status != 'completed']
+            for ingest_file in to_process:
+                ingest_file.status = 'processing'
+                ingest_file.error_message = None
+                ingest_file.attempts = (ingest_file.attempts or 0) + 1
+            serialized_commit()
+            emit_ingest_progress(socketio, job)
+
+            images = [f for f in to_process if not is_pdf(f.filename) and not is_archive(f.filename)]
+            pdfs = [f for f in to_process if is_pdf(f.filename)]
+            archives = [f for f in to_process if is_archive(f.filename)]
+
+            # Files were hashed and probed on arrival; the pool only normalizes them if the
+            # project's policy asks for it and moves them into the blob store
+            policy = ingest_policy(Project.query.get(job.project_id))
+            workers = current_app.config.get('INGEST_WORKERS', 4)
+            files_by_id = {f.id: f for f in images}
+
+            def mark_written(writer):
+                staged = []
+                for file_id in writer.ids:
+                    ingest_file = files_by_id[file_id]
+                    ingest_file.status = 'completed'
+                    ingest_file.images_created = 1
+                    ingest_file.completed_at = datetime.utcnow()
+                    staged.append(ingest_file.staged_path)
+                writer.ids.clear()
+                # The blob store has its own link to each file; drop the staged copies once the batch is committed
+                after_commit(lambda: _remove_files(staged))
+                _refresh_counts(job)
+                emit_ingest_progress(socketio, job)
+
+            # Image rows are bulk-inserted in committed batches
+            writer = ImageBatchWriter(batch_size=INGEST_BATCH_SIZE, on_batch=mark_written)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                if job.dedupe_distance is not None and images:
+                    # Hash first, so near-duplicates are dropped before they reach the blob store
+                    hashes = list(executor.map(safe_dhash, [f.staged_path for f in images]))
+                    kept = _skip_near_duplicates(socketio, job, images, hashes)
+                else:
+                    kept = [(f, None) for f in images]
+                
+                jobs = [
+                    (f.staged_path, f.filename, {'sha256': f.content_hash, 'width': f.width, 'height': f.height,
+                                                 'format': f.image_format, 'orientation': f.orientation}, policy, dhash)
+                    for f, dhash in kept
+                ]
+                results = executor.map(lambda args: _prepare_image(app, *args), jobs)
+                for (ingest_file, _), (prepared, error) in zip(kept, results):
+                    if error:
+                        _mark_failed(job, ingest_file, error)
+                        emit_ingest_progress(socketio, job, file=serialize_ingest_file(ingest_file))
+                        continue
+                    writer.add(ingest_file.id, {
+                        'filename': ingest_file.filename,
+                        'filepath': prepared['filepath'],
+                        'content_hash': prepared['content_hash'],
+                        'size': prepared['size'],
+                        'width': prepared['width'],
+                        'height': prepared['height'],
+                        'original': prepared['original'],
+                        'dhash': prepared['dhash'],
+                        'batch_id': job.batch_id,
+                        'project_id': job.project_id
+                    })
+            writer.flush()
+
+            for ingest_file in pdfs:
+                _ingest_pdf(socketio, job, ingest_file)
+                emit_ingest_progress(socketio, job, file=serialize_ingest_file(ingest_file))
+
+            for ingest_file in archives:
+                _ingest_archive(app, socketio, job, ingest_file)
+                emit_ingest_progress(socketio, job, file=serialize_ingest_file(ingest_file))
+
+            _finish_job(app, job)
+            print(f"✅ Ingest job #{job.id} {job.status}: {job.images_created} images, {job.failed_files} failed files")
+        except Exception as e:
+            print(f"❌ Ingest job #{job_id} failed: {e}")
+            import traceback
+            traceback.print_exc()
+            db.session.rollback()
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.completed_at = datetime.utcnow()
+            serialized_commit()
+
+        emit_ingest_progress(socketio, job)
+
+
+def retry_ingest_job(job):
+    """Queue every file of a job that did not complete for another attempt (caller commits)"""
+    for ingest_file in job.files:
+        if ingest_file.status != 'completed':
+            ingest_file.status = 'pending'
+            ingest_file.error_message = None
+    job.status = 'queued'
+    job.completed_at = None
+    _refresh_counts(job)
+
+
+def remove_ingest_staging(job_id):
+    """Delete whatever is still staged for a job"""
+    shutil.rmtree(job_staging_dir(job_id), ignore_errors=True)
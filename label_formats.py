@@ -0,0 +1,199 @@
+"""
+Label file parsing for FreeFlow dataset imports
+Turns YOLO, COCO and Pascal VOC label files into normalized boxes and
+polygons, and maps dataset class names onto a project's classes
+"""
+
+import os
+import json
+import random
+import posixpath
+import xml.etree.ElementTree as ET
+import yaml
+from database import db
+from models import Class
+from polygon_codec import encode_polygon
+
+# Files that name a YOLO dataset's classes, in order of preference
+YOLO_CLASS_FILES = ('data.yaml', 'dataset.yaml', 'classes.txt', 'obj.names')
+
+
+def parse_yolo_labels(text):
+    """
+    Parse a YOLO label file (detection or segmentation)
+
+    Returns:
+        List of (class index, x_center, y_center, width, height, polygon or None);
+        polygons are lists of normalized [x, y] points
+    """
+    labels = []
+    for line in text.splitlines():
+        parts = line.strip().split()
+        try:
+            class_idx = int(parts[0]) if parts else None
+            values = [float(v) for v in parts[1:]]
+        except ValueError:
+            continue
+
+        if class_idx is None or len(values) < 4:
+            continue
+        if len(values) == 4:
+            labels.append((class_idx, *values, None))
+        elif len(values) >= 6 and len(values) % 2 == 0:
+            # Segmentation line: class x1 y1 x2 y2 ...
+            polygon = [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+            labels.append((class_idx, *polygon_box(polygon), polygon))
+    return labels
+
+
+def polygon_box(polygon):
+    """Normalized (x_center, y_center, width, height) of a polygon's bounding box"""
+    xs = [p[0] for p in polygon]
+    ys = [p[1] for p in polygon]
+    return (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2, max(xs) - min(xs), max(ys) - min(ys)
+
+
+def parse_yolo_class_names(filename, text):
+    """Class names from a data.yaml / dataset.yaml or a one-name-per-line classes file"""
+    if filename.endswith('.yaml'):
+        names = (yaml.safe_load(text) or {}).get('names') or []
+        if isinstance(names, dict):
+            # Ultralytics style {0: name, 1: name}
+            return [names[k] for k in sorted(names)]
+        return list(names)
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def yolo_label_candidates(image_path):
+    """
+    Paths where a YOLO label for image_path may live
+
+    Standard layout replaces the last images/ folder with labels/; flat
+    datasets keep the .txt next to the image.
+    """
+    stem = posixpath.splitext(image_path)[0]
+    candidates = []
+    parts = stem.split('/')
+    if 'images' in parts:
+        idx = len(parts) - 1 - parts[::-1].index('images')
+        candidates.append('/'.join(parts[:idx] + ['labels'] + parts[idx + 1:]) + '.txt')
+    candidates.append(stem + '.txt')
+    return candidates
+
+
+def parse_coco(text):
+    """
+    Parse a COCO annotation file
+
+    Returns:
+        Tuple of (category names by id, {image basename: [(category id,
+        x_center, y_center, width, height, polygon or None)]}), or None if
+        the JSON is not COCO
+    """
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(data, dict) or not {'images', 'annotations', 'categories'} <= data.keys():
+        return None
+
+    categories = {c['id']: c['name'] for c in data['categories']}
+    images = {img['id']: img for img in data['images']}
+    labels = {}
+
+    for ann in data['annotations']:
+        img = images.get(ann.get('image_id'))
+        if not img or not img.get('width') or not img.get('height') or 'bbox' not in ann:
+            continue
+        w, h = img['width'], img['height']
+        x, y, bw, bh = ann['bbox']
+
+        polygon = None
+        segmentation = ann.get('segmentation')
+        if isinstance(segmentation, list) and segmentation and len(segmentation[0]) >= 6:
+            # Polygon segmentation (RLE masks are imported as boxes only)
+            flat = segmentation[0]
+            polygon = [[flat[i] / w, flat[i + 1] / h] for i in range(0, len(flat) - 1, 2)]
+
+        key = posixpath.basename(img['file_name'])
+        labels.setdefault(key, []).append(
+            (ann['category_id'], (x + bw / 2) / w, (y + bh / 2) / h, bw / w, bh / h, polygon)
+        )
+    return categories, labels
+
+
+def parse_voc(text):
+    """
+    Parse a Pascal VOC annotation XML file
+
+    Returns:
+        Tuple of (image filename, width, height, [(class name, xmin, ymin,
+        xmax, ymax)]); width and height are 0 if the file doesn't say
+    """
+    root = ET.fromstring(text)
+    size = root.find('size')
+    width = int(float(size.findtext('width', '0'))) if size is not None else 0
+    height = int(float(size.findtext('height', '0'))) if size is not None else 0
+
+    objects = []
+    for obj in root.iter('object'):
+        box = obj.find('bndbox')
+        name = (obj.findtext('name') or '').strip()
+        if box is None or not name:
+            continue
+        objects.append((name, *(float(box.findtext(k, '0')) for k in ('xmin', 'ymin', 'xmax', 'ymax'))))
+    return (root.findtext('filename') or '').strip(), width, height, objects
+
+
+def voc_labels(objects, width, height):
+    """Normalized (class name, x_center, y_center, width, height, None) labels from VOC pixel boxes"""
+    return [
+        (name, (xmin + xmax) / 2 / width, (ymin + ymax) / 2 / height, (xmax - xmin) / width, (ymax - ymin) / height, None)
+        for name, xmin, ymin, xmax, ymax in objects
+    ]
+
+
+def resolve_class_ids(project, names):
+    """
+    Map dataset class names onto the project's classes, creating missing ones (caller commits)
+
+    Args:
+        project: Project the labels are imported into
+        names: Dict of dataset class key (YOLO index, COCO id or VOC name) -> name
+
+    Returns:
+        Dict of dataset class key -> Class id
+    """
+    existing = {cls.name: cls for cls in project.classes}
+    mapping = {}
+    for key, name in names.items():
+        cls = existing.get(name)
+        if not cls:
+            cls = Class(name=name, color=f"#{random.randint(0, 0xFFFFFF):06x}", project_id=project.id)
+            db.session.add(cls)
+            db.session.flush()
+            existing[name] = cls
+            print(f"✨ Created new class: {name}")
+        mapping[key] = cls.id
+    return mapping
+
+
+def annotation_row(class_id, label, image_id=None):
+    """Annotation column values for one parsed (class, box..., polygon) label, for bulk inserts"""
+    _, x_center, y_center, width, height, polygon = label
+    row = {
+        'class_id': class_id,
+        'x_center': x_center,
+        'y_center': y_center,
+        'width': width,
+        'height': height,
+        'polygon_data': encode_polygon(polygon)
+    }
+    if image_id is not None:
+        row['image_id'] = image_id
+    return row
+
+
+def is_label_file(path):
+    name = os.path.basename(path).lower()
+    return name.endswith(('.txt', '.json', '.names')) or name in YOLO_CLASS_FILES
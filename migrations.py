@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+Versioned schema migrations for FreeFlow
+db.create_all() creates missing tables but never changes existing ones, so
+every change to an existing table is a numbered migration here. The
+schema_version table records which migrations a database has had, and the
+pending ones run in order at startup. Each step checks before it changes
+anything, so databases created from the current models (or partly upgraded
+by the old migrate_*.py scripts) go through them without errors. Migrations
+are written against SQLAlchemy rather than sqlite3, so they run on SQLite
+and PostgreSQL alike.
+
+Run `python migrations.py` to apply pending migrations and list the
+applied ones without starting the server.
+"""
+
+import os
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from database import db, serialized_write
+from models import SchemaVersion
+
+Migration = namedtuple('Migration', ['version', 'description', 'upgrade', 'background'])
+
+# Registered in version order by @migration
+MIGRATIONS = []
+
+
+def migration(version, description, background=False):
+    """
+    Register a migration
+
+    Args:
+        version: Schema version the migration brings the database to
+        description: Shown in the startup log and stored in schema_version
+        background: Data backfill that runs on a thread after startup instead
+            of blocking it; it is recorded once it finishes, so an
+            interrupted backfill starts over on the next startup
+    """
+    def register(upgrade):
+        MIGRATIONS.append(Migration(version, description, upgrade, background))
+        return upgrade
+    return register
+
+
+def _columns(table):
+    return {column['name'] for column in db.inspect(db.session.connection()).get_columns(table)}
+
+
+def _quote(name):
+    # e.g. "class" needs quoting on some databases
+    return db.session.get_bind().dialect.identifier_preparer.quote(name)
+
+
+def _add_columns(table, columns):
+    """Add (name, SQL type) columns a table doesn't have yet (types must be valid on SQLite and PostgreSQL)"""
+    existing = _columns(table)
+    for name, sql_type in columns:
+        if name not in existing:
+            print(f"  ➕ Adding column: {table}.{name}")
+            db.session.execute(db.text(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(name)} {sql_type}"))
+
+
+def _create_index(name, table, columns):
+    """
+    Create an index unless it exists; builds on a large table are timed in the log
+
+    On PostgreSQL the index is built CONCURRENTLY, outside the migration's
+    transaction, so the table stays writable while it builds.
+    """
+    start = time.time()
+    target = f"{_quote(name)} ON {_quote(table)} ({', '.join(_quote(column) for column in columns)})"
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY can't run inside a transaction
+        db.session.commit()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(db.text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {target}"))
+    else:
+        db.session.execute(db.text(f"CREATE INDEX IF NOT EXISTS {target}"))
+    elapsed = time.time() - start
+    if elapsed > 1:
+        print(f"  🗂️ Built index {name} in {elapsed:.1f}s")
+
+
+@migration(1, 'Hugging Face Jobs fields on training jobs')
+def add_hf_jobs():
+    _add_columns('training_job', [
+        ('is_hf_job', 'BOOLEAN DEFAULT FALSE'),
+        ('hf_job_id', 'VARCHAR(100)'),
+        ('hf_username', 'VARCHAR(100)'),
+        ('hf_hardware', 'VARCHAR(50)')
+    ])
+
+
+@migration(2, 'Content-addressed blob store')
+def content_addressed_storage():
+    """Add Image.content_hash and move legacy per-image files into the blob store"""
+    from blob_store import store_file, acquire_blob
+
+    _add_columns('image', [('content_hash', 'VARCHAR(64)')])
+    _create_index('ix_image_content_hash', 'image', ['content_hash'])
+
+    # Plain SQL: columns added by later migrations may not exist yet
+    legacy = "SELECT id, filename, filepath FROM image WHERE content_hash IS NULL"
+    if 'source_hash' in _columns('image'):
+        # Lazy PDF pages point at the page cache, not at a file of their own
+        legacy += " AND source_hash IS NULL"
+    images = db.session.execute(db.text(legacy)).all()
+    if images:
+        print(f"  📦 {len(images)} images to move into the blob store")
+
+    moved = 0
+    for image_id, filename, filepath in images:
+        if not os.path.exists(filepath):
+            print(f"  ⚠️ Missing file for image {image_id}: {filepath}")
+            continue
+
+        content_hash, path, size = store_file(filepath, filename, move=True)
+        acquire_blob(content_hash, path, size)
+        db.session.execute(
+            db.text("UPDATE image SET content_hash = :content_hash, filepath = :filepath WHERE id = :id"),
+            {'content_hash': content_hash, 'filepath': path, 'id': image_id}
+        )
+        moved += 1
+
+        if moved % 500 == 0:
+            db.session.commit()
+            print(f"  ... {moved} images moved")
+
+
+@migration(3, 'Header probe results on ingest files and near-duplicate skipping on ingest jobs')
+def ingest_probe_fields():
+    _add_columns('ingest_file', [
+        ('width', 'INTEGER'),
+        ('height', 'INTEGER'),
+        ('image_format', 'VARCHAR(20)'),
+        ('orientation', 'INTEGER')
+    ])
+    _add_columns('ingest_job', [('dedupe_distance', 'INTEGER')])
+
+
+@migration(4, 'Per-project ingest policy')
+def ingest_policy():
+    _add_columns('project', [
+        ('ingest_apply_orientation', 'BOOLEAN DEFAULT FALSE'),
+        ('ingest_format', 'VARCHAR(10)'),
+        ('ingest_quality', 'INTEGER DEFAULT 90'),
+        ('ingest_max_side', 'INTEGER'),
+        ('ingest_keep_originals', 'BOOLEAN DEFAULT FALSE')
+    ])
+    _add_columns('image', [('original_hash', 'VARCHAR(64)')])
+
+
+@migration(5, 'Lazily rendered PDF pages')
+def lazy_pdf_pages():
+    _add_columns('image', [('source_hash', 'VARCHAR(64)'), ('page_index', 'INTEGER')])
+    _create_index('ix_image_source_hash', 'image', ['source_hash'])
+
+
+@migration(6, 'Perceptual hashes for near-duplicate detection')
+def near_duplicates():
+    _add_columns('image', [('dhash', 'VARCHAR(16)')])
+    _create_index('ix_image_dhash', 'image', ['dhash'])
+
+
+@migration(7, 'Indexes for per-project, per-image and per-class queries')
+def listing_indexes():
+    _create_index('ix_image_project_status', 'image', ['project_id', 'status'])
+    _create_index('ix_image_project_uploaded', 'image', ['project_id', 'uploaded_at', 'id'])
+    _create_index('ix_image_project_batch', 'image', ['project_id', 'batch_id'])
+    _create_index('ix_annotation_image_class', 'annotation', ['image_id', 'class_id'])
+    _create_index('ix_annotation_class_id', 'annotation', ['class_id'])
+    _create_index('ix_class_project_id', 'class', ['project_id'])
+
+
+@migration(8, 'Perceptual hashes of images uploaded before near-duplicate detection', background=True)
+def backfill_dhashes():
+    """Hash every image that doesn't have a dhash (lazy PDF pages that were never rendered stay unhashed)"""
+    from concurrent.futures import ThreadPoolExecutor
+    from flask import current_app
+    from models import Image
+    from near_duplicates import safe_dhash
+
+    images = db.session.query(Image.id, Image.filepath).filter(Image.dhash.is_(None)).all()
+    images = [(image_id, path) for image_id, path in images if os.path.exists(path)]
+    if not images:
+        return
+    print(f"  🔍 {len(images)} images to hash")
+
+    def store(updates):
+        # Runs alongside requests and ingest jobs, so each batch is one serialized write transaction
+        with serialized_write():
+            for image_id, dhash in updates:
+                Image.query.filter_by(id=image_id).update({Image.dhash: dhash}, synchronize_session=False)
+            db.session.commit()
+
+    hashed = 0
+    updates = []
+    with ThreadPoolExecutor(max_workers=current_app.config.get('INGEST_WORKERS', 4)) as executor:
+        hashes = executor.map(safe_dhash, [path for _, path in images])
+        for (image_id, _), dhash in zip(images, hashes):
+            if not dhash:
+                continue
+            updates.append((image_id, dhash))
+            hashed += 1
+
+            if len(updates) == 500:
+                store(updates)
+                updates = []
+                print(f"  ... {hashed} images hashed")
+    store(updates)
+    print(f"  ✅ Hashed {hashed} images")
+
+
+@migration(9, 'Annotation revisions on images')
+def image_revisions():
+    _add_columns('image', [('revision', 'INTEGER NOT NULL DEFAULT 0')])
+
+
+@migration(10, 'Packed binary polygons')
+def packed_polygons():
+    """Add Annotation.polygon_data and convert the polygon_points JSON into it"""
+    from polygon_codec import encode_polygon
+
+    binary_type = db.LargeBinary().compile(dialect=db.session.get_bind().dialect)
+    _add_columns('annotation', [('polygon_data', binary_type)])
+    if 'polygon_points' not in _columns('annotation'):
+        return
+
+    # polygon_data is authoritative from here on. Converted rows have polygon_points set
+    # to NULL, so only polygons that couldn't be read keep their JSON there; the column
+    # itself is left in place, since dropping it rebuilds the table on SQLite
+    select = db.text("SELECT id, polygon_points FROM annotation "
+                     "WHERE polygon_points IS NOT NULL AND id > :last ORDER BY id LIMIT 1000")
+    converted = json_bytes = packed_bytes = 0
+    last_id = 0
+    while True:
+        rows = db.session.execute(select, {'last': last_id}).all()
+        if not rows:
+            break
+        for ann_id, points in rows:
+            last_id = ann_id
+            try:
+                packed = encode_polygon(json.loads(points))
+            except (TypeError, ValueError):
+                print(f"  ⚠️ Unreadable polygon on annotation {ann_id}, left as JSON")
+                continue
+            db.session.execute(
+                db.text("UPDATE annotation SET polygon_data = :data, polygon_points = NULL WHERE id = :id"),
+                {'data': packed, 'id': ann_id}
+            )
+            converted += 1
+            json_bytes += len(points.encode())
+            packed_bytes += len(packed or b'')
+        db.session.commit()
+        print(f"  ... {converted} polygons packed")
+
+    if json_bytes:
+        print(f"  📉 {converted} polygons: {json_bytes / 1024:.0f} KB as JSON, {packed_bytes / 1024:.0f} KB packed "
+              f"({100 * (1 - packed_bytes / json_bytes):.0f}% smaller)")
+
+
+@migration(11, 'Dataset version membership table')
+def dataset_version_membership():
+    """Move DatasetVersion.image_splits JSON into dataset_version_image rows and stored split counts"""
+    # The dataset_version_image table itself is new, so db.create_all() has made it
+    _add_columns('dataset_version', [
+        ('train_count', 'INTEGER DEFAULT 0'),
+        ('val_count', 'INTEGER DEFAULT 0'),
+        ('test_count', 'INTEGER DEFAULT 0')
+    ])
+    if 'image_splits' not in _columns('dataset_version'):
+        return
+
+    versions = db.session.execute(db.text("SELECT id, project_id, image_splits FROM dataset_version")).all()
+    insert = db.text("INSERT INTO dataset_version_image (version_id, image_id, split) VALUES (:version_id, :image_id, :split)")
+    for version_id, project_id, image_splits in versions:
+        try:
+            splits = json.loads(image_splits or '{}')
+        except ValueError:
+            print(f"  ⚠️ Unreadable splits on dataset version {version_id}, left empty")
+            splits = {}
+        # Images deleted since the version was made are dropped, as training already skipped them
+        existing = {image_id for (image_id,) in db.session.execute(
+            db.text("SELECT id FROM image WHERE project_id = :project_id"), {'project_id': project_id})}
+
+        rows = {}
+        for split in ('train', 'val', 'test'):
+            for image_id in splits.get(split, []):
+                if image_id in existing:
+                    rows.setdefault(image_id, {'version_id': version_id, 'image_id': image_id, 'split': split})
+        if rows:
+            db.session.execute(insert, list(rows.values()))
+
+        counts = {split: sum(1 for row in rows.values() if row['split'] == split) for split in ('train', 'val', 'test')}
+        db.session.execute(
+            db.text("UPDATE dataset_version SET train_count = :train, val_count = :val, test_count = :test WHERE id = :id"),
+            {**counts, 'id': version_id}
+        )
+    if versions:
+        print(f"  📋 Moved the splits of {len(versions)} dataset versions")
+
+    # New versions no longer write the NOT NULL JSON column
+    db.session.execute(db.text(f"ALTER TABLE {_quote('dataset_version')} DROP COLUMN {_quote('image_splits')}"))
+
+
+@migration(12, 'Displayed size of images with a rotating EXIF orientation', background=True)
+def orient_image_sizes():
+    """Swap width and height of images stored sideways with an EXIF orientation that turns them upright"""
+    from PIL import Image as PILImage
+    from models import Image
+    from image_normalize import TRANSPOSED_ORIENTATIONS
+    from image_probe import EXIF_ORIENTATION_TAG
+
+    # Lazy PDF pages have no file of their own and never carry EXIF
+    images = db.session.query(Image.id, Image.filepath, Image.width, Image.height).filter(
+        Image.source_hash.is_(None), Image.width != Image.height
+    ).all()
+
+    def sideways(path, width, height):
+        # Opening only reads the header
+        try:
+            with PILImage.open(path) as img:
+                orientation = img.getexif().get(EXIF_ORIENTATION_TAG)
+                return orientation in TRANSPOSED_ORIENTATIONS and img.size == (width, height)
+        except Exception:
+            return False
+
+    swapped = [(image_id, width, height) for image_id, path, width, height in images
+               if os.path.exists(path) and sideways(path, width, height)]
+    for start in range(0, len(swapped), 500):
+        with serialized_write():
+            for image_id, width, height in swapped[start:start + 500]:
+                Image.query.filter_by(id=image_id).update({Image.width: height, Image.height: width},
+                                                          synchronize_session=False)
+            db.session.commit()
+    if swapped:
+        print(f"  🔄 Recorded the upright size of {len(swapped)} EXIF-rotated images")
+
+
+def applied_versions():
+    return {version for (version,) in db.session.query(SchemaVersion.version)}
+
+
+def schema_version():
+    """Highest migration version applied to the database (0 for none)"""
+    return db.session.query(db.func.max(SchemaVersion.version)).scalar() or 0
+
+
+def _apply(step):
+    print(f"🔧 Migration {step.version}: {step.description}")
+    start = time.time()
+    try:
+        step.upgrade()
+        with serialized_write():
+            db.session.add(SchemaVersion(version=step.version, description=step.description, applied_at=datetime.utcnow()))
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    print(f"✅ Migration {step.version} applied in {time.time() - start:.1f}s")
+
+
+def run_migrations(app):
+    """
+    Apply pending migrations (call after db.create_all())
+
+    Schema migrations run before this returns, so requests never see an old
+    schema; background migrations are started on a thread afterwards. A
+    failed migration is raised and leaves later ones pending.
+    """
+    with app.app_context():
+        SchemaVersion.__table__.create(db.engine, checkfirst=True)
+        applied = applied_versions()
+        for step in MIGRATIONS:
+            if not step.background and step.version not in applied:
+                _apply(step)
+        background = [step for step in MIGRATIONS if step.background and step.version not in applied]
+        print(f"✅ Database schema at version {schema_version()}")
+
+    if not background:
+        return
+
+    def worker():
+        with app.app_context():
+            for step in background:
+                try:
+                    _apply(step)
+                except Exception as e:
+                    print(f"❌ Migration {step.version} failed: {e}")
+                    return
+
+    thread = threading.Thread(target=worker)
+    thread.daemon = True
+    thread.start()
+
+
+if __name__ == '__main__':
+    # Importing the app creates tables and starts the pending migrations
+    from app import app
+
+    with app.app_context():
+        applied = {row.version: row for row in SchemaVersion.query.all()}
+    for step in MIGRATIONS:
+        row = applied.get(step.version)
+        status = f"applied {row.applied_at:%Y-%m-%d %H:%M}" if row else 'pending'
+        print(f"{step.version:>3}  {status:<22} {step.description}")
@@ -1,6 +1,5 @@
 from database import db
 from datetime import datetime
-import json
 
 class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -9,6 +8,12 @@ class Project(db.Model):
     annotation_group = db.Column(db.String(200))
     thumbnail_image_id = db.Column(db.Integer)  # Reference to an image (stored as ID, not foreign key to avoid circular deps)
     thumbnail_path = db.Column(db.String(1000))  # Custom uploaded thumbnail
+    # Ingest policy applied to uploaded images (all off = store uploads as they are)
+    ingest_apply_orientation = db.Column(db.Boolean, default=False)  # Rotate pixels by EXIF orientation
+    ingest_format = db.Column(db.String(10))  # JPEG, PNG or WEBP; empty keeps the uploaded format
+    ingest_quality = db.Column(db.Integer, default=90)  # JPEG/WebP quality when re-encoding
+    ingest_max_side = db.Column(db.Integer)  # Cap on the longest side in pixels; empty = no cap
+    ingest_keep_originals = db.Column(db.Boolean, default=False)  # Keep replaced originals in cold storage
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -18,12 +23,14 @@ class Project(db.Model):
     dataset_versions = db.relationship('DatasetVersion', backref='project', lazy=True, cascade='all, delete-orphan')
     training_jobs = db.relationship('TrainingJob', backref='project', lazy=True, cascade='all, delete-orphan')
     custom_models = db.relationship('CustomModel', backref='project', lazy=True, cascade='all, delete-orphan')
+    ingest_jobs = db.relationship('IngestJob', backref='project', lazy=True, cascade='all, delete-orphan')
+    chunked_uploads = db.relationship('ChunkedUpload', backref='project', lazy=True, cascade='all, delete-orphan')
 
 class Class(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     color = db.Column(db.String(20))  # Hex color
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False, index=True)
     
     # Relationships
     annotations = db.relationship('Annotation', backref='class_obj', lazy=True, cascade='all, delete-orphan')
@@ -34,18 +41,89 @@ class Image(db.Model):
     filepath = db.Column(db.String(1000), nullable=False)
     width = db.Column(db.Integer)
     height = db.Column(db.Integer)
+    content_hash = db.Column(db.String(64), index=True)  # SHA-256 of the shared blob in the blob store
+    original_hash = db.Column(db.String(64))  # Blob of the untouched upload, if the ingest policy kept it
+    source_hash = db.Column(db.String(64), index=True)  # PDF blob of a lazily rendered page (filepath is its page cache file)
+    page_index = db.Column(db.Integer)  # Zero-based page of source_hash
+    dhash = db.Column(db.String(16), index=True)  # 64-bit perceptual difference hash (hex) for near-duplicate lookups
     batch_id = db.Column(db.String(100))  # For grouping uploaded images
     status = db.Column(db.String(50), default='unassigned')  # unassigned, annotating, completed
+    revision = db.Column(db.Integer, nullable=False, default=0)  # Bumped by every annotation save; stale saves are rejected
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
     
     # Relationships
     annotations = db.relationship('Annotation', backref='image', lazy=True, cascade='all, delete-orphan')
+    dataset_memberships = db.relationship('DatasetVersionImage', backref='image', lazy=True, cascade='all, delete-orphan')
+    
+    __table_args__ = (
+        # Per-project counts by status are answered from the index alone
+        db.Index('ix_image_project_status', 'project_id', 'status'),
+        # Keyset pagination and navigation seek on (uploaded_at, id) within a project
+        db.Index('ix_image_project_uploaded', 'project_id', 'uploaded_at', 'id'),
+        # Batch listings and per-batch duplicate clusters
+        db.Index('ix_image_project_batch', 'project_id', 'batch_id'),
+    )
+
+class Blob(db.Model):
+    sha256 = db.Column(db.String(64), primary_key=True)
+    filepath = db.Column(db.String(1000), nullable=False)
+    size = db.Column(db.BigInteger)  # Bytes
+    ref_count = db.Column(db.Integer, nullable=False, default=0)  # Number of Image rows pointing at this blob
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class IngestJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    batch_id = db.Column(db.String(100))  # Batch the ingested images are grouped under
+    status = db.Column(db.String(50), default='queued')  # queued, processing, completed, completed_with_errors, failed
+    socket_id = db.Column(db.String(100))  # Socket.IO session of the uploading client, for scoped progress events
+    dedupe_distance = db.Column(db.Integer)  # Skip images within this many hash bits of an existing one (None = keep all)
+    total_files = db.Column(db.Integer, default=0)
+    processed_files = db.Column(db.Integer, default=0)
+    failed_files = db.Column(db.Integer, default=0)
+    images_created = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    completed_at = db.Column(db.DateTime)
+    
+    # Relationships
+    files = db.relationship('IngestFile', backref='job', lazy=True, cascade='all, delete-orphan')
+
+class IngestFile(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('ingest_job.id'), nullable=False, index=True)
+    filename = db.Column(db.String(500), nullable=False)  # Original (secured) filename
+    staged_path = db.Column(db.String(1000))  # Where the upload waits until it is processed
+    content_hash = db.Column(db.String(64))  # SHA-256 if it was computed while the file was received
+    width = db.Column(db.Integer)  # Probed from the header while the file was received
+    height = db.Column(db.Integer)
+    image_format = db.Column(db.String(20))  # PIL format name, e.g. JPEG or PNG
+    orientation = db.Column(db.Integer)  # EXIF orientation (1 = upright)
+    status = db.Column(db.String(50), default='pending')  # pending, processing, completed, failed
+    error_message = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    images_created = db.Column(db.Integer, default=0)  # PDFs create one image per page
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+
+class ChunkedUpload(db.Model):
+    id = db.Column(db.String(36), primary_key=True)  # Random token the client uploads chunks to
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id'), nullable=False)
+    filename = db.Column(db.String(500), nullable=False)
+    total_size = db.Column(db.BigInteger, nullable=False)  # Bytes the client announced
+    received_bytes = db.Column(db.BigInteger, default=0)  # Offset the next chunk must start at
+    content_hash = db.Column(db.String(64))  # SHA-256, set once every byte has arrived
+    staged_path = db.Column(db.String(1000), nullable=False)
+    status = db.Column(db.String(50), default='uploading')  # uploading, complete, finalized
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 class Annotation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     image_id = db.Column(db.Integer, db.ForeignKey('image.id'), nullable=False)
-    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False)
+    class_id = db.Column(db.Integer, db.ForeignKey('class.id'), nullable=False, index=True)
     
     # Bounding box coordinates (normalized 0-1)
     x_center = db.Column(db.Float, nullable=False)
@@ -53,13 +131,20 @@ class Annotation(db.Model):
     width = db.Column(db.Float, nullable=False)
     height = db.Column(db.Float, nullable=False)
     
-    # Instance segmentation polygon (JSON array of normalized [x, y] coordinates)
-    # Format: [[x1, y1], [x2, y2], ...]
-    polygon_points = db.Column(db.Text)
+    # Instance segmentation polygon: normalized [x, y] vertices packed by polygon_codec,
+    # deferred so queries that only need boxes never read it. This is the only polygon
+    # column read or written; databases upgraded by migration 10 keep an emptied
+    # polygon_points JSON column that nothing uses
+    polygon_data = db.deferred(db.Column(db.LargeBinary))
     
     confidence = db.Column(db.Float, default=1.0)  # For model predictions
     is_predicted = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        # Per-image annotation counts and class filters
+        db.Index('ix_annotation_image_class', 'image_id', 'class_id'),
+    )
 
 class DatasetVersion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -75,18 +160,31 @@ class DatasetVersion(db.Model):
     # Random seed for reproducible splits
     seed = db.Column(db.Integer)
     
-    # Image assignments stored as JSON
-    # {"train": [img_id1, img_id2, ...], "val": [...], "test": [...]}
-    image_splits = db.Column(db.Text, nullable=False)
-    
-    # Statistics
+    # Statistics (split sizes as created; membership is in DatasetVersionImage)
     total_images = db.Column(db.Integer)
     total_annotations = db.Column(db.Integer)
+    train_count = db.Column(db.Integer, default=0)
+    val_count = db.Column(db.Integer, default=0)
+    test_count = db.Column(db.Integer, default=0)
     
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
     training_jobs = db.relationship('TrainingJob', backref='dataset_version', lazy=True)
+    images = db.relationship('DatasetVersionImage', backref='version', lazy=True, cascade='all, delete-orphan')
+
+class DatasetVersionImage(db.Model):
+    # Which split of a dataset version an image is in
+    version_id = db.Column(db.Integer, db.ForeignKey('dataset_version.id'), primary_key=True)
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id'), primary_key=True)
+    split = db.Column(db.String(10), nullable=False)  # train, val, test
+    
+    __table_args__ = (
+        # Materializing one split of a version
+        db.Index('ix_dataset_version_image_split', 'version_id', 'split', 'image_id'),
+        # Versions that contain an image
+        db.Index('ix_dataset_version_image_image', 'image_id'),
+    )
 
 class TrainingJob(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -135,3 +233,10 @@ class CustomModel(db.Model):
     file_size = db.Column(db.String(50))  # Human-readable file size
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+class SchemaVersion(db.Model):
+    # One row per migration in migrations.py that has been applied to this database
+    __tablename__ = 'schema_version'
+    
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200))
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,214 @@
+"""
+Near-duplicate detection for FreeFlow
+Every image gets a 64-bit difference hash (dHash) at ingest, stored on the
+Image row. Hashes of a project are kept in a BK-tree, so finding the images
+within a few bits (Hamming distance) of a hash doesn't compare against every
+image in the project.
+"""
+
+import threading
+from PIL import Image as PILImage, ImageOps
+from database import db
+from models import Image
+from image_probe import DECODE_CHECK_MAX_PIXELS
+
+# 8x8 gradient bits = a 64-bit hash, stored as 16 hex digits
+HASH_SIZE = 8
+# Hashes this many bits apart or fewer count as near-duplicates by default
+DEFAULT_MAX_DISTANCE = 6
+MAX_DISTANCE_LIMIT = 16
+
+# Per-project BK-trees, rebuilt when the project's hashed images change
+_project_trees = {}
+_project_trees_lock = threading.Lock()
+
+
+def dhash_file(path):
+    """
+    Difference hash of an image file, as 16 hex digits
+
+    The image is decoded at a reduced size where the format allows it (JPEG
+    draft mode) and EXIF orientation is applied first, so an upload and its
+    rotated, resized or re-encoded copy hash (nearly) the same.
+
+    Returns:
+        Hex string, or None for images too large to decode for hashing
+    """
+    with PILImage.open(path) as img:
+        if img.format == 'JPEG':
+            img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        elif img.width * img.height > DECODE_CHECK_MAX_PIXELS:
+            return None
+        img = ImageOps.exif_transpose(img)
+        small = img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), PILImage.Resampling.LANCZOS, reducing_gap=2.0)
+
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        for col in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + col]
+            right = pixels[row * (HASH_SIZE + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return f"{value:016x}"
+
+
+def safe_dhash(path):
+    """dhash_file() that logs and returns None instead of failing an ingest"""
+    try:
+        return dhash_file(path)
+    except Exception as e:
+        print(f"⚠️ Could not hash {path}: {e}")
+        return None
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over integer hashes with Hamming distance
+
+    Usage:
+        tree = BKTree()
+        tree.add(int(image.dhash, 16), image.id)
+        tree.search(int(other.dhash, 16), max_distance=6)  # [(distance, image id), ...]
+
+    A search only descends into children whose edge distance is within
+    max_distance of the query's distance to the node (triangle inequality).
+    """
+
+    def __init__(self):
+        # Node: [hash, items with that exact hash, {edge distance: child node}]
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [value, [item], {}]
+            return
+
+        node = self.root
+        while True:
+            distance = hamming_distance(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value, max_distance):
+        """Items within max_distance of value, nearest first, as (distance, item)"""
+        matches = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, item) for item in node[1])
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+def project_hash_tree(project_id):
+    """
+    BK-tree of a project's hashed images (items are Image ids)
+
+    Cached per project; the cache is rebuilt when the number of hashed images
+    or the newest hashed image changes (i.e. after uploads or deletions).
+    """
+    hashed = db.session.query(db.func.count(Image.id), db.func.max(Image.id)).filter(
+        Image.project_id == project_id, Image.dhash.isnot(None)
+    ).one()
+    signature = tuple(hashed)
+
+    with _project_trees_lock:
+        cached = _project_trees.get(project_id)
+        if cached and cached[0] == signature:
+            return cached[1]
+
+    tree = BKTree()
+    for image_id, dhash in db.session.query(Image.id, Image.dhash).filter(
+        Image.project_id == project_id, Image.dhash.isnot(None)
+    ):
+        tree.add(int(dhash, 16), image_id)
+
+    with _project_trees_lock:
+        _project_trees[project_id] = (signature, tree)
+    return tree
+
+
+def find_near_duplicates(image, max_distance=DEFAULT_MAX_DISTANCE):
+    """Other images of image's project within max_distance bits, as (distance, image id), nearest first"""
+    if not image.dhash:
+        return []
+    tree = project_hash_tree(image.project_id)
+    return [(distance, image_id) for distance, image_id in tree.search(int(image.dhash, 16), max_distance)
+            if image_id != image.id]
+
+
+def cluster_images(images, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Group images into clusters of near-duplicates (single linkage)
+
+    Returns:
+        List of clusters (lists of Image ids, in the order of images) with
+        more than one image, largest first
+    """
+    hashed = [image for image in images if image.dhash]
+    tree = BKTree()
+    for image in hashed:
+        tree.add(int(image.dhash, 16), image.id)
+
+    # Union-find over every pair the tree reports as close
+    parent = {image.id: image.id for image in hashed}
+
+    def find(image_id):
+        while parent[image_id] != image_id:
+            parent[image_id] = parent[parent[image_id]]
+            image_id = parent[image_id]
+        return image_id
+
+    for image in hashed:
+        for _, other_id in tree.search(int(image.dhash, 16), max_distance):
+            root, other_root = find(image.id), find(other_id)
+            if root != other_root:
+                parent[other_root] = root
+
+    clusters = {}
+    for image in hashed:
+        clusters.setdefault(find(image.id), []).append(image.id)
+    return sorted((members for members in clusters.values() if len(members) > 1), key=len, reverse=True)
+
+
+class DuplicateFilter:
+    """
+    Decide, one upload at a time, whether an image is a near-duplicate
+
+    Compares against the project's existing images and the images accepted
+    earlier in the same upload.
+    """
+
+    def __init__(self, project_id, max_distance):
+        self.max_distance = max_distance
+        self.existing = project_hash_tree(project_id)
+        self.accepted = BKTree()
+
+    def match(self, dhash):
+        """(distance, Image id or None for an earlier file of this upload) of the closest match, or None"""
+        if not dhash:
+            return None
+        value = int(dhash, 16)
+        matches = self.existing.search(value, self.max_distance) + self.accepted.search(value, self.max_distance)
+        return min(matches, key=lambda match: match[0]) if matches else None
+
+    def accept(self, dhash):
+        if dhash:
+            self.accepted.add(int(dhash, 16), None)
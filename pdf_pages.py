@@ -0,0 +1,123 @@
+"""
+Lazily rendered PDF pages for FreeFlow
+Long PDFs are stored once in the blob store and get one Image row per page
+up front, sized from the page metadata. A page is rendered to JPEG the first
+time something needs its pixels (serving, inference, dataset export) and
+kept in the page cache from then on; the annotator's next pages and the
+grid's missing thumbnails are rendered ahead of time. Renders run in the
+shared render pool, so the server process only waits for them.
+"""
+
+import os
+import glob
+import threading
+from flask import current_app
+from database import db
+from models import Blob
+from pdf_render import render_file
+
+# Renders under way, by page cache path: a request for a page that is already
+# being rendered (by a prefetch or another request) waits on the same future
+_rendering = {}
+_rendering_lock = threading.Lock()
+
+
+def lazy_pdf_pages(total_pages):
+    """Whether a PDF with total_pages pages is ingested lazily (PDF_LAZY_MIN_PAGES, 0 = never)"""
+    min_pages = current_app.config.get('PDF_LAZY_MIN_PAGES', 0)
+    return bool(min_pages) and total_pages >= min_pages
+
+
+def page_cache_root():
+    """Folder lazily rendered pages are cached in"""
+    return current_app.config.get('PDF_PAGE_CACHE') or os.path.join(current_app.config['UPLOAD_FOLDER'], 'pages')
+
+
+def page_cache_path(pdf_hash, page_index):
+    """Where page page_index of the PDF blob pdf_hash is cached once rendered"""
+    return os.path.join(page_cache_root(), pdf_hash[:2], f"{pdf_hash}-{page_index + 1}.jpg")
+
+
+def is_lazy_page(image):
+    return image.source_hash is not None and image.page_index is not None
+
+
+def is_unrendered_page(image):
+    """Whether image is a lazy PDF page that isn't in the page cache yet"""
+    return is_lazy_page(image) and not os.path.exists(image.filepath)
+
+
+def ensure_image_file(image):
+    """
+    Path of an image's file, rendering it first if it is a lazy PDF page that isn't cached yet
+
+    Returns None if the file (or, for a page, its PDF) is missing.
+    """
+    if os.path.exists(image.filepath):
+        return image.filepath
+    if not is_lazy_page(image):
+        return None
+
+    try:
+        render = _page_render(image.source_hash, image.page_index, image.filepath)
+        if render:
+            # Waiting on the pool yields to other requests under eventlet
+            render.result()
+    except Exception as e:
+        print(f"❌ Rendering page {image.page_index + 1} for image {image.id} failed: {e}")
+        return None
+    return image.filepath if os.path.exists(image.filepath) else None
+
+
+def _page_render(pdf_hash, page_index, path):
+    """Future of rendering one page of a PDF blob into the page cache, or None if the PDF is missing"""
+    with _rendering_lock:
+        render = _rendering.get(path)
+    if render:
+        return render
+
+    blob = db.session.get(Blob, pdf_hash)
+    if not blob or not os.path.exists(blob.filepath):
+        print(f"⚠️ PDF {pdf_hash[:12]} for page {page_index + 1} is missing")
+        return None
+
+    with _rendering_lock:
+        render = _rendering.get(path)
+        if render:
+            return render
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        render = _rendering[path] = render_file(blob.filepath, page_index, path)
+
+    def finished(done):
+        with _rendering_lock:
+            if _rendering.get(path) is done:
+                del _rendering[path]
+    # Outside the lock: a render that has already finished runs the callback right here
+    render.add_done_callback(finished)
+    return render
+
+
+def prefetch_pages(images):
+    """Start rendering the lazy pages among images that aren't cached yet, without waiting for them"""
+    for image in images:
+        if not is_unrendered_page(image):
+            continue
+        render = _page_render(image.source_hash, image.page_index, image.filepath)
+        if render:
+            render.add_done_callback(_report_prefetch(image.source_hash, image.page_index))
+
+
+def _report_prefetch(pdf_hash, page_index):
+    def report(done):
+        if not done.cancelled() and done.exception():
+            print(f"⚠️ Prefetching page {page_index + 1} of PDF {pdf_hash[:12]} failed: {done.exception()}")
+    return report
+
+
+def remove_page_cache(pdf_hash):
+    """Delete every cached page of a PDF blob (once no image refers to it any more)"""
+    for path in glob.glob(os.path.join(page_cache_root(), pdf_hash[:2], f"{pdf_hash}-*.jpg")):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"⚠️ Failed to delete cached page {path}: {e}")
@@ -0,0 +1,281 @@
+"""
+PDF page rendering for FreeFlow
+Renders PDF pages to JPEG across a process pool that is started once and
+shared by every document; each worker opens documents on its own because
+pdfium handles are not shareable between processes
+"""
+
+import os
+import math
+import uuid
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pypdfium2 as pdfium
+from PIL import Image as PILImage
+
+# Pages are rendered at 2x (144 DPI) unless that exceeds MAX_RESOLUTION
+BASE_SCALE = 2.0
+MAX_RESOLUTION = 2000  # Maximum resolution on longest side
+JPEG_QUALITY = 90
+
+# Document a pool worker has open (see _worker_document)
+_worker_pdf = None
+_worker_pdf_path = None
+
+# The shared render pool (see render_pool)
+_pool = None
+_pool_guard = threading.Lock()
+
+# pdfium is not thread-safe: every pdfium call in this process (page counts and
+# sizes, single-worker renders) holds this lock; pool workers, which also render
+# lazy pages, are separate processes and don't need it
+pdfium_lock = threading.Lock()
+
+
+def _worker_document(pdf_path):
+    """A pool worker's open PdfDocument for pdf_path; consecutive pages of one PDF reuse it"""
+    global _worker_pdf, _worker_pdf_path
+    if _worker_pdf_path != pdf_path:
+        if _worker_pdf is not None:
+            _worker_pdf.close()
+        _worker_pdf = pdfium.PdfDocument(pdf_path)
+        _worker_pdf_path = pdf_path
+    return _worker_pdf
+
+
+def page_target_size(page, max_resolution=MAX_RESOLUTION):
+    """
+    Size of a page's output image and the scale to render it at
+
+    The size is exactly what rendering at BASE_SCALE and shrinking to
+    max_resolution produces, so page dimensions don't depend on how the
+    page is rendered.
+
+    Returns:
+        Tuple of (width, height, render scale, size at BASE_SCALE)
+    """
+    return target_size(page.get_width(), page.get_height(), max_resolution)
+
+
+def target_size(page_width, page_height, max_resolution=MAX_RESOLUTION):
+    """page_target_size() from a page's size in points (e.g. PdfDocument.get_page_size)"""
+    base_width = math.ceil(page_width * BASE_SCALE)
+    base_height = math.ceil(page_height * BASE_SCALE)
+    max_dimension = max(base_width, base_height)
+
+    if max_dimension <= max_resolution:
+        return base_width, base_height, BASE_SCALE, (base_width, base_height)
+
+    scale_factor = max_resolution / max_dimension
+    width = int(base_width * scale_factor)
+    height = int(base_height * scale_factor)
+    return width, height, BASE_SCALE * scale_factor, (base_width, base_height)
+
+
+def page_sizes(pdf_path, max_resolution=MAX_RESOLUTION):
+    """
+    Output (width, height) of every page of a PDF, from page metadata alone
+
+    Pages are neither loaded nor rendered, so this is fast even for
+    documents with thousands of pages.
+    """
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return [target_size(*pdf.get_page_size(index), max_resolution)[:2] for index in range(len(pdf))]
+        finally:
+            pdf.close()
+
+
+def render_page(page_index, output_path, max_resolution=MAX_RESOLUTION, pdf=None):
+    """
+    Render one page straight to its target size and save it as JPEG
+
+    Args:
+        page_index: Zero-based page number
+        output_path: Where to write the JPEG
+        max_resolution: Cap on the longest side
+        pdf: Open PdfDocument (defaults to the pool worker's document);
+            callers in the server process must hold pdfium_lock
+
+    Returns:
+        Dictionary with page_index, width, height, filepath and base_size
+    """
+    pdf = pdf or _worker_pdf
+    page = pdf[page_index]
+    width, height, scale, base_size = page_target_size(page, max_resolution)
+
+    pil_image = page.render(scale=scale).to_pil()
+    # ceil() in the renderer can overshoot the target by a pixel
+    if pil_image.size != (width, height):
+        pil_image = pil_image.resize((width, height), PILImage.Resampling.LANCZOS)
+
+    pil_image.save(output_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    page.close()
+
+    return {
+        'page_index': page_index,
+        'width': width,
+        'height': height,
+        'filepath': output_path,
+        'base_size': base_size
+    }
+
+
+def _render_page_job(job):
+    pdf_path, page_index, output_path, max_resolution = job
+    return render_page(page_index, output_path, max_resolution, pdf=_worker_document(pdf_path))
+
+
+def _render_file_job(job):
+    pdf_path, page_index, path, max_resolution = job
+    if os.path.exists(path):
+        return None
+    temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        result = render_page(page_index, temp_path, max_resolution, pdf=_worker_document(pdf_path))
+        # Readers never see a half-written page
+        os.replace(temp_path, path)
+        return dict(result, filepath=path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def render_workers(total_pages, workers=None):
+    """Number of processes to render a document with (defaults to all cores)"""
+    workers = workers or os.cpu_count() or 1
+    return max(1, min(workers, total_pages))
+
+
+def _pool_context():
+    """
+    Start method for render pools
+
+    The server runs request and ingest threads, and forking a threaded
+    process can leave a child holding locks (pdfium's among them) that no
+    thread will release. forkserver forks workers from a separate
+    single-threaded process instead; spawn is the fallback where it isn't
+    available.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        # Workers only need this module (pypdfium2 and PIL); preloading it in the server
+        # saves each new worker the import, without dragging the app into the server
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+
+def render_pool():
+    """
+    The process pool pages are rendered in
+
+    Started on first use with a worker per core and kept for the life of the
+    process, so a document doesn't wait for processes to start (and import
+    pypdfium2) before its first page. Ingests and lazy page renders share it.
+    """
+    global _pool
+    with _pool_guard:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=_pool_context())
+        return _pool
+
+
+def _discard_pool(pool):
+    """Drop a pool a worker died in (it refuses new work), so the next render starts a fresh one"""
+    global _pool
+    with _pool_guard:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def render_file(pdf_path, page_index, path, max_resolution=MAX_RESOLUTION):
+    """
+    Render one page to path in the render pool, unless path already exists
+
+    The page is written to a temporary file and moved into place, so path
+    only ever holds a whole page. The folder of path must exist.
+
+    Returns:
+        Future of the render_page() result (None if path already existed)
+    """
+    pool = render_pool()
+    try:
+        return pool.submit(_render_file_job, (pdf_path, page_index, path, max_resolution))
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        return render_pool().submit(_render_file_job, (pdf_path, page_index, path, max_resolution))
+
+
+def render_pdf_pages(pdf_path, output_folder, total_pages, max_resolution=MAX_RESOLUTION, workers=None):
+    """
+    Render every page of a PDF, yielding results in page order
+
+    Pages are fanned out over the shared render pool, at most workers at a
+    time so documents ingested together take turns; results are yielded in
+    page order as they complete, so progress can be reported page by page.
+    The document is only opened in the pool workers (or, with one worker, in
+    this process once no pool is needed).
+
+    Args:
+        pdf_path: PDF file to render
+        output_folder: Folder for the page JPEGs
+        total_pages: Page count of the PDF (see count_pages)
+        max_resolution: Cap on the longest side
+        workers: Number of pages rendered at once (defaults to all cores)
+
+    Yields:
+        Dictionary per page (see render_page)
+    """
+    jobs = [
+        (page_index, os.path.join(output_folder, f"pdf_page_{page_index + 1}_{uuid.uuid4()}.jpg"), max_resolution)
+        for page_index in range(total_pages)
+    ]
+    workers = render_workers(total_pages, workers)
+
+    if workers > 1:
+        pool = render_pool()
+        # Futures are collected in submission order, so progress stays in page order
+        pending = deque()
+        try:
+            for job in jobs:
+                pending.append(pool.submit(_render_page_job, (pdf_path, *job)))
+                if len(pending) >= workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        except BrokenProcessPool:
+            _discard_pool(pool)
+            raise
+        finally:
+            # An abandoned ingest leaves no queued pages behind
+            for future in pending:
+                future.cancel()
+        return
+
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        for job in jobs:
+            # Released between pages, so lazy renders and uploads aren't held up by a whole document
+            with pdfium_lock:
+                result = render_page(*job, pdf=pdf)
+            yield result
+    finally:
+        with pdfium_lock:
+            pdf.close()
+
+
+def count_pages(pdf_path):
+    """Number of pages in a PDF"""
+    with pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
@@ -0,0 +1,52 @@
+"""
+Packed binary storage for annotation polygons
+A polygon is stored as a 5-byte header (encoding, vertex count) followed by
+its x, y pairs. Normalized coordinates inside [0, 1] are quantized to
+uint16, which is finer than a pixel of a 65k-pixel image and a fraction of
+the size of the JSON text; polygons with a point outside the image fall
+back to float32.
+"""
+
+import struct
+
+HEADER = struct.Struct('<BI')  # Encoding, vertex count
+QUANTIZED = 1  # uint16 steps of 1/65535
+FLOAT32 = 2
+QUANTIZE_SCALE = 65535
+# Decoded coordinates are rounded to this many decimals (the uint16 step is ~1.5e-5)
+DECIMALS = 6
+
+
+def encode_polygon(points):
+    """
+    Pack a polygon for Annotation.polygon_data
+
+    Args:
+        points: Normalized [x, y] vertices
+
+    Returns:
+        Bytes, or None for an empty polygon
+    """
+    if not points:
+        return None
+    values = [float(value) for point in points for value in point[:2]]
+    count = len(values) // 2
+
+    if all(0.0 <= value <= 1.0 for value in values):
+        quantized = [round(value * QUANTIZE_SCALE) for value in values]
+        return HEADER.pack(QUANTIZED, count) + struct.pack(f'<{len(values)}H', *quantized)
+    return HEADER.pack(FLOAT32, count) + struct.pack(f'<{len(values)}f', *values)
+
+
+def decode_polygon(data):
+    """Normalized [x, y] vertices of packed polygon bytes (None for None)"""
+    if not data:
+        return None
+    encoding, count = HEADER.unpack_from(data)
+    if encoding == QUANTIZED:
+        values = [value / QUANTIZE_SCALE for value in struct.unpack_from(f'<{count * 2}H', data, HEADER.size)]
+    elif encoding == FLOAT32:
+        values = struct.unpack_from(f'<{count * 2}f', data, HEADER.size)
+    else:
+        raise ValueError(f"Unknown polygon encoding {encoding}")
+    return [[round(values[i], DECIMALS), round(values[i + 1], DECIMALS)] for i in range(0, len(values), 2)]
@@ -0,0 +1,217 @@
+"""
+Resumable chunked uploads for FreeFlow
+Clients create an upload, PUT chunks at explicit byte offsets, can ask for the
+received offset after a dropped connection, and finalize finished uploads into
+an ingest job. Chunks are appended straight to the staged file and hashed on
+the way in, so the file is never spooled or re-read.
+"""
+
+import os
+import hashlib
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from flask import current_app
+from werkzeug.utils import secure_filename
+from database import db
+from models import ChunkedUpload
+
+# Suggested chunk size for clients
+CHUNK_SIZE = 8 * 1024 * 1024
+STREAM_BLOCK_SIZE = 1024 * 1024
+# Seconds between sweeps for abandoned uploads
+EXPIRE_INTERVAL = 10 * 60
+
+# Running SHA-256 per upload, as (hasher, bytes hashed); rebuilt from disk after a restart
+_hashers = {}
+# One writer per upload at a time
+_upload_locks = {}
+_upload_locks_guard = threading.Lock()
+_last_expire_sweep = 0.0
+
+
+class UploadOffsetMismatch(Exception):
+    """A chunk did not start at the upload's received offset"""
+
+    def __init__(self, expected):
+        super().__init__(f'Chunk must start at offset {expected}')
+        self.expected = expected
+
+
+class UploadBusy(Exception):
+    """Another request is already writing to this upload"""
+
+
+def chunked_staging_dir():
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], 'staging', 'chunked')
+
+
+def _upload_lock(upload_id):
+    with _upload_locks_guard:
+        if upload_id not in _upload_locks:
+            _upload_locks[upload_id] = threading.Lock()
+        return _upload_locks[upload_id]
+
+
+def _forget_upload(upload_id):
+    """Drop the in-memory hasher and lock of an upload that takes no more chunks"""
+    _hashers.pop(upload_id, None)
+    with _upload_locks_guard:
+        _upload_locks.pop(upload_id, None)
+
+
+def expire_stale_uploads(force=False):
+    """
+    Delete uploads that received no chunk for CHUNKED_UPLOAD_TTL_HOURS (caller commits)
+
+    Runs at most once per EXPIRE_INTERVAL unless force is set. Staged files
+    left behind without an upload row (e.g. after a crash) go too.
+
+    Returns:
+        Number of upload rows deleted
+    """
+    global _last_expire_sweep
+    ttl_hours = current_app.config.get('CHUNKED_UPLOAD_TTL_HOURS', 24)
+    now = time.time()
+    if ttl_hours <= 0 or (not force and now - _last_expire_sweep < EXPIRE_INTERVAL):
+        return 0
+    _last_expire_sweep = now
+
+    cutoff = datetime.utcnow() - timedelta(hours=ttl_hours)
+    expired = 0
+    for upload in ChunkedUpload.query.filter(ChunkedUpload.updated_at < cutoff).all():
+        lock = _upload_lock(upload.id)
+        if not lock.acquire(blocking=False):
+            continue  # A chunk is arriving right now
+        try:
+            discard_upload(upload)
+            db.session.delete(upload)
+            expired += 1
+        finally:
+            lock.release()
+
+    staging_dir = chunked_staging_dir()
+    if os.path.isdir(staging_dir):
+        known = {path for (path,) in db.session.query(ChunkedUpload.staged_path)}
+        for name in os.listdir(staging_dir):
+            path = os.path.join(staging_dir, name)
+            try:
+                if path not in known and os.path.getmtime(path) < now - ttl_hours * 3600:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    if expired:
+        print(f"🧹 Expired {expired} abandoned upload(s)")
+    return expired
+
+
+def create_upload(project_id, filename, total_size):
+    """Register a new upload and create its empty staged file (caller commits)"""
+    expire_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    os.makedirs(chunked_staging_dir(), exist_ok=True)
+    staged_path = os.path.join(chunked_staging_dir(), f"{upload_id}.part")
+    open(staged_path, 'wb').close()
+
+    upload = ChunkedUpload(
+        id=upload_id,
+        project_id=project_id,
+        filename=secure_filename(filename),
+        total_size=total_size,
+        received_bytes=0,
+        staged_path=staged_path,
+        status='uploading'
+    )
+    db.session.add(upload)
+    _hashers[upload_id] = (hashlib.sha256(), 0)
+    return upload
+
+
+def _running_hash(upload):
+    """The upload's hasher positioned at received_bytes, rebuilding it from the staged file if needed"""
+    hasher, hashed = _hashers.get(upload.id, (None, -1))
+    if hasher is not None and hashed == upload.received_bytes:
+        return hasher
+
+    hasher = hashlib.sha256()
+    remaining = upload.received_bytes
+    with open(upload.staged_path, 'rb') as f:
+        while remaining > 0:
+            block = f.read(min(STREAM_BLOCK_SIZE, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            remaining -= len(block)
+    return hasher
+
+
+def write_chunk(upload, offset, stream):
+    """
+    Append a chunk read from stream at offset (caller commits)
+
+    Bytes are written and hashed as they arrive; if the client disconnects
+    mid-chunk, whatever arrived is kept and the offset reflects it.
+
+    Raises:
+        UploadOffsetMismatch: offset is not the number of bytes received so far
+        UploadBusy: another chunk for this upload is being written
+    """
+    lock = _upload_lock(upload.id)
+    if not lock.acquire(blocking=False):
+        raise UploadBusy()
+
+    try:
+        if offset != upload.received_bytes:
+            raise UploadOffsetMismatch(upload.received_bytes)
+
+        hasher = _running_hash(upload)
+        received = upload.received_bytes
+        limit = upload.total_size
+
+        try:
+            with open(upload.staged_path, 'r+b') as out:
+                # Drop anything past the acknowledged offset (a chunk cut off before it was recorded)
+                out.truncate(received)
+                out.seek(received)
+                while received < limit:
+                    block = stream.read(min(STREAM_BLOCK_SIZE, limit - received))
+                    if not block:
+                        break
+                    out.write(block)
+                    hasher.update(block)
+                    received += len(block)
+        finally:
+            upload.received_bytes = received
+            _hashers[upload.id] = (hasher, received)
+
+        if received == upload.total_size:
+            upload.content_hash = hasher.hexdigest()
+            upload.status = 'complete'
+    finally:
+        lock.release()
+        if upload.status == 'complete':
+            _forget_upload(upload.id)
+
+
+def discard_upload(upload):
+    """Delete an upload's staged file (caller deletes the row and commits)"""
+    _forget_upload(upload.id)
+    try:
+        if os.path.exists(upload.staged_path):
+            os.remove(upload.staged_path)
+    except Exception as e:
+        print(f"⚠️ Failed to delete staged upload {upload.id}: {e}")
+
+
+def serialize_upload(upload):
+    return {
+        'upload_id': upload.id,
+        'filename': upload.filename,
+        'size': upload.total_size,
+        'offset': upload.received_bytes,
+        'status': upload.status,
+        'content_hash': upload.content_hash,
+        'chunk_size': CHUNK_SIZE
+    }
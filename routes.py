@@ -1,15 +1,33 @@
-from flask import render_template, request, jsonify, send_from_directory, send_file, current_app
+from flask import render_template, request, jsonify, current_app
 from database import db
-from models import Project, Image, Annotation, Class, DatasetVersion, TrainingJob, CustomModel
+from models import Project, Image, Annotation, Class, DatasetVersion, DatasetVersionImage, TrainingJob, CustomModel, IngestJob, ChunkedUpload
 from werkzeug.utils import secure_filename
-from PIL import Image as PILImage
-import pypdfium2 as pdfium
 from pathlib import Path
 import os
 import json
 from datetime import datetime
 import uuid
+import re
 import threading
+import base64
+import binascii
+from types import SimpleNamespace
+from functools import partial
+from file_serving import send_cached_file, image_version
+from ingest import create_ingest_job, create_ingest_job_from_staged, start_ingest_job, is_job_running, retry_ingest_job, serialize_ingest_job, remove_ingest_staging
+from resumable_upload import create_upload, write_chunk, discard_upload, serialize_upload, UploadOffsetMismatch, UploadBusy
+from blob_store import release_image_file
+from image_probe import probe_file, probe_hashed_file, ImageProbeError
+from archive_ingest import is_archive
+from bulk_insert import ImageBatchWriter
+from dataset_importer import DATASET_FORMATS, DatasetImportError, resolve_dataset_dir, create_dataset_import_job, run_dataset_import
+from label_formats import parse_yolo_labels, annotation_row
+from polygon_codec import encode_polygon, decode_polygon
+from dataset_versions import add_version_images
+from image_normalize import OUTPUT_FORMATS, ingest_policy, serialize_ingest_policy, store_normalized
+from pdf_pages import ensure_image_file, is_unrendered_page, prefetch_pages
+from near_duplicates import DEFAULT_MAX_DISTANCE, MAX_DISTANCE_LIMIT, safe_dhash, find_near_duplicates, cluster_images
+from derivatives import needs_tiles, tile_descriptor, ensure_tile_pyramid, tile_path, remove_image_derivatives, ensure_thumbnail, build_sprite, sprite_paths, ensure_display_image, display_version, needs_display_derivative, derivative_version
 
 # App and socketio will be injected by app.py
 _app_instance = None
@@ -23,8 +41,22 @@ def init_routes(app, socketio):
 
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'tiff', 'bmp'}
 
+# Upper bound on thumbnails packed into one sprite (the grid shows at most 100 per page)
+MAX_SPRITE_IMAGES = 200
+
+# Images per page of a project listing (the grid offers up to 200 per page)
+DEFAULT_IMAGES_PER_PAGE = 25
+MAX_IMAGES_PER_PAGE = 200
+
+# Neighbours on each side returned with an annotate navigation step
+NAVIGATION_WINDOW = 2
+MAX_NAVIGATION_WINDOW = 10
+
+# Near-duplicates listed for one image
+MAX_NEAR_DUPLICATES = 200
+
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return '.' in filename and (filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS or is_archive(filename))
 
 # ==================== MAIN PAGES ====================
 
@@ -48,9 +80,21 @@ def training_page(project_id):
 
 # ==================== API ENDPOINTS ====================
 
+def _image_counts(project_id=None):
+    """(image count, annotated count) per project id, from one GROUP BY query instead of loading every image"""
+    query = db.session.query(
+        Image.project_id,
+        db.func.count(Image.id),
+        db.func.sum(db.case((Image.status == 'completed', 1), else_=0))
+    )
+    if project_id is not None:
+        query = query.filter(Image.project_id == project_id)
+    return {pid: (total, annotated or 0) for pid, total, annotated in query.group_by(Image.project_id)}
+
 def get_projects():
     """Get all projects"""
     projects = Project.query.order_by(Project.updated_at.desc()).all()
+    counts = _image_counts()
     return jsonify([{
         'id': p.id,
         'name': p.name,
@@ -58,8 +102,8 @@ def get_projects():
         'annotation_group': p.annotation_group,
         'created_at': p.created_at.isoformat(),
         'updated_at': p.updated_at.isoformat(),
-        'image_count': len(p.images),
-        'annotated_count': sum(1 for img in p.images if img.status == 'completed')
+        'image_count': counts.get(p.id, (0, 0))[0],
+        'annotated_count': counts.get(p.id, (0, 0))[1]
     } for p in projects])
 
 def create_project():
@@ -92,6 +136,7 @@ def create_project():
 def get_project(project_id):
     """Get project details"""
     project = Project.query.get_or_404(project_id)
+    image_count, annotated_count = _image_counts(project_id).get(project_id, (0, 0))
     
     return jsonify({
         'id': project.id,
@@ -99,8 +144,9 @@ def get_project(project_id):
         'project_type': project.project_type,
         'annotation_group': project.annotation_group,
         'created_at': project.created_at.isoformat(),
-        'image_count': len(project.images),
-        'annotated_count': sum(1 for img in project.images if img.status == 'completed'),
+        'ingest_policy': serialize_ingest_policy(project),
+        'image_count': image_count,
+        'annotated_count': annotated_count,
         'classes': [{
             'id': cls.id,
             'name': cls.name,
@@ -141,12 +187,10 @@ def delete_project(project_id):
     """Delete a project"""
     project = Project.query.get_or_404(project_id)
     
-    # Delete all associated files
+    # Delete all associated files (shared blobs are kept while other images use them)
     for image in project.images:
-        try:
-            os.remove(image.filepath)
-        except:
-            pass
+        release_image_file(image)
+        remove_image_derivatives(image.id)
     
     # Delete custom thumbnail if exists
     if project.thumbnail_path and os.path.exists(project.thumbnail_path):
@@ -155,13 +199,19 @@ def delete_project(project_id):
         except:
             pass
     
+    # Drop uploads still waiting in the ingest staging area
+    for job in project.ingest_jobs:
+        remove_ingest_staging(job.id)
+    for upload in project.chunked_uploads:
+        discard_upload(upload)
+    
     db.session.delete(project)
     db.session.commit()
     
     return jsonify({'message': 'Project deleted successfully'})
 
 def update_project_settings(project_id):
-    """Update project settings (name, thumbnail)"""
+    """Update project settings (name, thumbnail, ingest policy)"""
     project = Project.query.get_or_404(project_id)
     data = request.json
     
@@ -185,6 +235,28 @@ def update_project_settings(project_id):
             else:
                 return jsonify({'error': 'Image not found'}), 404
     
+    # Update ingest policy if provided (applies to images added from now on)
+    if 'ingest_policy' in data:
+        policy = data['ingest_policy'] or {}
+        output_format = (policy.get('format') or '').upper() or None
+        if output_format and output_format not in OUTPUT_FORMATS:
+            return jsonify({'error': f"Format must be one of {', '.join(OUTPUT_FORMATS)}"}), 400
+        try:
+            quality = int(policy.get('quality') or 90)
+            max_side = int(policy['max_side']) if policy.get('max_side') else None
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Quality and max side must be numbers'}), 400
+        if not 1 <= quality <= 100:
+            return jsonify({'error': 'Quality must be between 1 and 100'}), 400
+        if max_side is not None and max_side < 16:
+            return jsonify({'error': 'Max side must be at least 16 pixels'}), 400
+        
+        project.ingest_apply_orientation = bool(policy.get('apply_orientation'))
+        project.ingest_format = output_format
+        project.ingest_quality = quality
+        project.ingest_max_side = max_side
+        project.ingest_keep_originals = bool(policy.get('keep_originals'))
+    
     project.updated_at = datetime.utcnow()
     db.session.commit()
     
@@ -234,190 +306,223 @@ def upload_project_thumbnail(project_id):
 
 def get_project_thumbnail(project_id):
     """Get project thumbnail image"""
-    from flask import send_file
-    
     project = Project.query.get_or_404(project_id)
     
     # Check if custom thumbnail exists
     if project.thumbnail_path and os.path.exists(project.thumbnail_path):
-        return send_file(project.thumbnail_path)
+        return send_cached_file(project.thumbnail_path)
     
     # Check if thumbnail image ID is set
     if project.thumbnail_image_id:
         image = Image.query.get(project.thumbnail_image_id)
-        if image and os.path.exists(image.filepath):
-            return send_file(image.filepath)
+        if image and ensure_image_file(image):
+            return send_cached_file(image.filepath, version=image_version(image))
     
     # Return placeholder or first image
     first_image = Image.query.filter_by(project_id=project_id).order_by(Image.uploaded_at).first()
-    if first_image and os.path.exists(first_image.filepath):
-        return send_file(first_image.filepath)
+    if first_image and ensure_image_file(first_image):
+        return send_cached_file(first_image.filepath, version=image_version(first_image))
     
     return jsonify({'error': 'No thumbnail available'}), 404
 
 def upload_images(project_id):
-    """Upload images or PDFs to a project"""
+    """Stage uploaded images or PDFs and ingest them in the background"""
     project = Project.query.get_or_404(project_id)
     
     if 'files' not in request.files:
         return jsonify({'error': 'No files provided'}), 400
     
-    files = request.files.getlist('files')
-    batch_id = str(uuid.uuid4())
-    uploaded_images = []
+    files = [f for f in request.files.getlist('files') if f and allowed_file(f.filename)]
+    if not files:
+        return jsonify({'error': 'No supported files provided'}), 400
     
-    from flask import current_app
-    project_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(project_id))
-    os.makedirs(project_folder, exist_ok=True)
+    # Only land the files on disk here (hashed and probed on the way); PDF rendering and DB inserts happen in the worker
+    job, rejected = create_ingest_job(project_id, files, socket_id=request.form.get('socket_id'),
+                                      dedupe_distance=_dedupe_distance(request.form))
+    if not job:
+        return jsonify({'error': 'No valid files provided', 'rejected': rejected}), 400
+    start_ingest_job(_app_instance, _socketio_instance, job.id)
     
-    for file in files:
-        if file and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            file_ext = filename.rsplit('.', 1)[1].lower()
-            
-            if file_ext == 'pdf':
-                # Extract images from PDF
-                pdf_images = extract_images_from_pdf(file, project_folder, batch_id, project_id)
-                
-                # Create database entries for each extracted PDF page
-                for pdf_img in pdf_images:
-                    image = Image(
-                        filename=pdf_img['filename'],
-                        filepath=pdf_img['filepath'],
-                        width=pdf_img['width'],
-                        height=pdf_img['height'],
-                        batch_id=batch_id,
-                        project_id=project_id
-                    )
-                    db.session.add(image)
-                
-                uploaded_images.extend(pdf_images)
-            else:
-                # Save image directly
-                unique_filename = f"{uuid.uuid4()}_{filename}"
-                filepath = os.path.join(project_folder, unique_filename)
-                file.save(filepath)
-                
-                # Get image dimensions
-                with PILImage.open(filepath) as img:
-                    width, height = img.size
-                
-                # Create database entry
-                image = Image(
-                    filename=filename,
-                    filepath=filepath,
-                    width=width,
-                    height=height,
-                    batch_id=batch_id,
-                    project_id=project_id
-                )
-                db.session.add(image)
-                uploaded_images.append({
-                    'filename': filename,
-                    'width': width,
-                    'height': height
-                })
+    return jsonify({
+        'message': f'Queued {job.total_files} files for ingest',
+        'job_id': job.id,
+        'batch_id': job.batch_id,
+        'status_url': f'/api/ingest/{job.id}',
+        'rejected': rejected
+    }), 202
+
+def _dedupe_distance(options):
+    """Hash distance within which an upload skips near-duplicates (skip_duplicates, duplicate_distance), or None"""
+    if str(options.get('skip_duplicates', '')).lower() not in ('true', '1', 'on'):
+        return None
+    try:
+        distance = int(options.get('duplicate_distance') or DEFAULT_MAX_DISTANCE)
+    except (TypeError, ValueError):
+        distance = DEFAULT_MAX_DISTANCE
+    return min(max(distance, 0), MAX_DISTANCE_LIMIT)
+
+def _max_distance_arg():
+    """max_distance query parameter, clamped to what the hash lookups support"""
+    distance = request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int)
+    return min(max(distance, 0), MAX_DISTANCE_LIMIT)
+
+def create_chunked_upload(project_id):
+    """Start a resumable chunked upload of one file"""
+    Project.query.get_or_404(project_id)
+    data = request.json or {}
+    filename = data.get('filename')
+    size = data.get('size')
+    
+    if not filename or not allowed_file(filename):
+        return jsonify({'error': 'Unsupported file type'}), 400
+    if not isinstance(size, int) or size <= 0:
+        return jsonify({'error': 'size must be a positive number of bytes'}), 400
+    
+    upload = create_upload(project_id, filename, size)
+    db.session.commit()
+    return jsonify(serialize_upload(upload)), 201
+
+def get_chunked_upload(upload_id):
+    """Get how many bytes of a chunked upload have been received"""
+    upload = ChunkedUpload.query.get_or_404(upload_id)
+    return jsonify(serialize_upload(upload))
+
+def put_upload_chunk(upload_id):
+    """Append a chunk to a chunked upload; the body is raw bytes starting at ?offset="""
+    upload = ChunkedUpload.query.get_or_404(upload_id)
+    
+    if upload.status != 'uploading':
+        return jsonify({'error': 'Upload is already complete', **serialize_upload(upload)}), 409
+    
+    offset = request.args.get('offset', type=int)
+    if offset is None:
+        return jsonify({'error': 'offset is required'}), 400
+    
+    try:
+        write_chunk(upload, offset, request.stream)
+    except UploadOffsetMismatch as e:
+        return jsonify({'error': str(e), 'offset': e.expected}), 409
+    except UploadBusy:
+        return jsonify({'error': 'Another chunk is being written to this upload'}), 409
+    except Exception as e:
+        # Keep whatever arrived so the client can resume from there
+        db.session.commit()
+        print(f"⚠️ Chunk for upload {upload_id} interrupted at {upload.received_bytes} bytes: {e}")
+        return jsonify({'error': f'Chunk interrupted: {str(e)}', 'offset': upload.received_bytes}), 400
     
-    project.updated_at = datetime.utcnow()
     db.session.commit()
+    return jsonify(serialize_upload(upload))
+
+def delete_chunked_upload(upload_id):
+    """Abort a chunked upload and delete what was received"""
+    upload = ChunkedUpload.query.get_or_404(upload_id)
+    discard_upload(upload)
+    db.session.delete(upload)
+    db.session.commit()
+    return jsonify({'message': 'Upload discarded'})
+
+def finalize_chunked_uploads(project_id):
+    """Hand finished chunked uploads to the ingest pipeline as one job"""
+    Project.query.get_or_404(project_id)
+    data = request.json or {}
+    upload_ids = data.get('upload_ids') or []
+    
+    if not upload_ids:
+        return jsonify({'error': 'No upload IDs provided'}), 400
+    
+    by_id = {u.id: u for u in ChunkedUpload.query.filter(
+        ChunkedUpload.id.in_(upload_ids),
+        ChunkedUpload.project_id == project_id
+    ).all()}
+    missing = [upload_id for upload_id in upload_ids if upload_id not in by_id]
+    if missing:
+        return jsonify({'error': 'Uploads not found', 'upload_ids': missing}), 404
+    
+    uploads = [by_id[upload_id] for upload_id in dict.fromkeys(upload_ids)]
+    incomplete = [u.id for u in uploads if u.status != 'complete']
+    if incomplete:
+        return jsonify({'error': 'Uploads are not complete', 'upload_ids': incomplete}), 409
+    
+    # Chunks were hashed as they arrived; only the header and tail are read here
+    accepted, staged, rejected = [], [], []
+    for upload in uploads:
+        try:
+            probe = probe_hashed_file(upload.staged_path, upload.content_hash, upload.filename)
+            accepted.append(upload)
+            staged.append((upload.filename, upload.staged_path, probe))
+        except ImageProbeError as e:
+            print(f"⚠️ Rejected upload {upload.filename}: {e}")
+            rejected.append({'upload_id': upload.id, 'filename': upload.filename, 'error': str(e)})
+            discard_upload(upload)
+            db.session.delete(upload)
+    
+    if not staged:
+        db.session.commit()
+        return jsonify({'error': 'No valid files provided', 'rejected': rejected}), 400
     
-    # Set first uploaded image as project thumbnail if no thumbnail exists
-    if not project.thumbnail_image_id and not project.thumbnail_path:
-        first_image = Image.query.filter_by(project_id=project_id).order_by(Image.uploaded_at).first()
-        if first_image:
-            project.thumbnail_image_id = first_image.id
-            db.session.commit()
-            print(f"✅ Set project thumbnail to first image (ID: {first_image.id})")
+    job = create_ingest_job_from_staged(project_id, staged, socket_id=data.get('socket_id'),
+                                        dedupe_distance=_dedupe_distance(data))
+    for upload in accepted:
+        db.session.delete(upload)
+    db.session.commit()
+    start_ingest_job(_app_instance, _socketio_instance, job.id)
     
     return jsonify({
-        'message': f'Uploaded {len(uploaded_images)} images',
-        'batch_id': batch_id,
-        'images': uploaded_images
-    }), 201
+        'message': f'Queued {len(staged)} files for ingest',
+        'job_id': job.id,
+        'batch_id': job.batch_id,
+        'status_url': f'/api/ingest/{job.id}',
+        'rejected': rejected
+    }), 202
+
+def get_ingest_job(job_id):
+    """Get the status of an ingest job and its files"""
+    job = IngestJob.query.get_or_404(job_id)
+    return jsonify(serialize_ingest_job(job))
+
+def retry_ingest_job_endpoint(job_id):
+    """Retry the files of an ingest job that failed"""
+    job = IngestJob.query.get_or_404(job_id)
+    
+    if is_job_running(job.id):
+        return jsonify({'error': 'Ingest job is still running'}), 409
+    
+    if not any(f.status != 'completed' for f in job.files):
+        return jsonify({'error': 'No failed files to retry'}), 400
+    
+    retry_ingest_job(job)
+    db.session.commit()
+    start_ingest_job(_app_instance, _socketio_instance, job.id)
+    
+    return jsonify(serialize_ingest_job(job)), 202
 
-def extract_images_from_pdf(pdf_file, output_folder, batch_id, project_id=None):
-    """Extract images from PDF using pdfium"""
-    pdf_images = []
-    MAX_RESOLUTION = 2000  # Maximum resolution on longest side
+def import_local_dataset(project_id):
+    """Import a YOLO, COCO or Pascal VOC dataset from a folder on the server in the background"""
+    Project.query.get_or_404(project_id)
+    data = request.json or {}
+    dataset_format = (data.get('format') or 'auto').lower()
     
-    # Save PDF temporarily
-    temp_pdf_path = os.path.join(output_folder, f"temp_{uuid.uuid4()}.pdf")
-    pdf_file.save(temp_pdf_path)
+    if not data.get('path'):
+        return jsonify({'error': 'path is required'}), 400
+    if dataset_format not in DATASET_FORMATS:
+        return jsonify({'error': f"format must be one of {', '.join(DATASET_FORMATS)}"}), 400
     
     try:
-        pdf = pdfium.PdfDocument(temp_pdf_path)
-        total_pages = len(pdf)
-        
-        # Emit initial processing status
-        if project_id and _socketio_instance:
-            _socketio_instance.emit('pdf_processing', {
-                'project_id': project_id,
-                'status': 'processing',
-                'current': 0,
-                'total': total_pages,
-                'message': f'Processing PDF: 0/{total_pages} pages'
-            })
-        
-        for page_num in range(total_pages):
-            page = pdf[page_num]
-            bitmap = page.render(scale=2.0)  # 2x scale for better quality
-            pil_image = bitmap.to_pil()
-            
-            # Resize if needed to max resolution of 2000px on longest side
-            original_width, original_height = pil_image.size
-            max_dimension = max(original_width, original_height)
-            
-            if max_dimension > MAX_RESOLUTION:
-                # Calculate new dimensions maintaining aspect ratio
-                scale_factor = MAX_RESOLUTION / max_dimension
-                new_width = int(original_width * scale_factor)
-                new_height = int(original_height * scale_factor)
-                
-                # Resize using high-quality Lanczos resampling
-                pil_image = pil_image.resize((new_width, new_height), PILImage.Resampling.LANCZOS)
-                print(f"📐 Resized page {page_num + 1} from {original_width}x{original_height} to {new_width}x{new_height}")
-            
-            # Save as JPEG with high quality to reduce file size while maintaining quality
-            image_filename = f"pdf_page_{page_num + 1}_{uuid.uuid4()}.jpg"
-            image_path = os.path.join(output_folder, image_filename)
-            pil_image.save(image_path, 'JPEG', quality=90, optimize=True)
-            
-            width, height = pil_image.size
-            pdf_images.append({
-                'filename': f"{os.path.basename(pdf_file.filename)} - Page {page_num + 1}",
-                'width': width,
-                'height': height,
-                'filepath': image_path
-            })
-            
-            # Emit progress update
-            if project_id and _socketio_instance:
-                _socketio_instance.emit('pdf_processing', {
-                    'project_id': project_id,
-                    'status': 'processing',
-                    'current': page_num + 1,
-                    'total': total_pages,
-                    'message': f'Processing PDF: {page_num + 1}/{total_pages} pages'
-                })
-        
-        # Emit completion
-        if project_id and _socketio_instance:
-            _socketio_instance.emit('pdf_processing', {
-                'project_id': project_id,
-                'status': 'complete',
-                'current': total_pages,
-                'total': total_pages,
-                'message': f'Completed processing {total_pages} pages'
-            })
+        dataset_dir = resolve_dataset_dir(data['path'])
+    except DatasetImportError as e:
+        return jsonify({'error': str(e)}), e.status
     
-    finally:
-        # Clean up temp PDF
-        try:
-            os.remove(temp_pdf_path)
-        except:
-            pass
+    job = create_dataset_import_job(project_id, socket_id=data.get('socket_id'))
+    db.session.commit()
+    start_ingest_job(_app_instance, _socketio_instance, job.id,
+                     runner=partial(run_dataset_import, dataset_dir=dataset_dir, dataset_format=dataset_format))
     
-    return pdf_images
+    return jsonify({
+        'message': f'Importing {dataset_dir}',
+        'job_id': job.id,
+        'batch_id': job.batch_id,
+        'status_url': f'/api/ingest/{job.id}'
+    }), 202
 
 def import_from_roboflow(project_id):
     """Import dataset from Roboflow"""
@@ -479,8 +584,6 @@ def import_from_roboflow(project_id):
             raise FileNotFoundError(f"Could not find data.yaml in downloaded dataset. Contents: {os.listdir(temp_dir)}")
         
         batch_id = str(uuid.uuid4())
-        project_folder = os.path.join(current_app.config['UPLOAD_FOLDER'], str(project_id))
-        os.makedirs(project_folder, exist_ok=True)
         
         # Load data.yaml to get class names
         print(f"🔍 Loading data.yaml from: {data_yaml_path}")
@@ -514,9 +617,9 @@ def import_from_roboflow(project_id):
         
         db.session.commit()
         
-        # Import images and annotations from all splits
-        total_images = 0
-        total_annotations = 0
+        # Import images and annotations from all splits, bulk-inserted in committed batches
+        writer = ImageBatchWriter(on_batch=lambda w: print(f"📦 Imported {w.images_written} images so far..."))
+        policy = ingest_policy(project)
         
         for split in ['train', 'valid', 'test']:
             split_dir = os.path.join(dataset_path, split)
@@ -537,55 +640,44 @@ def import_from_roboflow(project_id):
                 
                 img_path = os.path.join(images_dir, img_filename)
                 
-                # Copy image to project folder
-                dest_filename = f"{uuid.uuid4()}_{img_filename}"
-                dest_path = os.path.join(project_folder, dest_filename)
-                shutil.copy2(img_path, dest_path)
-                
-                # Get image dimensions
-                with PILImage.open(dest_path) as img:
-                    width, height = img.size
+                # Hash and read the dimensions in one pass, skipping broken downloads
+                try:
+                    probe = probe_file(img_path)
+                except ImageProbeError as e:
+                    print(f"⚠️ Skipping {split}/{img_filename}: {e}")
+                    continue
                 
-                # Create database entry
-                image = Image(
-                    filename=f"{split}_{img_filename}",
-                    filepath=dest_path,
-                    width=width,
-                    height=height,
-                    batch_id=batch_id,
-                    project_id=project_id,
-                    status='completed'  # Mark as annotated since we're importing annotations
-                )
-                db.session.add(image)
-                db.session.flush()  # Get the ID
-                total_images += 1
+                # Move image into the blob store, normalized by the project's ingest policy
+                dhash = safe_dhash(img_path)
+                stored = store_normalized(img_path, img_filename, probe, policy, move=True)
                 
                 # Load annotations
-                label_filename = os.path.splitext(img_filename)[0] + '.txt'
-                label_path = os.path.join(labels_dir, label_filename)
-                
+                annotations = []
+                label_path = os.path.join(labels_dir, os.path.splitext(img_filename)[0] + '.txt')
                 if os.path.exists(label_path):
                     with open(label_path, 'r') as f:
-                        for line in f:
-                            parts = line.strip().split()
-                            if len(parts) >= 5:
-                                class_idx = int(parts[0])
-                                x_center = float(parts[1])
-                                y_center = float(parts[2])
-                                box_width = float(parts[3])
-                                box_height = float(parts[4])
-                                
-                                if class_idx in class_mapping:
-                                    annotation = Annotation(
-                                        image_id=image.id,
-                                        class_id=class_mapping[class_idx],
-                                        x_center=x_center,
-                                        y_center=y_center,
-                                        width=box_width,
-                                        height=box_height
-                                    )
-                                    db.session.add(annotation)
-                                    total_annotations += 1
+                        annotations = [
+                            annotation_row(class_mapping[label[0]], label)
+                            for label in parse_yolo_labels(f.read()) if label[0] in class_mapping
+                        ]
+                
+                writer.add(f"{split}/{img_filename}", {
+                    'filename': f"{split}_{img_filename}",
+                    'filepath': stored['filepath'],
+                    'content_hash': stored['content_hash'],
+                    'size': stored['size'],
+                    'width': stored['width'],
+                    'height': stored['height'],
+                    'original': stored['original'],
+                    'dhash': dhash,
+                    'batch_id': batch_id,
+                    'project_id': project_id,
+                    'status': 'completed'  # Mark as annotated since we're importing annotations
+                }, annotations)
+        
+        writer.flush()
+        total_images = writer.images_written
+        total_annotations = writer.annotations_written
         
         # Clean up temp directory
         try:
@@ -632,12 +724,9 @@ def delete_project_images(project_id):
     for image_id in image_ids:
         image = Image.query.filter_by(id=image_id, project_id=project_id).first()
         if image:
-            # Delete the image file
-            try:
-                if os.path.exists(image.filepath):
-                    os.remove(image.filepath)
-            except Exception as e:
-                print(f"Failed to delete image file: {e}")
+            # Release the image file (shared blobs are kept while other images use them)
+            release_image_file(image)
+            remove_image_derivatives(image.id)
             
             # Delete from database (cascades to annotations)
             db.session.delete(image)
@@ -653,53 +742,289 @@ def delete_project_images(project_id):
     })
 
 def get_project_images(project_id):
-    """Get all images in a project"""
-    project = Project.query.get_or_404(project_id)
+    """
+    Get one page of a project's images, newest upload first
+    
+    Query args: limit, after or before (a cursor from next_cursor/prev_cursor),
+    filter (all/annotated/unannotated), status, batch_id and class_id.
+    Pages are found by (uploaded_at, id) keyset rather than offset, so a page
+    deep into a large project costs the same as the first. Totals are only
+    counted for the first page (no cursor).
+    """
+    Project.query.get_or_404(project_id)
+    
+    limit = min(max(request.args.get('limit', DEFAULT_IMAGES_PER_PAGE, type=int), 1), MAX_IMAGES_PER_PAGE)
+    try:
+        after = _decode_cursor(request.args.get('after'))
+        before = _decode_cursor(request.args.get('before'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    if after and before:
+        return jsonify({'error': 'Pass either after or before, not both'}), 400
+    
+    image_filter = request.args.get('filter', 'all')
+    filtered = _filtered_images_query(
+        project_id, image_filter,
+        status=request.args.get('status'),
+        batch_id=request.args.get('batch_id'),
+        class_id=request.args.get('class_id', type=int)
+    )
     
-    images = Image.query.filter_by(project_id=project_id).order_by(Image.uploaded_at.desc()).all()
-    
-    # Group by batch
-    batches = {}
-    for img in images:
-        batch_id = img.batch_id or 'unknown'
-        if batch_id not in batches:
-            batches[batch_id] = []
-        batches[batch_id].append({
-            'id': img.id,
-            'filename': img.filename,
-            'width': img.width,
-            'height': img.height,
-            'status': img.status,
-            'uploaded_at': img.uploaded_at.isoformat(),
-            'annotation_count': len(img.annotations)
-        })
+    # Annotation counts come from a correlated subquery instead of loading every image's annotations
+    annotation_count = db.session.query(db.func.count(Annotation.id)).filter(
+        Annotation.image_id == Image.id
+    ).correlate(Image).scalar_subquery()
+    page_query = filtered.add_columns(annotation_count)
+    
+    # One extra row tells whether there is another page in that direction
+    if before:
+        rows = page_query.filter(_before(before)).order_by(Image.uploaded_at.asc(), Image.id.asc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        has_previous, has_next = has_more, True
+    else:
+        query = page_query.filter(_after(after)) if after else page_query
+        rows = query.order_by(Image.uploaded_at.desc(), Image.id.desc()).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        has_previous, has_next = after is not None, has_more
+    
+    images = [{
+        'id': img.id,
+        'filename': img.filename,
+        'width': img.width,
+        'height': img.height,
+        'status': img.status,
+        'batch_id': img.batch_id,
+        'uploaded_at': img.uploaded_at.isoformat(),
+        'annotation_count': count,
+        'version': image_version(img),
+        'thumbnail_version': f"{derivative_version(img)}-thumb",
+        'content_hash': img.content_hash
+    } for img, count in rows]
+    
+    result = {
+        'images': images,
+        'next_cursor': _encode_cursor(rows[-1][0]) if rows and has_next else None,
+        'prev_cursor': _encode_cursor(rows[0][0]) if rows and has_previous else None
+    }
+    if not (after or before):
+        total, annotated = _image_counts(project_id).get(project_id, (0, 0))
+        result['total'] = filtered.count()
+        result['counts'] = {'all': total, 'annotated': annotated, 'unannotated': total - annotated}
+    return jsonify(result)
+
+def get_project_batches(project_id):
+    """Get the upload batches of a project with their image counts, newest first"""
+    Project.query.get_or_404(project_id)
     
-    return jsonify({
-        'batches': [
-            {
-                'batch_id': batch_id,
-                'images': imgs,
-                'count': len(imgs)
-            }
-            for batch_id, imgs in batches.items()
-        ]
-    })
+    batches = db.session.query(
+        Image.batch_id,
+        db.func.count(Image.id),
+        db.func.sum(db.case((Image.status == 'completed', 1), else_=0)),
+        db.func.max(Image.uploaded_at)
+    ).filter(Image.project_id == project_id).group_by(Image.batch_id).order_by(db.func.max(Image.uploaded_at).desc()).all()
+    
+    return jsonify([{
+        'batch_id': batch_id or 'unknown',
+        'count': count,
+        'annotated_count': annotated or 0,
+        'uploaded_at': uploaded_at.isoformat() if uploaded_at else None
+    } for batch_id, count, annotated, uploaded_at in batches])
 
 def get_image(image_id):
     """Get image file"""
     image = Image.query.get_or_404(image_id)
-    return send_file(image.filepath)
+    
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
+    return send_cached_file(image.filepath, version=image_version(image))
+
+def get_image_thumbnail(image_id):
+    """Get a small cached thumbnail of an image"""
+    image = Image.query.get_or_404(image_id)
+    
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
+    path = ensure_thumbnail(image)
+    return send_cached_file(path, version=f"{derivative_version(image)}-thumb", mimetype='image/jpeg')
+
+def get_image_display(image_id):
+    """Get the display-resolution copy of an image for the annotate canvas"""
+    image = Image.query.get_or_404(image_id)
+    
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
+    path = ensure_display_image(image)
+    mimetype = 'image/jpeg' if path != image.filepath else None
+    return send_cached_file(path, version=display_version(image), mimetype=mimetype)
+
+def get_thumbnail_sprite(project_id):
+    """Get the offset index of a sprite packing the thumbnails of one grid page"""
+    project = Project.query.get_or_404(project_id)
+    
+    ids_param = request.args.get('ids')
+    if ids_param:
+        # Explicit page of image ids, in display order
+        try:
+            image_ids = [int(image_id) for image_id in ids_param.split(',') if image_id]
+        except ValueError:
+            return jsonify({'error': 'ids must be a comma-separated list of integers'}), 400
+        image_ids = image_ids[:MAX_SPRITE_IMAGES]
+        by_id = {img.id: img for img in Image.query.filter(Image.project_id == project_id, Image.id.in_(image_ids)).all()}
+        images = [by_id[image_id] for image_id in image_ids if image_id in by_id]
+    else:
+        # Same page/filter semantics as the project grid
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(max(request.args.get('per_page', 25, type=int), 1), MAX_SPRITE_IMAGES)
+        image_filter = request.args.get('filter', 'all')
+        
+        query = Image.query.filter_by(project_id=project_id)
+        if image_filter == 'annotated':
+            query = query.filter(Image.status == 'completed')
+        elif image_filter == 'unannotated':
+            query = query.filter(Image.status != 'completed')
+        images = query.order_by(Image.uploaded_at.desc(), Image.id.desc()).offset((page - 1) * per_page).limit(per_page).all()
+    
+    # Lazy PDF pages that aren't rendered yet are left out of the sprite instead of holding it
+    # up: they start rendering now and the grid shows a placeholder until their thumbnails load
+    pending = [img for img in images if is_unrendered_page(img)]
+    prefetch_pages(pending)
+    pending_ids = {img.id for img in pending}
+    images = [img for img in images if img.id not in pending_ids and ensure_image_file(img)]
+    if not images and not pending:
+        return jsonify({'error': 'No images available'}), 404
+    
+    if images:
+        try:
+            index = build_sprite(images)
+        except Exception as e:
+            print(f"❌ Sprite generation failed for project {project_id}: {e}")
+            return jsonify({'error': f'Sprite generation failed: {str(e)}'}), 500
+        index['url'] = f"/api/projects/{project_id}/thumbnails/sprite/{index['key']}.jpg?v={index['key']}"
+    else:
+        index = {'key': None, 'width': 0, 'height': 0, 'images': {}, 'url': None}
+    index['pending'] = [img.id for img in pending]
+    return jsonify(index)
+
+def get_thumbnail_sprite_image(project_id, sprite_key):
+    """Get a packed thumbnail sprite image"""
+    if not re.fullmatch(r'[0-9a-f]{40}', sprite_key):
+        return jsonify({'error': 'Invalid sprite key'}), 400
+    
+    sprite_path, _ = sprite_paths(sprite_key)
+    if not os.path.exists(sprite_path):
+        return jsonify({'error': 'Sprite not found'}), 404
+    
+    # The key is derived from the image ids and file versions, so the sprite never changes
+    return send_cached_file(sprite_path, version=sprite_key, mimetype='image/jpeg')
+
+def get_image_tiles(image_id):
+    """Get the deep-zoom tile pyramid descriptor for a large image"""
+    image = Image.query.get_or_404(image_id)
+    
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
+    try:
+        ensure_tile_pyramid(image)
+    except Exception as e:
+        print(f"❌ Tile pyramid generation failed for image {image_id}: {e}")
+        return jsonify({'error': f'Tile generation failed: {str(e)}'}), 500
+    
+    return jsonify(tile_descriptor(image))
+
+def get_image_tile(image_id, level, col, row):
+    """Get a single tile from an image's deep-zoom pyramid"""
+    image = Image.query.get_or_404(image_id)
+    
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
+    ensure_tile_pyramid(image)
+    
+    path = tile_path(image, level, col, row)
+    if not os.path.exists(path):
+        return jsonify({'error': 'Tile not found'}), 404
+    
+    # Tiles never change for a given file version, so key the ETag on it
+    return send_cached_file(path, version=f"{derivative_version(image)}-{level}-{col}-{row}", mimetype='image/jpeg')
+
+def get_image_duplicates(image_id):
+    """Get the near-duplicates of an image among its project's images"""
+    image = Image.query.get_or_404(image_id)
+    max_distance = _max_distance_arg()
+    
+    if not image.dhash:
+        return jsonify({'image_id': image.id, 'hashed': False, 'max_distance': max_distance, 'duplicates': []})
+    
+    matches = find_near_duplicates(image, max_distance)[:MAX_NEAR_DUPLICATES]
+    by_id = {img.id: img for img in Image.query.filter(Image.id.in_([image_id for _, image_id in matches])).all()}
+    
+    return jsonify({
+        'image_id': image.id,
+        'hashed': True,
+        'max_distance': max_distance,
+        'duplicates': [{
+            'id': match_id,
+            'filename': by_id[match_id].filename,
+            'batch_id': by_id[match_id].batch_id,
+            'status': by_id[match_id].status,
+            'distance': distance
+        } for distance, match_id in matches if match_id in by_id]
+    })
+
+def get_duplicate_clusters(project_id):
+    """Group a project's images (or one upload batch, ?batch_id=) into clusters of near-duplicates"""
+    Project.query.get_or_404(project_id)
+    max_distance = _max_distance_arg()
+    batch_id = request.args.get('batch_id')
+    
+    query = db.session.query(Image.id, Image.filename, Image.dhash).filter(
+        Image.project_id == project_id, Image.dhash.isnot(None)
+    )
+    if batch_id:
+        query = query.filter(Image.batch_id == batch_id)
+    images = query.order_by(Image.id).all()
+    filenames = {image.id: image.filename for image in images}
+    
+    clusters = cluster_images(images, max_distance)
+    return jsonify({
+        'batch_id': batch_id,
+        'max_distance': max_distance,
+        'images_checked': len(images),
+        'clusters': [{
+            'size': len(members),
+            'images': [{'id': image_id, 'filename': filenames[image_id]} for image_id in members]
+        } for members in clusters]
+    })
 
 def get_image_annotations(image_id):
     """Get annotations for an image"""
     image = Image.query.get_or_404(image_id)
     
-    return jsonify({
+    return jsonify(image_annotations_payload(image))
+
+def image_annotations_payload(image):
+    """Image metadata and annotations as sent to the annotate page"""
+    # Polygons are deferred on Annotation; fetch this image's in one query
+    polygons = dict(db.session.query(Annotation.id, Annotation.polygon_data).filter(
+        Annotation.image_id == image.id, Annotation.polygon_data.isnot(None)))
+    return {
         'image_id': image.id,
         'filename': image.filename,
         'width': image.width,
         'height': image.height,
         'status': image.status,
+        'revision': image.revision,
+        'version': image_version(image),
+        'content_hash': image.content_hash,
+        'tiled': needs_tiles(image),
+        'display_version': display_version(image),
+        'display_scaled': needs_display_derivative(image),
         'annotations': [{
             'id': ann.id,
             'class_id': ann.class_id,
@@ -710,8 +1035,120 @@ def get_image_annotations(image_id):
             'height': ann.height,
             'confidence': ann.confidence,
             'is_predicted': ann.is_predicted,
-            'polygon_points': ann.polygon_points  # Include polygon data
+            'polygon': decode_polygon(polygons.get(ann.id))  # [[x, y], ...] or None
         } for ann in image.annotations]
+    }
+
+def _filtered_images_query(project_id, image_filter, status=None, batch_id=None, class_id=None):
+    """Images of a project restricted to the annotate page's status filter and the listing's filters"""
+    query = Image.query.filter(Image.project_id == project_id)
+    if image_filter == 'annotated':
+        query = query.filter(Image.status == 'completed')
+    elif image_filter == 'unannotated':
+        query = query.filter(Image.status != 'completed')
+    if status:
+        query = query.filter(Image.status == status)
+    if batch_id == 'unknown':
+        query = query.filter(Image.batch_id.is_(None))
+    elif batch_id:
+        query = query.filter(Image.batch_id == batch_id)
+    if class_id:
+        query = query.filter(db.exists().where(Annotation.image_id == Image.id, Annotation.class_id == class_id))
+    return query
+
+def _after(image):
+    """Images that come after image (or a cursor) in navigation order (newest upload first)"""
+    # Row-value comparison, so the (project_id, uploaded_at, id) index can seek straight to the position
+    return db.tuple_(Image.uploaded_at, Image.id) < (image.uploaded_at, image.id)
+
+def _before(image):
+    """Images that come before image (or a cursor) in navigation order"""
+    return db.tuple_(Image.uploaded_at, Image.id) > (image.uploaded_at, image.id)
+
+def _encode_cursor(image):
+    """Opaque listing cursor for an image's (uploaded_at, id) position"""
+    return base64.urlsafe_b64encode(f"{image.uploaded_at.isoformat()}|{image.id}".encode()).decode().rstrip('=')
+
+def _decode_cursor(cursor):
+    """Position from _encode_cursor() (anything with uploaded_at and id), or None; ValueError if malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        uploaded_at, image_id = raw.split('|')
+        return SimpleNamespace(uploaded_at=datetime.fromisoformat(uploaded_at), id=int(image_id))
+    except (ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_image_navigation(project_id):
+    """
+    Get everything the annotate page needs to show one image and step to its neighbours
+    
+    Neighbours are found relative to the anchor image rather than by position,
+    so saving an image out of the current filter doesn't skip the next one.
+    """
+    Project.query.get_or_404(project_id)
+    
+    image_filter = request.args.get('filter', 'all')
+    direction = request.args.get('direction', 'current')
+    k = min(max(request.args.get('k', NAVIGATION_WINDOW, type=int), 0), MAX_NAVIGATION_WINDOW)
+    anchor_id = request.args.get('image_id', type=int)
+    
+    if direction not in ('current', 'next', 'previous'):
+        return jsonify({'error': 'direction must be current, next or previous'}), 400
+    
+    filtered = _filtered_images_query(project_id, image_filter)
+    newest_first = (Image.uploaded_at.desc(), Image.id.desc())
+    oldest_first = (Image.uploaded_at.asc(), Image.id.asc())
+    with_annotations = db.selectinload(Image.annotations).joinedload(Annotation.class_obj)
+    
+    anchor = Image.query.filter_by(id=anchor_id, project_id=project_id).first() if anchor_id else None
+    
+    target = None
+    if anchor and direction == 'next':
+        target = filtered.filter(_after(anchor)).order_by(*newest_first).first()
+    elif anchor and direction == 'previous':
+        target = filtered.filter(_before(anchor)).order_by(*oldest_first).first()
+    if target is None and anchor and filtered.filter(Image.id == anchor.id).count():
+        target = anchor
+    if target is None:
+        # Anchor missing or outside the filter: start from the first image
+        target = filtered.order_by(*newest_first).first()
+    
+    total = filtered.count()
+    if target is None:
+        return jsonify({'position': 0, 'total': 0, 'filter': image_filter,
+                        'current': None, 'previous': [], 'next': [], 'preload': []})
+    
+    position = filtered.filter(_before(target)).count()
+    previous_images = filtered.filter(_before(target)).options(with_annotations).order_by(*oldest_first).limit(k).all()
+    next_images = filtered.filter(_after(target)).options(with_annotations).order_by(*newest_first).limit(k).all()
+    
+    def payload(image):
+        data = image_annotations_payload(image)
+        if data['tiled']:
+            data['tiles'] = tile_descriptor(image)
+        return data
+    
+    # Lazy PDF pages around the current one are rendered before the browser asks for them
+    prefetch_pages([target] + next_images + previous_images)
+    
+    # Nearest neighbours first, next before previous since that's the usual direction
+    preload = []
+    for i in range(k):
+        for neighbours in (next_images, previous_images):
+            if i < len(neighbours) and not needs_tiles(neighbours[i]):
+                image = neighbours[i]
+                preload.append(f"/api/images/{image.id}/display?v={display_version(image)}")
+    
+    return jsonify({
+        'position': position,
+        'total': total,
+        'filter': image_filter,
+        'current': payload(target),
+        'previous': [payload(img) for img in previous_images],
+        'next': [payload(img) for img in next_images],
+        'preload': preload
     })
 
 def save_annotations(image_id):
@@ -724,23 +1161,98 @@ def save_annotations(image_id):
     
     # Add new annotations
     for ann_data in data.get('annotations', []):
-        annotation = Annotation(
-            image_id=image_id,
-            class_id=ann_data['class_id'],
-            x_center=ann_data['x_center'],
-            y_center=ann_data['y_center'],
-            width=ann_data['width'],
-            height=ann_data['height'],
-            polygon_points=ann_data.get('polygon_points')  # Add polygon support
-        )
+        annotation = Annotation(image_id=image_id, **_annotation_columns(ann_data))
         db.session.add(annotation)
     
-    # Update image status
+    # Update image status; a full replace still invalidates edits based on the old revision
     image.status = data.get('status', 'completed')
+    image.revision = Image.revision + 1
     
     db.session.commit()
     
-    return jsonify({'message': 'Annotations saved successfully'})
+    return jsonify({'message': 'Annotations saved successfully', 'revision': image.revision})
+
+# Annotation fields a client may set (besides the polygon), and the ones a new annotation must have
+ANNOTATION_FIELDS = ('class_id', 'x_center', 'y_center', 'width', 'height', 'confidence', 'is_predicted')
+REQUIRED_ANNOTATION_FIELDS = ('class_id', 'x_center', 'y_center', 'width', 'height')
+
+def _annotation_columns(ann):
+    """Annotation column values from a client annotation (polygon as [[x, y], ...], or the older polygon_points JSON)"""
+    columns = {field: ann[field] for field in ANNOTATION_FIELDS if field in ann}
+    if 'polygon' in ann:
+        columns['polygon_data'] = encode_polygon(ann['polygon'])
+    elif 'polygon_points' in ann:
+        columns['polygon_data'] = encode_polygon(json.loads(ann['polygon_points'])) if ann['polygon_points'] else None
+    return columns
+
+def patch_annotations(image_id):
+    """
+    Apply an annotation delta to an image in one transaction
+    
+    Body: {revision, created: [annotation], updated: [{id, ...changed fields}],
+    deleted: [id], status}. The revision is the one the client loaded; if the
+    image was saved since, nothing is applied and 409 comes back with the
+    current annotations. Created annotations' ids are returned in request order.
+    """
+    image = Image.query.get_or_404(image_id)
+    data = request.json or {}
+    
+    revision = data.get('revision')
+    if not isinstance(revision, int):
+        return jsonify({'error': 'revision is required'}), 400
+    created = data.get('created', [])
+    updated = data.get('updated', [])
+    deleted = data.get('deleted', [])
+    
+    if any(not all(field in ann for field in REQUIRED_ANNOTATION_FIELDS) for ann in created):
+        return jsonify({'error': f"Created annotations need {', '.join(REQUIRED_ANNOTATION_FIELDS)}"}), 400
+    if any('id' not in ann for ann in updated):
+        return jsonify({'error': 'Updated annotations need an id'}), 400
+    
+    project_class_ids = {class_id for (class_id,) in db.session.query(Class.id).filter_by(project_id=image.project_id)}
+    if any('class_id' in ann and ann['class_id'] not in project_class_ids for ann in created + updated):
+        return jsonify({'error': 'Unknown class for this project'}), 400
+    
+    try:
+        created_columns = [_annotation_columns(ann) for ann in created]
+        updated_columns = [(ann['id'], _annotation_columns(ann)) for ann in updated]
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid polygon'}), 400
+    
+    # Compare-and-set on the revision: claiming the next one also takes the write
+    # lock, so two saves based on the same revision can't both apply
+    claimed = Image.query.filter_by(id=image_id, revision=revision).update(
+        {Image.revision: Image.revision + 1, Image.status: data.get('status', 'completed')},
+        synchronize_session=False
+    )
+    if not claimed:
+        db.session.rollback()
+        return jsonify({
+            'error': 'This image was saved by someone else since it was loaded',
+            'current': image_annotations_payload(db.session.get(Image, image_id))
+        }), 409
+    
+    changed_ids = [ann['id'] for ann in updated] + deleted
+    if changed_ids:
+        owned = {ann_id for (ann_id,) in db.session.query(Annotation.id).filter(
+            Annotation.id.in_(changed_ids), Annotation.image_id == image_id)}
+        if owned != set(changed_ids):
+            db.session.rollback()
+            return jsonify({'error': 'Annotations not found on this image'}), 400
+    
+    if deleted:
+        Annotation.query.filter(Annotation.id.in_(deleted)).delete(synchronize_session=False)
+    for ann_id, changes in updated_columns:
+        if changes:
+            Annotation.query.filter_by(id=ann_id).update(changes, synchronize_session=False)
+    new_annotations = [Annotation(image_id=image_id, **columns) for columns in created_columns]
+    db.session.add_all(new_annotations)
+    db.session.commit()
+    
+    return jsonify({
+        'revision': revision + 1,
+        'created': [annotation.id for annotation in new_annotations]
+    })
 
 def get_project_classes(project_id):
     """Get all classes for a project with annotation counts"""
@@ -797,7 +1309,10 @@ def delete_class(project_id, class_id):
     """Delete a class and all its annotations"""
     cls = Class.query.filter_by(id=class_id, project_id=project_id).first_or_404()
     
-    # Delete all annotations with this class
+    # Delete all annotations with this class; open annotate pages holding them are now stale
+    affected_images = db.session.query(Annotation.image_id).filter_by(class_id=class_id)
+    Image.query.filter(Image.id.in_(affected_images)).update(
+        {Image.revision: Image.revision + 1}, synchronize_session=False)
     Annotation.query.filter_by(class_id=class_id).delete()
     
     db.session.delete(cls)
@@ -849,16 +1364,13 @@ def create_dataset_version(project_id):
         val_split=val_split,
         test_split=test_split,
         seed=seed,
-        image_splits=json.dumps({
-            'train': train_images,
-            'val': val_images,
-            'test': test_images
-        }),
         total_images=total,
         total_annotations=sum(len(img.annotations) for img in annotated_images)
     )
     
     db.session.add(version)
+    db.session.flush()
+    add_version_images(version, {'train': train_images, 'val': val_images, 'test': test_images})
     db.session.commit()
     
     return jsonify({
@@ -887,11 +1399,26 @@ def get_dataset_versions(project_id):
         'total_images': v.total_images,
         'total_annotations': v.total_annotations,
         'created_at': v.created_at.isoformat(),
-        'train_count': len(json.loads(v.image_splits)['train']),
-        'val_count': len(json.loads(v.image_splits)['val']),
-        'test_count': len(json.loads(v.image_splits)['test'])
+        'train_count': v.train_count,
+        'val_count': v.val_count,
+        'test_count': v.test_count
     } for v in versions])
 
+def get_image_dataset_versions(image_id):
+    """Dataset versions that contain an image, with the split it is in"""
+    Image.query.get_or_404(image_id)
+    
+    rows = db.session.query(DatasetVersion, DatasetVersionImage.split).join(
+        DatasetVersionImage, DatasetVersionImage.version_id == DatasetVersion.id
+    ).filter(DatasetVersionImage.image_id == image_id).order_by(DatasetVersion.created_at.desc())
+    
+    return jsonify([{
+        'id': version.id,
+        'name': version.name,
+        'split': split,
+        'created_at': version.created_at.isoformat()
+    } for version, split in rows])
+
 def delete_dataset_version(project_id, version_id):
     """Delete a dataset version"""
     version = DatasetVersion.query.filter_by(id=version_id, project_id=project_id).first_or_404()
@@ -1116,12 +1643,11 @@ def download_model(job_id):
     if not job.model_path or not os.path.exists(job.model_path):
         return jsonify({'error': 'Model file not found'}), 404
     
-    from flask import send_file
-    
     # Create a filename for download
     filename = f"{job.name or f'model_{job.id}'}_{job.model_size}.pt"
     
-    return send_file(
+    # Served with Range support so interrupted downloads of large weights can resume
+    return send_cached_file(
         job.model_path,
         as_attachment=True,
         download_name=filename
@@ -1149,8 +1675,6 @@ def view_model(project_id, job_id):
 
 def get_confusion_matrix(job_id):
     """Serve confusion matrix image"""
-    from flask import send_file
-    
     job = TrainingJob.query.get_or_404(job_id)
     
     if not job.model_path:
@@ -1165,12 +1689,10 @@ def get_confusion_matrix(job_id):
     if not os.path.exists(matrix_path):
         return jsonify({'error': 'Confusion matrix not found'}), 404
     
-    return send_file(matrix_path, mimetype='image/png')
+    return send_cached_file(matrix_path, mimetype='image/png')
 
 def get_confusion_matrix_normalized(job_id):
     """Serve normalized confusion matrix image"""
-    from flask import send_file
-    
     job = TrainingJob.query.get_or_404(job_id)
     
     if not job.model_path:
@@ -1185,7 +1707,7 @@ def get_confusion_matrix_normalized(job_id):
     if not os.path.exists(matrix_path):
         return jsonify({'error': 'Normalized confusion matrix not found'}), 404
     
-    return send_file(matrix_path, mimetype='image/png')
+    return send_cached_file(matrix_path, mimetype='image/png')
 
 def evaluate_model_on_test(job_id):
     """Evaluate or re-evaluate a trained model on the test set"""
@@ -1429,6 +1951,9 @@ def predict_annotations(project_id):
     
     image = Image.query.get_or_404(image_id)
     
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
     # Load model and predict
     from ultralytics import YOLO
     try:
@@ -1684,6 +2209,9 @@ def use_external_model(project_id):
     
     image = Image.query.get_or_404(image_id)
     
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
     try:
         # Load external model and predict
         from ultralytics import YOLO
@@ -1749,6 +2277,9 @@ def sam2_predict_point(project_id):
     
     image = Image.query.get_or_404(image_id)
     
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
     try:
         sam2 = get_sam2_service()
         result = sam2.predict_from_point(
@@ -1797,6 +2328,9 @@ def sam2_predict_box(project_id):
     
     image = Image.query.get_or_404(image_id)
     
+    if not ensure_image_file(image):
+        return jsonify({'error': 'Image file not found'}), 404
+    
     try:
         sam2 = get_sam2_service()
         result = sam2.predict_from_box(
@@ -1909,7 +2443,7 @@ def export_projects_endpoint():
             except:
                 pass
         
-        response = send_file(
+        response = send_cached_file(
             zip_path,
             mimetype='application/zip',
             as_attachment=True,
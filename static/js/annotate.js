@@ -1,12 +1,17 @@
 // Annotation interface functionality
 
 let canvas, ctx;
-let images = [];
-let allImages = [];
 let currentFilter = 'all'; // 'all', 'annotated', 'unannotated'
-let currentImageIndex = 0;
+let currentImageIndex = 0; // Position of the current image within the filter
+let totalImages = 0;
+let preloadedImages = []; // Keeps neighbour prefetches alive until the next step
+const NAVIGATION_WINDOW = 2; // Neighbours fetched on each side of the current image
 let currentImage = null;
 let currentImageData = null; // Store image data (id, filename, etc)
+let currentTiles = null; // Deep-zoom tile descriptor when the image is served as a pyramid
+let tileCache = new Map(); // Loaded tiles for the current image, keyed by level/col/row
+let fullResolutionUrl = null; // Original image URL when the canvas shows a downscaled copy
+let fullResolutionImage = null; // Original image, fetched once the user zooms past the display copy
 let classes = [];
 let selectedClassId = null;
 let externalModels = [];
@@ -33,6 +38,9 @@ let zoom = 1;
 let panX = 0, panY = 0;
 let history = [];
 let historyIndex = -1;
+let imageRevision = 0; // Revision of the current image the annotations were loaded or last saved at
+let savedAnnotations = new Map(); // Annotation id -> serialized fields as last loaded or saved
+let pendingSave = null; // In-flight save, so saves of one image never race each other
 
 document.addEventListener('DOMContentLoaded', () => {
     canvas = document.getElementById('annotationCanvas');
@@ -92,81 +100,55 @@ function selectClass(classId) {
 }
 
 async function loadImages() {
+    // Start from the image in the URL if there is one (falls back to the first image)
+    const urlParams = new URLSearchParams(window.location.search);
+    await loadImage('current', urlParams.get('image'));
+}
+
+async function loadImage(direction, anchorId = null) {
     try {
-        const data = await apiCall(`/api/projects/${PROJECT_ID}/images`);
-        allImages = [];
-        
-        data.batches.forEach(batch => {
-            allImages.push(...batch.images);
-        });
-        
-        // Apply filter
-        if (currentFilter === 'all') {
-            images = [...allImages];
-        } else if (currentFilter === 'annotated') {
-            images = allImages.filter(img => img.status === 'completed');
-        } else if (currentFilter === 'unannotated') {
-            images = allImages.filter(img => img.status !== 'completed');
-        }
+        // One request returns the image, its annotations and its neighbours
+        const params = new URLSearchParams({ filter: currentFilter, direction, k: NAVIGATION_WINDOW });
+        if (anchorId) params.set('image_id', anchorId);
+        const bundle = await apiCall(`/api/projects/${PROJECT_ID}/navigation?${params}`);
         
-        if (images.length === 0) {
+        if (!bundle.current) {
             showToast(`No ${currentFilter} images to annotate`, 'error');
             return;
         }
         
-        // Check if specific image ID is provided in URL
-        const urlParams = new URLSearchParams(window.location.search);
-        const imageId = urlParams.get('image');
-        
-        if (imageId) {
-            const index = images.findIndex(img => img.id == imageId);
-            if (index !== -1) {
-                loadImage(index);
-            } else {
-                // Image not in filtered list, load first image
-                loadImage(0);
-            }
-        } else {
-            loadImage(0);
-        }
-        
-        updateImageCounter();
+        currentImageIndex = bundle.position;
+        totalImages = bundle.total;
+        preloadNeighbours(bundle.preload);
+        await showImage(bundle.current);
     } catch (error) {
-        showToast('Failed to load images', 'error');
+        showToast('Failed to load image', 'error');
     }
 }
 
-async function loadImage(index) {
-    if (index < 0 || index >= images.length) return;
-    
-    currentImageIndex = index;
-    const imageData = images[index];
+function preloadNeighbours(urls) {
+    preloadedImages = urls.map(url => {
+        const img = new Image();
+        img.src = url;
+        return img;
+    });
+}
+
+async function showImage(data) {
+    const imageData = { ...data, id: data.image_id };
     currentImageData = imageData; // Store the image data object
     
     try {
-        // Load image annotations
-        const data = await apiCall(`/api/images/${imageData.id}/annotations`);
         annotations = data.annotations;
         
-        // Parse polygon data if present
+        // Polygons arrive as [[x, y], ...] arrays (null for plain boxes)
         annotations.forEach(ann => {
-            if (ann.polygon_points) {
-                try {
-                    ann.polygon = JSON.parse(ann.polygon_points);
-                    ann.has_polygon = true;
-                } catch (e) {
-                    console.error('Failed to parse polygon data:', e);
-                    ann.has_polygon = false;
-                }
-            } else {
-                ann.has_polygon = false;
-            }
+            ann.has_polygon = Array.isArray(ann.polygon) && ann.polygon.length > 0;
         });
+        imageRevision = data.revision || 0;
+        rememberSavedAnnotations(annotations);
         
-        // Load the image
-        const img = document.getElementById('imageElement');
-        img.onload = async () => {
-            currentImage = img;
+        const onImageReady = async () => {
             resizeCanvas();
             drawCanvas();
             renderAnnotationsList();
@@ -176,7 +158,37 @@ async function loadImage(index) {
                 await runAutoLabelAssist();
             }
         };
-        img.src = `/api/images/${imageData.id}`;
+        
+        // Very large scans are drawn from a tile pyramid so only visible tiles are fetched
+        if (data.tiled) {
+            currentTiles = data.tiles || await apiCall(`/api/images/${imageData.id}/tiles`);
+            tileCache = new Map();
+            currentImage = { width: currentTiles.width, height: currentTiles.height };
+            await onImageReady();
+            updateImageCounter();
+            return;
+        }
+        if (currentTiles) {
+            // The previous image was tiled; don't draw its placeholder as a regular image
+            currentImage = null;
+            currentTiles = null;
+            tileCache = new Map();
+        }
+        
+        // Large originals are drawn from a display-resolution copy until the user zooms in
+        fullResolutionImage = null;
+        fullResolutionUrl = data.display_scaled
+            ? `/api/images/${imageData.id}?v=${data.version || ''}`
+            : null;
+        
+        // Load the image
+        const img = document.getElementById('imageElement');
+        img.onload = async () => {
+            currentImage = img;
+            await onImageReady();
+        };
+        // Versioned URL lets the browser cache the image as immutable
+        img.src = `/api/images/${imageData.id}/display?v=${data.display_version || data.version || ''}`;
         
         updateImageCounter();
     } catch (error) {
@@ -186,10 +198,10 @@ async function loadImage(index) {
 
 function updateImageCounter() {
     document.getElementById('imageCounter').textContent = 
-        `${currentImageIndex + 1} / ${images.length}`;
+        `${currentImageIndex + 1} / ${totalImages}`;
     
     document.getElementById('prevBtn').disabled = currentImageIndex === 0;
-    document.getElementById('nextBtn').disabled = currentImageIndex === images.length - 1;
+    document.getElementById('nextBtn').disabled = currentImageIndex >= totalImages - 1;
 }
 
 function resizeCanvas() {
@@ -573,7 +585,7 @@ function drawCanvas() {
     ctx.translate(panX, panY);
     
     // Draw image
-    ctx.drawImage(currentImage, 0, 0, canvas.width, canvas.height);
+    drawBaseImage();
     
     // Draw annotations (with zoom/pan applied)
     annotations.forEach((ann, index) => {
@@ -654,6 +666,103 @@ function drawCanvas() {
     document.getElementById('annotationCount').textContent = annotations.length;
 }
 
+function drawBaseImage() {
+    if (!currentTiles) {
+        ctx.drawImage(fullResolutionImage || currentImage, 0, 0, canvas.width, canvas.height);
+        loadFullResolutionIfZoomed();
+        return;
+    }
+    
+    // The largest level that fits in a single tile is a cheap placeholder while sharper tiles load
+    const previewLevel = currentTiles.levels.filter(l => l.cols === 1 && l.rows === 1).pop().level;
+    
+    // Pick the level whose resolution matches the on-screen size of the image
+    const screenWidth = canvas.width * zoom * (window.devicePixelRatio || 1);
+    const downscale = Math.max(1, currentTiles.width / screenWidth);
+    const level = Math.max(previewLevel, currentTiles.max_level - Math.floor(Math.log2(downscale)));
+    
+    drawTileLevel(previewLevel);
+    if (level !== previewLevel) {
+        drawTileLevel(level);
+    }
+}
+
+function loadFullResolutionIfZoomed() {
+    if (!fullResolutionUrl || fullResolutionImage) return;
+    
+    // Only fetch the original once the display copy is being upscaled on screen
+    const screenWidth = canvas.width * zoom * (window.devicePixelRatio || 1);
+    if (screenWidth <= currentImage.naturalWidth) return;
+    
+    const url = fullResolutionUrl;
+    fullResolutionUrl = null;
+    const original = new Image();
+    original.onload = () => {
+        // Ignore originals that arrive after navigating to another image
+        if (currentImageData && url.startsWith(`/api/images/${currentImageData.id}?`)) {
+            fullResolutionImage = original;
+            drawCanvas();
+        }
+    };
+    original.src = url;
+}
+
+function drawTileLevel(level) {
+    const info = currentTiles.levels[level];
+    const tileSize = currentTiles.tile_size;
+    
+    // Canvas units per pixel of this level
+    const scaleX = canvas.width / info.width;
+    const scaleY = canvas.height / info.height;
+    
+    // Visible region in canvas units (inverse of the zoom/pan transform)
+    const viewLeft = -panX;
+    const viewTop = -panY;
+    const viewRight = viewLeft + canvas.width / zoom;
+    const viewBottom = viewTop + canvas.height / zoom;
+    
+    const colStart = Math.max(0, Math.floor(viewLeft / scaleX / tileSize));
+    const colEnd = Math.min(info.cols - 1, Math.floor(viewRight / scaleX / tileSize));
+    const rowStart = Math.max(0, Math.floor(viewTop / scaleY / tileSize));
+    const rowEnd = Math.min(info.rows - 1, Math.floor(viewBottom / scaleY / tileSize));
+    
+    for (let row = rowStart; row <= rowEnd; row++) {
+        for (let col = colStart; col <= colEnd; col++) {
+            const tile = getTile(level, col, row);
+            if (tile) {
+                ctx.drawImage(
+                    tile,
+                    col * tileSize * scaleX,
+                    row * tileSize * scaleY,
+                    tile.naturalWidth * scaleX,
+                    tile.naturalHeight * scaleY
+                );
+            }
+        }
+    }
+}
+
+function getTile(level, col, row) {
+    const key = `${level}/${col}_${row}`;
+    let tile = tileCache.get(key);
+    
+    if (!tile) {
+        const tiles = currentTiles;
+        tile = new Image();
+        tile.onload = () => {
+            // Ignore tiles that arrive after navigating to another image
+            if (currentTiles === tiles) drawCanvas();
+        };
+        tile.src = tiles.url
+            .replace('{level}', level)
+            .replace('{col}', col)
+            .replace('{row}', row) + `?v=${tiles.version}`;
+        tileCache.set(key, tile);
+    }
+    
+    return tile.complete && tile.naturalWidth > 0 ? tile : null;
+}
+
 function renderAnnotationsList() {
     const list = document.getElementById('annotationsList');
     
@@ -723,43 +832,126 @@ function redo() {
     }
 }
 
+// Fields of an annotation as stored on the server
+function annotationFields(ann) {
+    return {
+        class_id: ann.class_id,
+        x_center: ann.x_center,
+        y_center: ann.y_center,
+        width: ann.width,
+        height: ann.height,
+        confidence: ann.confidence ?? 1.0,
+        is_predicted: !!ann.is_predicted,
+        polygon: ann.has_polygon && ann.polygon ? ann.polygon : null
+    };
+}
+
+function rememberSavedAnnotations(saved) {
+    savedAnnotations = new Map(saved.map(ann => [ann.id, JSON.stringify(annotationFields(ann))]));
+}
+
+// Created, updated and deleted annotations since the last load or save
+function annotationChanges() {
+    const created = [];
+    const updated = [];
+    annotations.forEach(ann => {
+        const saved = savedAnnotations.get(ann.id);
+        const fields = annotationFields(ann);
+        if (saved === undefined) {
+            created.push({ ...fields });
+        } else if (saved !== JSON.stringify(fields)) {
+            updated.push({ id: ann.id, ...fields });
+        }
+    });
+    const current = new Set(annotations.map(ann => ann.id));
+    const deleted = [...savedAnnotations.keys()].filter(id => !current.has(id));
+    return { created, updated, deleted };
+}
+
+// Swap client-side ids of newly saved annotations for their server ids, including in undo history
+function applyServerIds(idMap) {
+    const remap = ann => {
+        if (idMap.has(ann.id)) ann.id = idMap.get(ann.id);
+    };
+    annotations.forEach(remap);
+    history.forEach(state => state.forEach(remap));
+}
+
 async function saveAnnotations(autoNavigate = true) {
+    // Wait for an earlier save of this image; it moves the revision this one is based on
+    if (pendingSave) {
+        await pendingSave.catch(() => {});
+    }
+    const save = sendAnnotationChanges();
+    pendingSave = save;
     try {
-        const imageData = images[currentImageIndex];
-        
-        await apiCall(`/api/images/${imageData.id}/annotations`, {
-            method: 'POST',
-            body: JSON.stringify({
-                annotations: annotations.map(ann => ({
-                    class_id: ann.class_id,
-                    x_center: ann.x_center,
-                    y_center: ann.y_center,
-                    width: ann.width,
-                    height: ann.height
-                })),
-                status: 'completed'
-            })
-        });
-        
-        // Update image status in local array
-        if (images[currentImageIndex]) {
-            images[currentImageIndex].status = 'completed';
-        }
+        await save;
         
         if (!autoSaveEnabled) {
             showToast('Annotations saved!', 'success');
         }
         
         // Move to next image only if requested and not auto-saving
-        if (autoNavigate && !autoSaveEnabled && currentImageIndex < images.length - 1) {
+        if (autoNavigate && !autoSaveEnabled && currentImageIndex < totalImages - 1) {
             nextImage();
         }
     } catch (error) {
-        showToast('Failed to save annotations', 'error');
+        if (!error.conflict) {
+            showToast('Failed to save annotations', 'error');
+        }
         throw error; // Re-throw to prevent navigation on save failure
+    } finally {
+        if (pendingSave === save) {
+            pendingSave = null;
+        }
     }
 }
 
+// Send only what changed since the last save, checked against the revision it was based on
+async function sendAnnotationChanges() {
+    const imageData = currentImageData;
+    const changes = annotationChanges();
+    if (!changes.created.length && !changes.updated.length && !changes.deleted.length
+        && imageData.status === 'completed') {
+        return;
+    }
+    
+    // What the server will hold once this succeeds, serialized now since polygons are edited in place
+    const sent = annotations.map(ann => [ann.id, JSON.stringify(annotationFields(ann))]);
+    const clientIds = annotations.filter(ann => !savedAnnotations.has(ann.id)).map(ann => ann.id);
+    
+    const response = await fetch(`/api/images/${imageData.id}/annotations`, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ revision: imageRevision, ...changes, status: 'completed' })
+    });
+    const result = await response.json();
+    
+    if (response.status === 409) {
+        // Someone else saved this image; show their annotations rather than overwrite them
+        showToast('This image was changed elsewhere - reloaded the latest annotations', 'warning');
+        if (currentImageData && currentImageData.id === imageData.id) {
+            await showImage(result.current);
+        }
+        const error = new Error(result.error);
+        error.conflict = true;
+        throw error;
+    }
+    if (!response.ok) {
+        throw new Error(result.error || `HTTP error! status: ${response.status}`);
+    }
+    
+    const idMap = new Map(clientIds.map((clientId, i) => [clientId, result.created[i]]));
+    if (currentImageData && currentImageData.id === imageData.id) {
+        applyServerIds(idMap);
+        imageRevision = result.revision;
+        savedAnnotations = new Map(sent.map(([id, fields]) => [idMap.get(id) ?? id, fields]));
+    }
+    
+    // Update image status in local array
+    imageData.status = 'completed';
+}
+
 async function previousImage() {
     if (currentImageIndex > 0) {
         if (autoSaveEnabled) {
@@ -769,12 +961,12 @@ async function previousImage() {
                 return; // Don't navigate if save failed
             }
         }
-        loadImage(currentImageIndex - 1);
+        loadImage('previous', currentImageData.id);
     }
 }
 
 async function nextImage() {
-    if (currentImageIndex < images.length - 1) {
+    if (currentImageIndex < totalImages - 1) {
         if (autoSaveEnabled) {
             try {
                 await saveAnnotations(false);
@@ -782,7 +974,7 @@ async function nextImage() {
                 return; // Don't navigate if save failed
             }
         }
-        loadImage(currentImageIndex + 1);
+        loadImage('next', currentImageData.id);
     }
 }
 
@@ -1150,7 +1342,7 @@ async function runSingleLabelAssist() {
     try {
         showToast('Running Label Assist...', 'info');
         
-        const imageData = images[currentImageIndex];
+        const imageData = currentImageData;
         const confidence = document.getElementById('confidenceSlider').value / 100;
         const clearExisting = document.getElementById('clearExistingAnnotations').checked;
         
@@ -1236,7 +1428,7 @@ async function runSingleLabelAssist() {
 
 async function runAutoLabelAssist() {
     try {
-        const imageData = images[currentImageIndex];
+        const imageData = currentImageData;
         
         console.log('🤖 Running auto label assist:', {
             modelType: labelAssistConfig.modelType,
@@ -1904,57 +2096,7 @@ drawCanvas = function() {
     }
 };
 
-// Modify saveAnnotations to include polygon data
-const originalSaveAnnotations = saveAnnotations;
-saveAnnotations = async function(autoNavigate = true) {
-    try {
-        const imageData = images[currentImageIndex];
-        
-        const annotationsToSave = annotations.map(ann => {
-            const data = {
-                class_id: ann.class_id,
-                x_center: ann.x_center,
-                y_center: ann.y_center,
-                width: ann.width,
-                height: ann.height
-            };
-            
-            // Include polygon if present (SAM2 support)
-            if (ann.has_polygon && ann.polygon) {
-                data.polygon_points = JSON.stringify(ann.polygon);
-            }
-            
-            return data;
-        });
-
-        await apiCall(`/api/images/${imageData.id}/annotations`, {
-            method: 'POST',
-            body: JSON.stringify({
-                annotations: annotationsToSave,
-                status: 'completed'
-            })
-        });
-        
-        // Update image status in local array
-        if (images[currentImageIndex]) {
-            images[currentImageIndex].status = 'completed';
-        }
-        
-        if (!autoSaveEnabled) {
-            showToast('Annotations saved!', 'success');
-        }
-        
-        // Move to next image only if requested and not auto-saving
-        if (autoNavigate && !autoSaveEnabled && currentImageIndex < images.length - 1) {
-            nextImage();
-        }
-    } catch (error) {
-        console.error('Save error:', error);
-        showToast('Failed to save annotations', 'error');
-        throw error; // Re-throw to prevent navigation on save failure
-    }
-};
-
+// Note: saveAnnotations sends polygons itself (annotationFields), so it isn't overridden here
 // Note: loadAnnotations override removed - polygon support is now in routes.py get_image_annotations
 
 console.log('✅ SAM2 Integration loaded');
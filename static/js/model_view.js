@@ -273,14 +273,9 @@ async function loadConfusionMatrices() {
 async function loadTestSamples() {
     try {
         // Get test set images
-        const data = await apiCall(`/api/projects/${PROJECT_ID}/images`);
-        const allImages = [];
-        data.batches.forEach(batch => {
-            allImages.push(...batch.images);
-        });
-        
-        // Take first 5 images as samples
-        const samples = allImages.slice(0, 5);
+        // Take the 5 newest images as samples
+        const data = await apiCall(`/api/projects/${PROJECT_ID}/images?limit=5`);
+        const samples = data.images;
         
         const samplesHtml = samples.map(img => `
             <img src="/api/images/${img.id}" 
@@ -1,15 +1,20 @@
 // Project page functionality
 
 let project = null;
-let allImages = [];
-let filteredImages = [];
+let filteredImages = []; // Images on the current page
 let currentFilter = 'all'; // 'all', 'annotated', 'unannotated'
+let currentClassFilter = ''; // Class id images must have an annotation of, or '' for any
+let filteredTotal = 0; // Images matching the filter, counted with the first page
+let nextCursor = null;
+let prevCursor = null;
 let classes = [];
 let datasetVersions = [];
 let currentPage = 1;
 let imagesPerPage = 25;
 let selectedImages = new Set(); // Track selected image IDs
 let socket = null; // SocketIO connection for real-time updates
+let activeIngestJobs = new Map(); // Ingest job id -> latest status, for uploads started from this page
+const INGEST_DONE_STATUSES = ['completed', 'completed_with_errors', 'failed'];
 
 document.addEventListener('DOMContentLoaded', () => {
     loadProject();
@@ -41,16 +46,16 @@ function setupSocketConnection() {
         console.error('❌ Socket connection error:', error);
     });
     
-    socket.on('pdf_processing', (data) => {
-        console.log('📨 PDF processing event received:', data);
-        if (data.project_id === PROJECT_ID) {
-            updateProcessingStatus(data);
+    // Progress of ingest jobs started by this client (the server scopes events to our socket)
+    socket.on('ingest_progress', (data) => {
+        if (data.project_id === PROJECT_ID && activeIngestJobs.has(data.job_id)) {
+            activeIngestJobs.set(data.job_id, data);
+            updateIngestStatus(data);
         }
     });
 }
 
-function updateProcessingStatus(data) {
-    console.log('📊 Updating processing status:', data);
+function updateIngestStatus(data) {
     const uploadStatus = document.getElementById('uploadStatus');
     const progressFill = document.getElementById('progressFill');
     const uploadProgress = document.getElementById('uploadProgress');
@@ -60,27 +65,93 @@ function updateProcessingStatus(data) {
         return;
     }
     
-    if (data.status === 'processing') {
-        uploadProgress.style.display = 'block';
-        const percent = (data.current / data.total) * 100;
-        progressFill.style.width = percent + '%';
-        uploadStatus.textContent = `Processing PDF: ${data.current}/${data.total} pages (resizing & saving...)`;
-        console.log(`📄 Processing: ${data.current}/${data.total} (${percent.toFixed(1)}%)`);
-    } else if (data.status === 'complete') {
-        progressFill.style.width = '100%';
-        uploadStatus.textContent = `✅ Processing complete! ${data.total} pages extracted.`;
-        console.log(`✅ PDF processing complete: ${data.total} pages`);
-        
-        // Auto-close after a brief delay and reload images
-        setTimeout(async () => {
-            console.log('🔄 Closing modal and reloading images...');
-            closeUploadModal();
-            await loadImages();
-            uploadProgress.style.display = 'none';
-            progressFill.style.width = '0%';
-            document.getElementById('fileInput').value = '';
-        }, 1500);
+    // Progress across every job of this upload (large uploads are sent as several jobs)
+    const jobs = [...activeIngestJobs.values()].filter(Boolean);
+    const total = jobs.reduce((sum, job) => sum + job.total, 0);
+    const done = jobs.reduce((sum, job) => sum + job.processed + job.failed, 0);
+    
+    uploadProgress.style.display = 'block';
+    progressFill.style.width = (total ? (done / total) * 100 : 0) + '%';
+    
+    if (data.pdf && data.status === 'processing') {
+        uploadStatus.textContent = `Processing ${data.pdf.filename}: ${data.pdf.current}/${data.pdf.total} pages...`;
+    } else if (data.archive && data.status === 'processing') {
+        const of = data.archive.total ? `/${data.archive.total}` : '';
+        uploadStatus.textContent = `Unpacking ${data.archive.filename}: ${data.archive.current}${of} images...`;
+    } else {
+        uploadStatus.textContent = `Processing files: ${done}/${total}...`;
+    }
+}
+
+// Resolve once every job has finished; polls as a fallback in case socket events are missed
+async function waitForIngestJobs(jobIds) {
+    jobIds.forEach(id => {
+        if (!activeIngestJobs.has(id)) activeIngestJobs.set(id, null);
+    });
+    
+    const isDone = id => {
+        const job = activeIngestJobs.get(id);
+        return job && INGEST_DONE_STATUSES.includes(job.status);
+    };
+    
+    let lastPoll = 0;
+    while (!jobIds.every(isDone)) {
+        await new Promise(resolve => setTimeout(resolve, 500));
+        if (Date.now() - lastPoll < 3000) continue;
+        lastPoll = Date.now();
+        
+        for (const id of jobIds.filter(id => !isDone(id))) {
+            try {
+                const job = await apiCall(`/api/ingest/${id}`);
+                activeIngestJobs.set(id, job);
+                updateIngestStatus(job);
+            } catch (error) {
+                console.error(`❌ Failed to poll ingest job ${id}:`, error);
+            }
+        }
+    }
+    
+    const results = jobIds.map(id => activeIngestJobs.get(id));
+    jobIds.forEach(id => activeIngestJobs.delete(id));
+    return results;
+}
+
+async function finishIngest(jobIds) {
+    const results = await waitForIngestJobs(jobIds);
+    const imagesCreated = results.reduce((sum, job) => sum + job.images_created, 0);
+    const failedJobs = results.filter(job => job.failed > 0 || job.status === 'failed');
+    
+    if (failedJobs.length === 0) {
+        document.getElementById('progressFill').style.width = '100%';
+        showToast(`Imported ${imagesCreated} images successfully!`, 'success');
+    } else {
+        const failedCount = failedJobs.reduce((sum, job) => sum + Math.max(job.failed, 1), 0);
+        showToast(`Imported ${imagesCreated} images; ${failedCount} files failed`, 'error');
+        
+        if (confirm(`${failedCount} files could not be imported. Retry them?`)) {
+            const retried = [];
+            for (const job of failedJobs) {
+                try {
+                    await apiCall(`/api/ingest/${job.job_id}/retry`, { method: 'POST' });
+                    retried.push(job.job_id);
+                } catch (error) {
+                    console.error(`❌ Retry of ingest job ${job.job_id} failed:`, error);
+                }
+            }
+            if (retried.length > 0) {
+                await loadImages();
+                return finishIngest(retried);
+            }
+        }
     }
+    
+    closeUploadModal();
+    await loadImages();
+    
+    // Reset
+    document.getElementById('uploadProgress').style.display = 'none';
+    document.getElementById('progressFill').style.width = '0%';
+    document.getElementById('fileInput').value = '';
 }
 
 async function loadProject() {
@@ -99,66 +170,64 @@ async function loadProject() {
 }
 
 async function loadImages() {
+    await Promise.all([loadImagesPage(), loadBatches()]);
+    updateSelectionUI();
+}
+
+async function loadImagesPage(cursor = null) {
+    // cursor: {after} or {before} from the previous response, null for the first page
     try {
-        const data = await apiCall(`/api/projects/${PROJECT_ID}/images`);
-        
-        // Flatten all images from batches
-        allImages = [];
-        data.batches.forEach(batch => {
-            allImages.push(...batch.images);
-        });
-        
-        // Update counts
-        const totalCount = allImages.length;
-        const annotatedCount = allImages.filter(img => img.status === 'completed').length;
-        const unannotatedCount = totalCount - annotatedCount;
-        
-        document.getElementById('allImagesCount').textContent = totalCount;
-        document.getElementById('annotatedCount').textContent = annotatedCount;
-        document.getElementById('unannotatedCount').textContent = unannotatedCount;
+        const params = new URLSearchParams({ limit: imagesPerPage, filter: currentFilter });
+        if (currentClassFilter) params.set('class_id', currentClassFilter);
+        if (cursor) Object.entries(cursor).forEach(([key, value]) => params.set(key, value));
+        
+        const data = await apiCall(`/api/projects/${PROJECT_ID}/images?${params}`);
+        filteredImages = data.images;
+        nextCursor = data.next_cursor;
+        prevCursor = data.prev_cursor;
+        
+        if (!cursor) {
+            // Counts only come with the first page
+            currentPage = 1;
+            filteredTotal = data.total;
+            document.getElementById('allImagesCount').textContent = data.counts.all;
+            document.getElementById('annotatedCount').textContent = data.counts.annotated;
+            document.getElementById('unannotatedCount').textContent = data.counts.unannotated;
+            document.getElementById('datasetCount').textContent = data.counts.annotated;
+        }
         
-        // Apply filter and display images grid
-        applyFilter();
         displayImagesGrid();
-        updateSelectionUI();
+    } catch (error) {
+        showToast('Failed to load images', 'error');
+    }
+}
+
+async function loadBatches() {
+    try {
+        const batches = await apiCall(`/api/projects/${PROJECT_ID}/batches`);
         
-        // Update batches section
         const unassignedBatches = document.getElementById('unassignedBatches');
-        document.getElementById('unassignedCount').textContent = data.batches.length;
+        document.getElementById('unassignedCount').textContent = batches.length;
         
-        if (data.batches.length === 0) {
+        if (batches.length === 0) {
             unassignedBatches.innerHTML = '<p class="empty-state">No batches uploaded yet</p>';
         } else {
-            unassignedBatches.innerHTML = data.batches.map(batch => `
+            unassignedBatches.innerHTML = batches.map(batch => `
                 <div class="batch-card">
                     <div class="batch-header">
-                        <span>Uploaded ${formatDate(batch.images[0].uploaded_at)}</span>
+                        <span>Uploaded ${formatDate(batch.uploaded_at)}</span>
                         <button class="btn-icon" onclick="viewBatch('${batch.batch_id}')">→</button>
                     </div>
                     <div class="batch-meta">
                         ${batch.count} images • 
-                        ${batch.images.filter(img => img.status === 'completed').length} annotated
+                        ${batch.annotated_count} annotated
                     </div>
                 </div>
             `).join('');
         }
-        
-        document.getElementById('datasetCount').textContent = annotatedCount;
-        
     } catch (error) {
-        showToast('Failed to load images', 'error');
-    }
-}
-
-function applyFilter() {
-    if (currentFilter === 'all') {
-        filteredImages = [...allImages];
-    } else if (currentFilter === 'annotated') {
-        filteredImages = allImages.filter(img => img.status === 'completed');
-    } else if (currentFilter === 'unannotated') {
-        filteredImages = allImages.filter(img => img.status !== 'completed');
+        showToast('Failed to load batches', 'error');
     }
-    currentPage = 1; // Reset to first page when filter changes
 }
 
 function filterImages(filter) {
@@ -177,15 +246,27 @@ function filterImages(filter) {
         }
     });
     
-    applyFilter();
-    displayImagesGrid();
+    loadImagesPage();
+}
+
+function updateClassFilterOptions() {
+    const select = document.getElementById('imageClassFilter');
+    select.innerHTML = '<option value="">All classes</option>' + classes.map(cls => `
+        <option value="${cls.id}" ${String(cls.id) === currentClassFilter ? 'selected' : ''}>${cls.name}</option>
+    `).join('');
+}
+
+function filterImagesByClass() {
+    currentClassFilter = document.getElementById('imageClassFilter').value;
+    loadImagesPage();
 }
 
 function displayImagesGrid() {
     const grid = document.getElementById('imagesGrid');
     
     if (filteredImages.length === 0) {
-        const emptyMessage = currentFilter === 'all' ? 'No images uploaded yet' :
+        const emptyMessage = currentClassFilter ? 'No images with this class' :
+                            currentFilter === 'all' ? 'No images uploaded yet' :
                             currentFilter === 'annotated' ? 'No annotated images yet' :
                             'No unannotated images';
         grid.innerHTML = `<p class="empty-state" style="grid-column: 1/-1; text-align: center; padding: 3rem;">${emptyMessage}</p>`;
@@ -196,14 +277,12 @@ function displayImagesGrid() {
         return;
     }
     
-    // Calculate pagination
-    const totalPages = Math.ceil(filteredImages.length / imagesPerPage);
-    const startIdx = (currentPage - 1) * imagesPerPage;
-    const endIdx = Math.min(startIdx + imagesPerPage, filteredImages.length);
-    const imagesToShow = filteredImages.slice(startIdx, endIdx);
+    // The server returns one page at a time
+    const totalPages = Math.max(Math.ceil(filteredTotal / imagesPerPage), currentPage);
+    const imagesToShow = filteredImages;
     
     // Update showing count
-    document.getElementById('totalImagesCount').textContent = filteredImages.length;
+    document.getElementById('totalImagesCount').textContent = filteredTotal;
     document.getElementById('showingCount').textContent = imagesToShow.length;
     
     // Render images
@@ -227,10 +306,7 @@ function displayImagesGrid() {
                 🗑️
             </button>
             
-            <img src="/api/images/${img.id}" 
-                 alt="${img.filename}" 
-                 class="image-thumbnail"
-                 loading="lazy">
+            <canvas class="image-thumbnail" data-image-id="${img.id}"></canvas>
             <div class="image-card-info">
                 <div class="image-card-name">${img.filename}</div>
                 <div class="image-card-meta">
@@ -241,14 +317,17 @@ function displayImagesGrid() {
         </div>
     `).join('');
     
+    // Thumbnails for the whole page come from one packed sprite
+    loadSpriteThumbnails(imagesToShow);
+    
     // Update select all checkbox state
     updateSelectAllCheckbox();
     
     // Update pagination controls (both top and bottom)
-    if (totalPages > 1) {
+    if (prevCursor || nextCursor) {
         const pageText = `Page ${currentPage} of ${totalPages}`;
-        const prevDisabled = currentPage === 1;
-        const nextDisabled = currentPage === totalPages;
+        const prevDisabled = !prevCursor;
+        const nextDisabled = !nextCursor;
         
         // Top pagination
         document.getElementById('paginationControlsTop').style.display = 'flex';
@@ -267,24 +346,108 @@ function displayImagesGrid() {
     }
 }
 
+async function loadSpriteThumbnails(imagesToShow) {
+    const ids = imagesToShow.map(img => img.id).join(',');
+    
+    try {
+        const sprite = await apiCall(`/api/projects/${PROJECT_ID}/thumbnails/sprite?ids=${ids}`);
+        
+        // PDF pages still rendering get a placeholder; their thumbnails load once they're ready
+        const pending = new Set(sprite.pending || []);
+        if (pending.size) {
+            const pendingImages = imagesToShow.filter(img => pending.has(img.id));
+            pendingImages.forEach(img => drawThumbnailPlaceholder(img.id));
+            loadIndividualThumbnails(pendingImages);
+        }
+        if (!sprite.url) return;
+        
+        const spriteImage = new Image();
+        
+        spriteImage.onload = () => {
+            Object.entries(sprite.images).forEach(([imageId, offset]) => {
+                // The page may have changed while the sprite was loading
+                const thumbCanvas = document.querySelector(`canvas.image-thumbnail[data-image-id="${imageId}"]`);
+                if (thumbCanvas) {
+                    drawSpriteThumbnail(thumbCanvas, spriteImage, offset);
+                }
+            });
+        };
+        spriteImage.onerror = () => loadIndividualThumbnails(imagesToShow.filter(img => !pending.has(img.id)));
+        spriteImage.src = sprite.url;
+    } catch (error) {
+        console.error('Failed to load thumbnail sprite:', error);
+        loadIndividualThumbnails(imagesToShow);
+    }
+}
+
+function drawThumbnailPlaceholder(imageId) {
+    const thumbCanvas = document.querySelector(`canvas.image-thumbnail[data-image-id="${imageId}"]`);
+    if (!thumbCanvas) return;
+    
+    const dpr = window.devicePixelRatio || 1;
+    thumbCanvas.width = thumbCanvas.clientWidth * dpr;
+    thumbCanvas.height = thumbCanvas.clientHeight * dpr;
+    const ctx = thumbCanvas.getContext('2d');
+    ctx.fillStyle = '#f3f4f6';
+    ctx.fillRect(0, 0, thumbCanvas.width, thumbCanvas.height);
+    ctx.fillStyle = '#9ca3af';
+    ctx.font = `${14 * dpr}px sans-serif`;
+    ctx.textAlign = 'center';
+    ctx.textBaseline = 'middle';
+    ctx.fillText('Rendering page…', thumbCanvas.width / 2, thumbCanvas.height / 2);
+}
+
+function drawSpriteThumbnail(thumbCanvas, spriteImage, offset) {
+    // Crop the thumbnail like object-fit: cover
+    const dpr = window.devicePixelRatio || 1;
+    const width = thumbCanvas.clientWidth;
+    const height = thumbCanvas.clientHeight;
+    thumbCanvas.width = width * dpr;
+    thumbCanvas.height = height * dpr;
+    
+    const scale = Math.max(width / offset.width, height / offset.height);
+    const sourceWidth = width / scale;
+    const sourceHeight = height / scale;
+    const sourceX = offset.x + (offset.width - sourceWidth) / 2;
+    const sourceY = offset.y + (offset.height - sourceHeight) / 2;
+    
+    thumbCanvas.getContext('2d').drawImage(
+        spriteImage,
+        sourceX, sourceY, sourceWidth, sourceHeight,
+        0, 0, thumbCanvas.width, thumbCanvas.height
+    );
+}
+
+function loadIndividualThumbnails(imagesToShow) {
+    // Fallback: one thumbnail request per card
+    imagesToShow.forEach(img => {
+        const thumbCanvas = document.querySelector(`canvas.image-thumbnail[data-image-id="${img.id}"]`);
+        if (!thumbCanvas) return;
+        
+        const thumb = new Image();
+        thumb.onload = () => drawSpriteThumbnail(thumbCanvas, thumb, {
+            x: 0, y: 0, width: thumb.naturalWidth, height: thumb.naturalHeight
+        });
+        thumb.src = `/api/images/${img.id}/thumbnail?v=${img.thumbnail_version}`;
+    });
+}
+
 function changeImagesPerPage() {
     imagesPerPage = parseInt(document.getElementById('imagesPerPage').value);
-    currentPage = 1; // Reset to first page
-    displayImagesGrid();
+    loadImagesPage(); // Back to the first page
 }
 
 function previousPage() {
-    if (currentPage > 1) {
-        currentPage--;
-        displayImagesGrid();
+    if (prevCursor) {
+        currentPage = Math.max(currentPage - 1, 1);
+        loadImagesPage({ before: prevCursor });
     }
 }
 
 function nextPage() {
-    const totalPages = Math.ceil(filteredImages.length / imagesPerPage);
-    if (currentPage < totalPages) {
+    if (nextCursor) {
         currentPage++;
-        displayImagesGrid();
+        loadImagesPage({ after: nextCursor });
     }
 }
 
@@ -293,18 +456,10 @@ function openAnnotation(imageId) {
     location.href = `/annotate/${PROJECT_ID}?image=${imageId}&filter=${currentFilter}`;
 }
 
-function openAnnotationOld(imageId) {
-    // Find the image index in allImages (old function, keeping for reference)
-    const imageIndex = allImages.findIndex(img => img.id === imageId);
-    if (imageIndex !== -1) {
-        // Navigate to annotation page, could add image index as query param
-        location.href = `/annotate/${PROJECT_ID}?image=${imageId}`;
-    }
-}
-
 async function loadClasses() {
     try {
         classes = await apiCall(`/api/projects/${PROJECT_ID}/classes`);
+        updateClassFilterOptions();
         
         const classesListView = document.getElementById('classesListView');
         
@@ -841,69 +996,146 @@ function selectDirectory() {
     directoryInput.click();
 }
 
-// Upload files in batches to avoid overwhelming the server/browser
-async function uploadInBatches(filesArray, hasPDF) {
-    const BATCH_SIZE = 50;
-    const totalFiles = filesArray.length;
-    const totalBatches = Math.ceil(totalFiles / BATCH_SIZE);
+// Files above this size (and folder-sized selections) use resumable chunked uploads
+const CHUNKED_UPLOAD_THRESHOLD = 20 * 1024 * 1024;
+const MAX_CHUNK_RETRIES = 5;
+// Finished uploads are handed to the server in ingest jobs of at most this many files
+const FINALIZE_BATCH_SIZE = 200;
+
+// Upload one file in chunks, resuming from whatever the server already has
+async function uploadFileInChunks(file, onProgress) {
+    const resumeKey = `freeflow-upload:${PROJECT_ID}:${file.name}:${file.size}:${file.lastModified}`;
+    let upload = null;
+    
+    // Pick up an upload of the same file left over from an interrupted session
+    const savedId = localStorage.getItem(resumeKey);
+    if (savedId) {
+        try {
+            upload = await apiCall(`/api/uploads/${savedId}`);
+            console.log(`🔁 Resuming ${file.name} at ${upload.offset}/${file.size} bytes`);
+        } catch (error) {
+            localStorage.removeItem(resumeKey);
+        }
+    }
+    if (!upload) {
+        upload = await apiCall(`/api/projects/${PROJECT_ID}/uploads`, {
+            method: 'POST',
+            body: JSON.stringify({ filename: file.name, size: file.size })
+        });
+        localStorage.setItem(resumeKey, upload.upload_id);
+    }
+    
+    let offset = upload.offset;
+    let retries = 0;
+    onProgress(offset);
+    
+    while (offset < file.size) {
+        const end = Math.min(offset + upload.chunk_size, file.size);
+        try {
+            const response = await fetch(`/api/uploads/${upload.upload_id}?offset=${offset}`, {
+                method: 'PUT',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: file.slice(offset, end)
+            });
+            const result = await response.json();
+            
+            // A 409 with an offset means the server has a different byte count; continue from it
+            if (response.ok || (response.status === 409 && typeof result.offset === 'number')) {
+                offset = result.offset;
+                retries = 0;
+                onProgress(offset);
+                continue;
+            }
+            throw new Error(result.error || `HTTP ${response.status}`);
+        } catch (error) {
+            if (++retries > MAX_CHUNK_RETRIES) throw error;
+            console.warn(`⚠️ Chunk at ${offset} of ${file.name} failed, retrying (${retries}/${MAX_CHUNK_RETRIES})`, error);
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** (retries - 1)));
+            
+            // Ask the server how much actually arrived before resending
+            try {
+                offset = (await apiCall(`/api/uploads/${upload.upload_id}`)).offset;
+            } catch (statusError) {
+                // Keep the last known offset and try again
+            }
+        }
+    }
     
+    return { uploadId: upload.upload_id, resumeKey };
+}
+
+// Upload large files and folders chunk by chunk, then ingest them
+async function uploadResumable(filesArray) {
     const uploadProgress = document.getElementById('uploadProgress');
     const uploadStatus = document.getElementById('uploadStatus');
     const progressFill = document.getElementById('progressFill');
     
-    let uploadedCount = 0;
-    let totalImagesUploaded = 0;
+    const totalBytes = filesArray.reduce((sum, file) => sum + file.size, 0);
+    let completedBytes = 0;
+    const uploaded = [];
+    let failedCount = 0;
     
-    for (let i = 0; i < totalBatches; i++) {
-        const start = i * BATCH_SIZE;
-        const end = Math.min(start + BATCH_SIZE, totalFiles);
-        const batch = filesArray.slice(start, end);
-        
-        console.log(`📤 Uploading batch ${i + 1}/${totalBatches} (${batch.length} files)`);
-        
-        const formData = new FormData();
-        for (let file of batch) {
-            formData.append('files', file);
-        }
+    for (let i = 0; i < filesArray.length; i++) {
+        const file = filesArray[i];
+        uploadStatus.textContent = `Uploading ${file.name} (${i + 1}/${filesArray.length})...`;
         
         try {
-            uploadStatus.textContent = `Uploading batch ${i + 1}/${totalBatches} (${uploadedCount}/${totalFiles} files)...`;
-            
-            const response = await fetch(`/api/projects/${PROJECT_ID}/upload`, {
-                method: 'POST',
-                body: formData
-            });
-            
-            if (response.ok) {
-                const result = await response.json();
-                uploadedCount = end;
-                totalImagesUploaded += result.images.length;
-                
-                const percent = (uploadedCount / totalFiles) * 100;
+            uploaded.push(await uploadFileInChunks(file, (fileOffset) => {
+                const percent = totalBytes ? ((completedBytes + fileOffset) / totalBytes) * 100 : 100;
                 progressFill.style.width = percent + '%';
-                
-                console.log(`✅ Batch ${i + 1}/${totalBatches} complete: ${result.images.length} images uploaded`);
-            } else {
-                const error = await response.json();
-                throw new Error(error.error || 'Upload failed');
-            }
+            }));
         } catch (error) {
-            console.error(`❌ Batch ${i + 1} failed:`, error);
-            showToast(`Upload failed at batch ${i + 1}: ${error.message}`, 'error');
+            console.error(`❌ Upload of ${file.name} failed:`, error);
+            failedCount++;
+        }
+        completedBytes += file.size;
+    }
+    
+    if (failedCount > 0) {
+        showToast(`${failedCount} files could not be uploaded; select them again to resume`, 'error');
+    }
+    if (uploaded.length === 0) {
+        uploadProgress.style.display = 'none';
+        return;
+    }
+    
+    const jobIds = [];
+    try {
+        for (let i = 0; i < uploaded.length; i += FINALIZE_BATCH_SIZE) {
+            const group = uploaded.slice(i, i + FINALIZE_BATCH_SIZE);
+            const result = await apiCall(`/api/projects/${PROJECT_ID}/uploads/finalize`, {
+                method: 'POST',
+                body: JSON.stringify({
+                    upload_ids: group.map(u => u.uploadId),
+                    socket_id: socket ? socket.id : null,
+                    skip_duplicates: document.getElementById('skipDuplicatesInput').checked
+                })
+            });
+            jobIds.push(result.job_id);
+            activeIngestJobs.set(result.job_id, null);
+            group.forEach(u => localStorage.removeItem(u.resumeKey));
+            reportRejectedFiles(result.rejected);
+        }
+    } catch (error) {
+        showToast('Failed to start processing uploaded files', 'error');
+        if (jobIds.length === 0) {
             uploadProgress.style.display = 'none';
             return;
         }
     }
     
-    // All batches complete
-    if (hasPDF) {
-        uploadStatus.textContent = 'All batches uploaded! Processing PDFs...';
-        // Socket will handle PDF processing updates
-    } else {
-        showToast(`Successfully uploaded ${totalImagesUploaded} images in ${totalBatches} batches!`, 'success');
-        closeUploadModal();
-        await loadImages();
-    }
+    uploadStatus.textContent = 'Upload complete! Processing files...';
+    progressFill.style.width = '0%';
+    await finishIngest(jobIds);
+}
+
+// Files the server turned away because they were truncated or not decodable
+function reportRejectedFiles(rejected) {
+    if (!rejected || rejected.length === 0) return;
+    rejected.forEach(r => console.warn(`⚠️ Rejected ${r.filename}: ${r.error}`));
+    const names = rejected.slice(0, 3).map(r => r.filename).join(', ');
+    const more = rejected.length > 3 ? ` and ${rejected.length - 3} more` : '';
+    showToast(`Skipped ${rejected.length} corrupt or truncated files: ${names}${more}`, 'error');
 }
 
 async function handleFiles(files) {
@@ -919,25 +1151,18 @@ async function handleFiles(files) {
     
     console.log(`📦 Uploading ${totalFiles} files`);
     
-    // Check if any PDFs are being uploaded
-    const hasPDF = filesArray.some(file => file.name.toLowerCase().endsWith('.pdf'));
-    
-    // Ensure socket is connected for PDF processing updates
-    if (hasPDF) {
-        if (!socket || !socket.connected) {
-            console.log('🔌 Socket not connected, reconnecting for PDF processing...');
-            setupSocketConnection();
-            await new Promise(resolve => setTimeout(resolve, 500));
-        } else {
-            console.log('✅ Socket already connected for PDF processing');
-        }
+    // Ensure socket is connected so the server can send us ingest progress
+    if (!socket || !socket.connected) {
+        console.log('🔌 Socket not connected, reconnecting for ingest progress...');
+        setupSocketConnection();
+        await new Promise(resolve => setTimeout(resolve, 500));
     }
     
-    // If more than 50 files, upload in batches
+    // Folders and large files go through resumable chunked uploads
     const BATCH_SIZE = 50;
-    if (totalFiles > BATCH_SIZE) {
-        console.log(`📦 Large upload detected: ${totalFiles} files. Uploading in batches of ${BATCH_SIZE}...`);
-        await uploadInBatches(filesArray, hasPDF);
+    if (totalFiles > BATCH_SIZE || filesArray.some(file => file.size > CHUNKED_UPLOAD_THRESHOLD)) {
+        console.log(`📦 Large upload detected: ${totalFiles} files. Using resumable chunked uploads...`);
+        await uploadResumable(filesArray);
         return;
     }
     
@@ -946,6 +1171,8 @@ async function handleFiles(files) {
     for (let file of filesArray) {
         formData.append('files', file);
     }
+    if (socket && socket.id) formData.append('socket_id', socket.id);
+    if (document.getElementById('skipDuplicatesInput').checked) formData.append('skip_duplicates', 'true');
     
     try {
         const xhr = new XMLHttpRequest();
@@ -959,26 +1186,19 @@ async function handleFiles(files) {
         });
         
         xhr.addEventListener('load', async () => {
-            if (xhr.status === 201) {
+            if (xhr.status === 202) {
+                // Files are staged; socket updates show ingest progress until the job finishes
                 const result = JSON.parse(xhr.responseText);
-                
-                // If PDF was uploaded, show processing message
-                // Socket updates will show real-time progress and close the modal
-                if (hasPDF) {
-                    uploadStatus.textContent = 'Upload complete! Processing PDF pages...';
-                    progressFill.style.width = '0%';
-                    // Socket will handle the rest via updateProcessingStatus()
-                } else {
-                    // No PDF, complete immediately
-                    showToast(`Uploaded ${result.images.length} images successfully!`, 'success');
-                    closeUploadModal();
-                    await loadImages();
-                    
-                    // Reset
-                    uploadProgress.style.display = 'none';
-                    progressFill.style.width = '0%';
-                    document.getElementById('fileInput').value = '';
-                }
+                activeIngestJobs.set(result.job_id, null);
+                reportRejectedFiles(result.rejected);
+                uploadStatus.textContent = 'Upload complete! Processing files...';
+                progressFill.style.width = '0%';
+                await finishIngest([result.job_id]);
+            } else if (xhr.status === 400) {
+                const response = JSON.parse(xhr.responseText);
+                reportRejectedFiles(response.rejected);
+                if (!response.rejected) showToast(response.error || 'Upload failed', 'error');
+                uploadProgress.style.display = 'none';
             } else if (xhr.status === 413) {
                 const response = JSON.parse(xhr.responseText);
                 showToast(response.message || 'File too large. Maximum size is 1GB.', 'error');
@@ -1082,6 +1302,78 @@ async function importFromRoboflow() {
     }
 }
 
+// ==================== LOCAL DATASET IMPORT ====================
+
+function showLocalImportModal() {
+    document.getElementById('localImportModal').classList.add('active');
+}
+
+function closeLocalImportModal() {
+    document.getElementById('localImportModal').classList.remove('active');
+    document.getElementById('localImportPath').value = '';
+    document.getElementById('localImportFormat').value = 'auto';
+    document.getElementById('localImportProgress').style.display = 'none';
+    document.getElementById('localImportProgressBar').style.width = '0%';
+    document.getElementById('localImportBtn').disabled = false;
+}
+
+async function importLocalDataset() {
+    const path = document.getElementById('localImportPath').value.trim();
+    const format = document.getElementById('localImportFormat').value;
+    
+    if (!path) {
+        showToast('Please enter a folder path', 'error');
+        return;
+    }
+    
+    const progressDiv = document.getElementById('localImportProgress');
+    const statusText = document.getElementById('localImportStatus');
+    const progressBar = document.getElementById('localImportProgressBar');
+    const importBtn = document.getElementById('localImportBtn');
+    
+    progressDiv.style.display = 'block';
+    statusText.textContent = 'Scanning folder...';
+    importBtn.disabled = true;
+    
+    try {
+        const response = await fetch(`/api/projects/${PROJECT_ID}/import-local`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ path, format, socket_id: socket ? socket.id : null })
+        });
+        const result = await response.json();
+        if (response.status !== 202) throw new Error(result.error || 'Import failed');
+        
+        // The import runs in the background; poll its job until it finishes
+        let job = null;
+        while (!job || !INGEST_DONE_STATUSES.includes(job.status)) {
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            job = await apiCall(result.status_url);
+            if (job.total) {
+                progressBar.style.width = ((job.processed + job.failed) / job.total) * 100 + '%';
+                statusText.textContent = `Importing images: ${job.processed + job.failed}/${job.total}...`;
+            }
+        }
+        
+        if (job.status === 'failed') throw new Error(job.error || 'Import failed');
+        progressBar.style.width = '100%';
+        statusText.textContent = 'Import complete!';
+        const skipped = job.failed ? ` (${job.failed} unreadable files skipped)` : '';
+        showToast(`Imported ${job.images_created} images${skipped}`, job.failed ? 'warning' : 'success');
+        
+        setTimeout(async () => {
+            closeLocalImportModal();
+            await loadImages();
+            await loadClasses();
+        }, 1000);
+    } catch (error) {
+        console.error('Local import failed:', error);
+        showToast(error.message || 'Failed to import dataset', 'error');
+        progressDiv.style.display = 'none';
+        importBtn.disabled = false;
+    }
+}
+
 // ==================== CLASS MANAGEMENT ====================
 
 function showAddClassModal() {
@@ -1369,6 +1661,14 @@ async function loadSettings() {
     // Load current project name
     document.getElementById('projectNameInput').value = project.name;
     
+    // Load current ingest policy
+    const policy = project.ingest_policy || {};
+    document.getElementById('ingestApplyOrientation').checked = !!policy.apply_orientation;
+    document.getElementById('ingestFormat').value = policy.format || '';
+    document.getElementById('ingestQuality').value = policy.quality || 90;
+    document.getElementById('ingestMaxSide').value = policy.max_side || '';
+    document.getElementById('ingestKeepOriginals').checked = !!policy.keep_originals;
+    
     // Load current thumbnail
     document.getElementById('currentThumbnail').src = `/api/projects/${PROJECT_ID}/thumbnail`;
     document.getElementById('currentThumbnail').onerror = function() {
@@ -1398,15 +1698,52 @@ async function updateProjectName() {
     }
 }
 
+async function updateIngestPolicy() {
+    const policy = {
+        apply_orientation: document.getElementById('ingestApplyOrientation').checked,
+        format: document.getElementById('ingestFormat').value || null,
+        quality: parseInt(document.getElementById('ingestQuality').value) || 90,
+        max_side: parseInt(document.getElementById('ingestMaxSide').value) || null,
+        keep_originals: document.getElementById('ingestKeepOriginals').checked
+    };
+    
+    try {
+        const response = await fetch(`/api/projects/${PROJECT_ID}`, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ ingest_policy: policy })
+        });
+        const data = await response.json();
+        if (!response.ok) {
+            showToast(data.error || 'Failed to update ingest policy', 'error');
+            return;
+        }
+        
+        project.ingest_policy = policy;
+        showToast('Ingest policy updated successfully', 'success');
+    } catch (error) {
+        showToast('Failed to update ingest policy', 'error');
+    }
+}
+
+let thumbnailChoices = [];
+
 async function showThumbnailSelector() {
     const selector = document.getElementById('thumbnailSelector');
     
     if (selector.style.display === 'none') {
-        // Load all images
+        // Offer the newest images rather than loading the whole project
         const grid = document.getElementById('thumbnailGridSelector');
-        grid.innerHTML = allImages.map(img => `
+        try {
+            const data = await apiCall(`/api/projects/${PROJECT_ID}/images?limit=200`);
+            thumbnailChoices = data.images;
+        } catch (error) {
+            showToast('Failed to load images', 'error');
+            return;
+        }
+        grid.innerHTML = thumbnailChoices.map(img => `
             <div onclick="selectThumbnailImage(${img.id})" style="cursor: pointer; border: 2px solid var(--border); border-radius: 0.5rem; overflow: hidden; transition: all 0.2s; position: relative;" onmouseover="this.style.borderColor='var(--primary-color)'" onmouseout="this.style.borderColor='var(--border)'">
-                <img src="/api/images/${img.id}" style="width: 100%; height: 120px; object-fit: cover; display: block;">
+                <img src="/api/images/${img.id}/thumbnail?v=${img.thumbnail_version}" style="width: 100%; height: 120px; object-fit: cover; display: block;" loading="lazy">
                 <div style="position: absolute; top: 0.25rem; right: 0.25rem; background: var(--primary-color); color: white; padding: 0.25rem 0.5rem; border-radius: 0.25rem; font-size: 0.75rem; display: none;" id="selected-${img.id}">✓</div>
             </div>
         `).join('');
@@ -1425,7 +1762,8 @@ async function selectThumbnailImage(imageId) {
         });
         
         // Update preview
-        document.getElementById('currentThumbnail').src = `/api/images/${imageId}`;
+        const selectedImage = thumbnailChoices.find(img => img.id === imageId);
+        document.getElementById('currentThumbnail').src = `/api/images/${imageId}?v=${selectedImage ? selectedImage.version : ''}`;
         
         // Hide selector
         document.getElementById('thumbnailSelector').style.display = 'none';
@@ -1480,7 +1818,7 @@ function toggleSelectAll() {
     const selectAllCheckbox = document.getElementById('selectAllImages');
     
     if (selectAllCheckbox.checked) {
-        // Select all visible images
+        // Select all images on this page
         filteredImages.forEach(img => selectedImages.add(img.id));
     } else {
         // Deselect all
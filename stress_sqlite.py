@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Stress test for concurrent database writes
+Runs simulated training jobs (per-epoch early-stop checks and progress
+writes through the background write path) while annotator threads save
+annotations through the API, then reports save latencies and any
+'database is locked' errors.
+
+Runs against a temporary SQLite database (with the app's SQLite settings)
+that is deleted at the end. --use-app-database runs on a scratch project in
+the database the app is configured for instead (DATABASE_URL, or the
+FreeFlow database itself), e.g. to measure PostgreSQL:
+    python stress_sqlite.py --annotators 8 --trainers 2 --seconds 30
+    DATABASE_URL=postgresql://localhost/freeflow_test python stress_sqlite.py --use-app-database
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent annotation saves during training')
+    parser.add_argument('--annotators', type=int, default=8, help='Threads saving annotations')
+    parser.add_argument('--trainers', type=int, default=2, help='Simulated training threads')
+    parser.add_argument('--seconds', type=float, default=20, help='How long to run')
+    parser.add_argument('--images', type=int, default=200, help='Images in the scratch project')
+    parser.add_argument('--epoch-ms', type=float, default=50, help='Simulated epoch length')
+    parser.add_argument('--use-app-database', action='store_true',
+                        help="Run in the app's configured database instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    scratch_dir = None
+    if not args.use_app_database:
+        # The app reads DATABASE_URL when it is imported
+        scratch_dir = tempfile.mkdtemp(prefix='freeflow_stress_')
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(scratch_dir, 'stress.db')}"
+
+    try:
+        return run(args)
+    finally:
+        if scratch_dir:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+
+def run(args):
+    from app import app
+    from database import db, serialized_commit
+    from models import Project, Image, Annotation, Class, TrainingJob
+
+    with app.app_context():
+        print(f"🔧 Database: {db.engine.url.render_as_string(hide_password=True)}")
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as connection:
+                journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+                busy_timeout = connection.exec_driver_sql("PRAGMA busy_timeout").scalar()
+            print(f"   journal_mode={journal_mode}, busy_timeout={busy_timeout}ms")
+
+        project = Project(name='Stress test (scratch)', project_type='object_detection')
+        db.session.add(project)
+        db.session.flush()
+        cls = Class(name='object', color='#ff0000', project_id=project.id)
+        db.session.add(cls)
+        db.session.execute(Image.__table__.insert(), [
+            {'project_id': project.id, 'filename': f'stress_{i}.jpg', 'filepath': f'stress_{i}.jpg',
+             'width': 640, 'height': 480, 'status': 'unassigned'}
+            for i in range(args.images)
+        ])
+        jobs = [TrainingJob(project_id=project.id, name=f'Stress training {i}', status='training', epochs=10 ** 6)
+                for i in range(args.trainers)]
+        db.session.add_all(jobs)
+        db.session.commit()
+        project_id, class_id = project.id, cls.id
+        job_ids = [job.id for job in jobs]
+        image_ids = [image_id for (image_id,) in db.session.query(Image.id).filter_by(project_id=project_id)]
+
+    deadline = time.time() + args.seconds
+    latencies = []
+    errors = []
+    epochs = [0] * args.trainers
+    results_lock = threading.Lock()
+
+    def annotator():
+        client = app.test_client()
+        while time.time() < deadline:
+            boxes = [{'class_id': class_id, 'x_center': random.random(), 'y_center': random.random(),
+                      'width': 0.1, 'height': 0.1} for _ in range(random.randint(1, 20))]
+            start = time.time()
+            try:
+                response = client.post(f'/api/images/{random.choice(image_ids)}/annotations',
+                                       json={'annotations': boxes, 'status': 'completed'})
+                failed = None if response.status_code == 200 else f"HTTP {response.status_code}"
+            except OperationalError as e:
+                failed = str(e.orig)
+            with results_lock:
+                if failed:
+                    errors.append(failed)
+                else:
+                    latencies.append(time.time() - start)
+
+    def trainer(index):
+        job_id = job_ids[index]
+        history = []
+        while time.time() < deadline:
+            time.sleep(args.epoch_ms / 1000)
+            try:
+                # Same shape as train_yolo_model's epoch callback: early-stop check, then progress
+                with app.app_context():
+                    job = TrainingJob.query.get(job_id)
+                    if job.stop_early:
+                        return
+                    history.append(random.random())
+                    job.metrics = json.dumps({'map50': history})
+                    serialized_commit()
+                epochs[index] += 1
+            except OperationalError as e:
+                with results_lock:
+                    errors.append(f"trainer: {e.orig}")
+
+    threads = [threading.Thread(target=annotator) for _ in range(args.annotators)]
+    threads += [threading.Thread(target=trainer, args=(i,)) for i in range(args.trainers)]
+    print(f"🏋️ {args.trainers} training threads, {args.annotators} annotators, {args.seconds:g}s")
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with app.app_context():
+        image_query = db.session.query(Image.id).filter(Image.project_id == project_id)
+        Annotation.query.filter(Annotation.image_id.in_(image_query)).delete(synchronize_session=False)
+        Image.query.filter_by(project_id=project_id).delete()
+        Class.query.filter_by(project_id=project_id).delete()
+        TrainingJob.query.filter_by(project_id=project_id).delete()
+        Project.query.filter_by(id=project_id).delete()
+        db.session.commit()
+
+    print(f"📊 {len(latencies)} saves ({len(latencies) / args.seconds:.0f}/s), {sum(epochs)} training epochs")
+    if latencies:
+        print(f"   save latency: p50 {statistics.median(latencies) * 1000:.1f}ms, "
+              f"p95 {percentile(latencies, 0.95) * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms")
+    locked = [error for error in errors if 'locked' in error]
+    if errors:
+        print(f"❌ {len(errors)} failed writes ({len(locked)} 'database is locked'), e.g. {errors[0]}")
+        return 1
+    print("✅ No failed writes")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
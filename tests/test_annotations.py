@@ -0,0 +1,57 @@
+import pytest
+from database import db
+from models import Annotation, Class, Image
+
+
+@pytest.fixture
+def image(project):
+    cls = Class(name='car', project_id=project.id)
+    image = Image(project_id=project.id, filename='a.jpg', filepath='/tmp/a.jpg', width=64, height=48)
+    db.session.add_all([cls, image])
+    db.session.commit()
+    return image
+
+
+def box(image, **fields):
+    return {'class_id': image.project.classes[0].id, 'x_center': 0.5, 'y_center': 0.5,
+            'width': 0.2, 'height': 0.1, **fields}
+
+
+def patch(client, image, revision, **delta):
+    return client.patch(f'/api/images/{image.id}/annotations', json={'revision': revision, **delta})
+
+
+def test_patch_claims_the_next_revision(client, image):
+    response = patch(client, image, 0, created=[box(image), box(image, x_center=0.25)])
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['revision'] == 1
+    assert len(response.get_json()['created']) == 2
+    assert Annotation.query.filter_by(image_id=image.id).count() == 2
+
+
+def test_stale_patch_is_rejected_with_the_current_state(client, image):
+    first = patch(client, image, 0, created=[box(image)]).get_json()
+
+    # A second tab still holding revision 0 tries to save over it
+    response = patch(client, image, 0, deleted=first['created'])
+
+    assert response.status_code == 409
+    current = response.get_json()['current']
+    assert current['revision'] == 1
+    assert [ann['id'] for ann in current['annotations']] == first['created']
+    assert Annotation.query.filter_by(image_id=image.id).count() == 1
+
+
+def test_full_replace_bumps_the_revision(client, image):
+    patch(client, image, 0, created=[box(image)])
+
+    response = client.post(f'/api/images/{image.id}/annotations', json={'annotations': [box(image, x_center=0.75)]})
+
+    assert response.status_code == 200
+    assert response.get_json()['revision'] == 2
+    # Edits based on the revision before the replace are now stale
+    stale = patch(client, image, 1, created=[box(image)])
+    assert stale.status_code == 409
+    assert [ann['x_center'] for ann in stale.get_json()['current']['annotations']] == [0.75]
+    assert patch(client, image, 2, created=[box(image)]).status_code == 200
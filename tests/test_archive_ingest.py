@@ -0,0 +1,62 @@
+import io
+import time
+import zipfile
+from PIL import Image as PILImage
+from archive_ingest import archive_image_name
+from database import db
+from models import Image
+
+
+def jpeg_bytes(color):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (32, 24), color).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def upload_archive(client, project, filename, entries):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for name, data in entries.items():
+            zf.writestr(name, data)
+    archive.seek(0)
+
+    response = client.post(f'/api/projects/{project.id}/upload', data={'files': (archive, filename)},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()['job_id']
+
+    for _ in range(100):
+        job = client.get(f'/api/ingest/{job_id}').get_json()
+        if job['status'] not in ('queued', 'processing'):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Ingest job {job_id} did not finish")
+
+
+def stored_filenames(project):
+    db.session.expire_all()
+    return sorted(filename for (filename,) in db.session.query(Image.filename).filter_by(project_id=project.id))
+
+
+def test_archive_image_name_drops_folder_named_like_the_archive():
+    assert archive_image_name('ds', 'ds/images/c.jpg') == 'ds/images/c.jpg'
+    assert archive_image_name('ds', 'images/c.jpg') == 'ds/images/c.jpg'
+    assert archive_image_name('ds', 'other/c.jpg') == 'ds/other/c.jpg'
+    assert archive_image_name('ds', 'c.jpg') == 'ds/c.jpg'
+
+
+def test_archive_with_top_level_folder_is_not_prefixed_twice(client, project):
+    job = upload_archive(client, project, 'ds.zip', {
+        'ds/images/c.jpg': jpeg_bytes((255, 0, 0)),
+        'ds/images/d.jpg': jpeg_bytes((0, 0, 255)),
+    })
+
+    assert job['status'] == 'completed', job
+    assert stored_filenames(project) == ['ds/images/c.jpg', 'ds/images/d.jpg']
+
+
+def test_archive_without_top_level_folder_gets_the_stem(client, project):
+    job = upload_archive(client, project, 'flat.zip', {'c.jpg': jpeg_bytes((0, 255, 0))})
+
+    assert job['status'] == 'completed', job
+    assert stored_filenames(project) == ['flat/c.jpg']
@@ -0,0 +1,85 @@
+import os
+import pytest
+import blob_store
+from blob_store import abandon_blobs, acquire_blob, blob_upsert, release_blob, store_file
+from bulk_insert import acquire_blobs
+from conftest import write_image
+from database import db
+from models import Blob
+
+
+def stored_blob(name, color):
+    return store_file(write_image(os.path.abspath(name), color=color), move=True)
+
+
+def test_acquire_blob_counts_references_on_one_row(app):
+    sha256, path, size = stored_blob('acquire.png', (1, 2, 3))
+
+    acquire_blob(sha256, path, size)
+    acquire_blob(sha256, path, size)
+    acquire_blobs([(sha256, path, size)] * 3)
+    db.session.commit()
+
+    assert db.session.get(Blob, sha256).ref_count == 5
+
+
+def test_released_blob_file_survives_a_rollback(app):
+    sha256, path, size = stored_blob('rollback.png', (4, 5, 6))
+    acquire_blob(sha256, path, size)
+    db.session.commit()
+
+    assert release_blob(sha256)
+    assert os.path.exists(path)
+    db.session.rollback()
+
+    assert os.path.exists(path)
+    assert db.session.get(Blob, sha256).ref_count == 1
+
+
+def test_released_blob_file_is_deleted_after_commit(app):
+    sha256, path, size = stored_blob('commit.png', (7, 8, 9))
+    acquire_blob(sha256, path, size)
+    db.session.commit()
+
+    assert release_blob(sha256)
+    assert os.path.exists(path)
+    db.session.commit()
+
+    assert not os.path.exists(path)
+    assert db.session.get(Blob, sha256) is None
+
+
+def test_store_of_released_content_keeps_the_file(app):
+    sha256, path, size = stored_blob('shared.png', (10, 11, 12))
+    acquire_blob(sha256, path, size)
+    db.session.commit()
+
+    # A second upload of the same bytes reuses the blob, then the first image is deleted before the upload is written
+    again = store_file(write_image(os.path.abspath('shared-again.png'), color=(10, 11, 12)), move=True)
+    assert again == (sha256, path, size)
+    assert release_blob(sha256)
+    db.session.commit()
+    assert os.path.exists(path)
+
+    acquire_blob(sha256, path, size)
+    db.session.commit()
+
+    assert os.path.exists(path)
+    assert db.session.get(Blob, sha256).ref_count == 1
+    assert sha256 not in blob_store._pins
+
+
+def test_abandoned_store_deletes_the_unreferenced_file(app):
+    sha256, path, size = stored_blob('abandoned.png', (13, 14, 15))
+
+    abandon_blobs([(sha256, path)])
+
+    assert not os.path.exists(path)
+    assert sha256 not in blob_store._pins
+
+
+@pytest.mark.postgresql
+def test_blob_upsert_uses_on_conflict_on_postgresql(app):
+    from sqlalchemy.dialects.postgresql import insert
+
+    assert blob_upsert() is insert
@@ -0,0 +1,20 @@
+import pytest
+from bulk_insert import insert_images
+from database import db
+from models import Image
+
+
+def test_insert_images_returns_ids_in_row_order(project):
+    # Rows of two shapes go through separate executemany calls; ids must still line up with the input
+    rows = [{'filename': f'img{i}.jpg', 'filepath': f'/nowhere/{i}.jpg', 'project_id': project.id,
+             **({'width': i} if i % 2 else {})} for i in range(7)]
+
+    ids = insert_images(rows)
+    db.session.commit()
+
+    assert [db.session.get(Image, image_id).filename for image_id in ids] == [row['filename'] for row in rows]
+
+
+@pytest.mark.postgresql
+def test_postgresql_inserts_with_ordered_returning(app):
+    assert db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order
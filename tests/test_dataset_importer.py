@@ -0,0 +1,40 @@
+import os
+import dataset_importer
+from conftest import write_image
+from database import db
+from dataset_importer import create_dataset_import_job, run_dataset_import
+from models import Annotation, Class, Image
+
+
+def write_yolo_dataset(root, labels):
+    for name, lines in labels.items():
+        write_image(os.path.join(root, 'images', f'{name}.jpg'), color=(len(name) * 40, 0, 0))
+        os.makedirs(os.path.join(root, 'labels'), exist_ok=True)
+        with open(os.path.join(root, 'labels', f'{name}.txt'), 'w') as f:
+            f.write(''.join(f"{line}\n" for line in lines))
+
+
+def test_yolo_classes_without_names_are_created_up_front(app, project, monkeypatch):
+    root = os.path.abspath('yolo-no-names')
+    write_yolo_dataset(root, {
+        'a': ['0 0.5 0.5 0.2 0.2'],
+        'bb': ['3 0.5 0.5 0.2 0.2', '0 0.1 0.1 0.1 0.1'],
+    })
+    calls = []
+    resolve_class_ids = dataset_importer.resolve_class_ids
+    monkeypatch.setattr(dataset_importer, 'resolve_class_ids',
+                        lambda project, names: calls.append(dict(names)) or resolve_class_ids(project, names))
+    job = create_dataset_import_job(project.id)
+    db.session.commit()
+
+    run_dataset_import(app, None, job.id, root)
+
+    # YOLO and VOC classes are looked up once, before any image is stored (no per-label fallback)
+    assert calls == [{0: 'class_0', 3: 'class_3'}, {}]
+    db.session.expire_all()
+    assert job.status == 'completed'
+    classes = {cls.name: cls.id for cls in Class.query.filter_by(project_id=project.id)}
+    assert set(classes) == {'class_0', 'class_3'}
+    counts = {name: Annotation.query.filter_by(class_id=class_id).count() for name, class_id in classes.items()}
+    assert counts == {'class_0': 2, 'class_3': 1}
+    assert Image.query.filter_by(project_id=project.id).count() == 2
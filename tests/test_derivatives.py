@@ -0,0 +1,117 @@
+import os
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image as PILImage
+import derivatives
+from conftest import write_image
+from derivatives import (build_sprite, ensure_display_image, ensure_thumbnail, ensure_tile_pyramid, sprite_paths,
+                         thumbnail_path, tile_descriptor, tile_path)
+from models import Image
+
+
+def test_concurrent_thumbnail_requests_generate_it_once(app, monkeypatch):
+    source = write_image(os.path.abspath('thumb-source.png'), size=(800, 600))
+    old = types.SimpleNamespace(id=9001, filepath=source, content_hash='a' * 64)
+    new = types.SimpleNamespace(id=9001, filepath=source, content_hash='b' * 64)
+    ensure_thumbnail(old)
+
+    generated = []
+    generate_thumbnail = derivatives.generate_thumbnail
+
+    def counting_generate(*args):
+        generated.append(args)
+        generate_thumbnail(*args)
+
+    def request_thumbnail(image):
+        with app.app_context():
+            return ensure_thumbnail(image)
+
+    monkeypatch.setattr(derivatives, 'generate_thumbnail', counting_generate)
+    # Requests for the new version clear the old one's folder; none may clear another's output
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        paths = list(executor.map(request_thumbnail, [new] * 16))
+
+    assert len(generated) == 1
+    assert set(paths) == {thumbnail_path(new)}
+    assert os.listdir(os.path.dirname(thumbnail_path(new))) == [os.path.basename(thumbnail_path(new))]
+
+
+def rotated_photo(name):
+    """A 4000x3000 JPEG tagged EXIF orientation 6, i.e. displayed upright as 3000x4000"""
+    return write_image(os.path.abspath(name), size=(4000, 3000), orientation=6)
+
+
+def test_display_copy_and_thumbnail_are_upright(app):
+    source = rotated_photo('rotated-display.jpg')
+    image = types.SimpleNamespace(id=9002, filepath=source, content_hash='c' * 64, width=3000, height=4000)
+
+    with PILImage.open(ensure_display_image(image)) as display:
+        assert display.size == (1536, 2048)
+    with PILImage.open(ensure_thumbnail(image)) as thumb:
+        assert thumb.size == (240, 320)
+
+
+def test_ingest_records_the_upright_size(app, client, project):
+    with open(rotated_photo('rotated-upload.jpg'), 'rb') as f:
+        response = client.post(f'/api/projects/{project.id}/upload', data={'files': (f, 'phone.jpg')},
+                               content_type='multipart/form-data')
+    assert response.status_code == 202, response.get_json()
+    job_id = response.get_json()['job_id']
+    for _ in range(100):
+        if client.get(f'/api/ingest/{job_id}').get_json()['status'] not in ('queued', 'processing'):
+            break
+        time.sleep(0.1)
+
+    image = Image.query.filter_by(project_id=project.id).one()
+    assert (image.width, image.height) == (3000, 4000)
+
+
+def two_tone_photo(name, size):
+    """Raw pixels red on the left half and blue on the right, tagged orientation 6 (so red is on top upright)"""
+    raw = PILImage.new('RGB', size, (0, 0, 255))
+    raw.paste((255, 0, 0), (0, 0, size[0] // 2, size[1]))
+    exif = PILImage.Exif()
+    exif[0x0112] = 6
+    path = os.path.abspath(name)
+    raw.save(path, exif=exif)
+    return path
+
+
+def is_red(pixel):
+    return pixel[0] > 200 and pixel[2] < 60
+
+
+def is_blue(pixel):
+    return pixel[2] > 200 and pixel[0] < 60
+
+
+def test_sprite_cells_are_upright(app):
+    source = two_tone_photo('rotated-sprite.jpg', (400, 300))
+    image = types.SimpleNamespace(id=9003, filepath=source, content_hash='d' * 64, width=300, height=400)
+
+    index = build_sprite([image])
+
+    cell = index['images']['9003']
+    assert (cell['width'], cell['height']) == (240, 320)
+    with PILImage.open(sprite_paths(index['key'])[0]) as sprite:
+        top = sprite.getpixel((cell['x'] + 120, cell['y'] + 40))
+        bottom = sprite.getpixel((cell['x'] + 120, cell['y'] + 280))
+    assert is_red(top) and is_blue(bottom)
+
+
+def test_tile_pyramid_follows_the_upright_size(app):
+    source = two_tone_photo('rotated-tiles.jpg', (1000, 600))
+    image = types.SimpleNamespace(id=9004, filepath=source, content_hash='e' * 64, width=600, height=1000)
+
+    descriptor = tile_descriptor(image)
+    top = descriptor['levels'][descriptor['max_level']]
+    ensure_tile_pyramid(image)
+
+    assert (top['width'], top['height'], top['cols'], top['rows']) == (600, 1000, 3, 4)
+    with PILImage.open(tile_path(image, top['level'], 0, 0)) as first:
+        assert is_red(first.getpixel((128, 128)))
+    with PILImage.open(tile_path(image, top['level'], 2, 3)) as corner:
+        assert corner.size == (600 - 2 * 256, 1000 - 3 * 256)
+        assert is_blue(corner.getpixel((40, 100)))
+    assert not os.path.exists(tile_path(image, top['level'], 3, 0))
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+import pytest
+from database import db
+from models import Image
+
+
+@pytest.fixture
+def listed_images(project):
+    """Seven images over four upload times, three of them sharing one, listed newest first"""
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    offsets = [0, 1, 1, 1, 2, 2, 3]
+    images = [Image(project_id=project.id, filename=f'{i}.jpg', filepath=f'/tmp/{i}.jpg',
+                    uploaded_at=start + timedelta(minutes=minutes))
+              for i, minutes in enumerate(offsets)]
+    db.session.add_all(images)
+    db.session.commit()
+    return [img.id for img in sorted(images, key=lambda img: (img.uploaded_at, img.id), reverse=True)]
+
+
+def get_page(client, project, **args):
+    response = client.get(f'/api/projects/{project.id}/images', query_string={'limit': 3, **args})
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+
+def ids(page):
+    return [img['id'] for img in page['images']]
+
+
+def test_forward_pages_cover_every_image_once(client, project, listed_images):
+    first = get_page(client, project)
+    second = get_page(client, project, after=first['next_cursor'])
+    last = get_page(client, project, after=second['next_cursor'])
+
+    assert ids(first) + ids(second) + ids(last) == listed_images
+    assert first['prev_cursor'] is None and first['total'] == 7
+    assert second['prev_cursor'] and 'total' not in second
+    assert ids(last) == listed_images[6:]
+    assert last['next_cursor'] is None and last['prev_cursor']
+
+
+def test_backward_pages_mirror_the_forward_ones(client, project, listed_images):
+    first = get_page(client, project)
+    second = get_page(client, project, after=first['next_cursor'])
+    last = get_page(client, project, after=second['next_cursor'])
+
+    back_second = get_page(client, project, before=last['prev_cursor'])
+    back_first = get_page(client, project, before=back_second['prev_cursor'])
+
+    assert ids(back_second) == ids(second)
+    assert ids(back_first) == ids(first)
+    assert back_first['prev_cursor'] is None
+    assert back_first['next_cursor'] and back_second['next_cursor']
+
+
+def test_ties_on_upload_time_split_across_pages(client, project, listed_images):
+    # Page size 2 puts the cut inside the three images uploaded at the same minute
+    seen = []
+    cursor = None
+    while True:
+        page = get_page(client, project, limit=2, **({'after': cursor} if cursor else {}))
+        seen += ids(page)
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    assert seen == listed_images
+
+
+def test_invalid_cursor_is_rejected(client, project, listed_images):
+    response = client.get(f'/api/projects/{project.id}/images', query_string={'after': 'not-a-cursor'})
+
+    assert response.status_code == 400
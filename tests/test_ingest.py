@@ -0,0 +1,46 @@
+import io
+import os
+import time
+import bulk_insert
+from PIL import Image as PILImage
+from database import db
+from models import Image, IngestFile
+
+
+def wait_for_job(client, job_id):
+    for _ in range(100):
+        job = client.get(f'/api/ingest/{job_id}').get_json()
+        if job['status'] not in ('queued', 'processing'):
+            return job
+        time.sleep(0.1)
+    raise AssertionError(f"Ingest job {job_id} did not finish")
+
+
+def jpeg_upload(color):
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (32, 24), color).save(buffer, 'JPEG')
+    buffer.seek(0)
+    return buffer
+
+
+def test_failed_batch_keeps_the_staged_upload_for_a_retry(client, project, monkeypatch):
+    def failing_insert(rows):
+        raise RuntimeError('disk full')
+
+    monkeypatch.setattr(bulk_insert, 'insert_images', failing_insert)
+    response = client.post(f'/api/projects/{project.id}/upload', data={'files': (jpeg_upload((1, 99, 1)), 'a.jpg')},
+                           content_type='multipart/form-data')
+    job_id = response.get_json()['job_id']
+    assert wait_for_job(client, job_id)['status'] == 'failed'
+
+    db.session.expire_all()
+    staged_path = IngestFile.query.filter_by(job_id=job_id).one().staged_path
+    assert os.path.exists(staged_path)
+
+    monkeypatch.undo()
+    assert client.post(f'/api/ingest/{job_id}/retry').status_code == 202
+    assert wait_for_job(client, job_id)['status'] == 'completed'
+
+    image = Image.query.filter_by(project_id=project.id).one()
+    assert os.path.exists(image.filepath)
+    assert not os.path.exists(staged_path)
@@ -0,0 +1,106 @@
+import json
+import os
+import pytest
+from conftest import write_image
+from database import db
+from migrations import dataset_version_membership, orient_image_sizes, packed_polygons
+from models import Annotation, Class, DatasetVersion, DatasetVersionImage, Image
+from polygon_codec import decode_polygon
+
+
+def add_image(project, path, width, height):
+    image = Image(filename=os.path.basename(path), filepath=path, width=width, height=height, project_id=project.id)
+    db.session.add(image)
+    db.session.commit()
+    return image.id
+
+
+def test_rotated_images_get_their_upright_size(project):
+    rotated = add_image(project, write_image(os.path.abspath('m-rotated.jpg'), size=(80, 60), orientation=6), 80, 60)
+    done = add_image(project, write_image(os.path.abspath('m-done.jpg'), size=(80, 60), orientation=6), 60, 80)
+    plain = add_image(project, write_image(os.path.abspath('m-plain.jpg'), size=(80, 60)), 80, 60)
+
+    orient_image_sizes()
+
+    db.session.expire_all()
+    sizes = {image_id: (db.session.get(Image, image_id).width, db.session.get(Image, image_id).height)
+             for image_id in (rotated, done, plain)}
+    assert sizes == {rotated: (60, 80), done: (60, 80), plain: (80, 60)}
+
+
+@pytest.fixture
+def legacy_column(app):
+    """Re-add a column a migration converts away, dropping it again afterwards if the migration didn't"""
+    added = []
+
+    def add(table, name, sql_type):
+        db.session.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {name} {sql_type}"))
+        db.session.commit()
+        added.append((table, name))
+
+    yield add
+    db.session.rollback()
+    for table, name in added:
+        if name in {column['name'] for column in db.inspect(db.engine).get_columns(table)}:
+            db.session.execute(db.text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+    db.session.commit()
+
+
+def test_json_polygons_are_packed_and_the_old_column_emptied(project, legacy_column):
+    legacy_column('annotation', 'polygon_points', 'TEXT')
+    cls = Class(name='leaf', project_id=project.id)
+    image_id = add_image(project, '/tmp/m-polygons.jpg', 100, 100)
+    db.session.add(cls)
+    db.session.commit()
+    polygons = {'inside': [[0.1, 0.2], [0.9, 0.2], [0.5, 0.8]], 'outside': [[-0.5, 0.25], [1.25, 0.75], [0.5, 0.5]],
+                'unreadable': 'not json', 'none': None}
+    ids = {}
+    for name, points in polygons.items():
+        annotation = Annotation(image_id=image_id, class_id=cls.id, x_center=0.5, y_center=0.5, width=0.1, height=0.1)
+        db.session.add(annotation)
+        db.session.flush()
+        raw = points if name == 'unreadable' else json.dumps(points) if points else None
+        db.session.execute(db.text("UPDATE annotation SET polygon_points = :raw WHERE id = :id"),
+                           {'raw': raw, 'id': annotation.id})
+        ids[name] = annotation.id
+    db.session.commit()
+
+    packed_polygons()
+
+    rows = {ann_id: (data, points) for ann_id, data, points in db.session.execute(
+        db.text("SELECT id, polygon_data, polygon_points FROM annotation WHERE image_id = :id"), {'id': image_id})}
+    for name in ('inside', 'outside'):
+        data, points = rows[ids[name]]
+        assert points is None
+        for (x, y), (dx, dy) in zip(polygons[name], decode_polygon(data)):
+            assert abs(x - dx) < 1e-4 and abs(y - dy) < 1e-4
+    # Only an unconvertible polygon keeps its JSON, for someone to inspect
+    assert rows[ids['unreadable']] == (None, 'not json')
+    assert rows[ids['none']] == (None, None)
+
+
+def test_split_json_becomes_version_membership(project, legacy_column):
+    legacy_column('dataset_version', 'image_splits', 'TEXT')
+    a, b, c, gone = (add_image(project, f'/tmp/m-split-{name}.jpg', 10, 10) for name in 'abcd')
+    db.session.delete(db.session.get(Image, gone))
+    version = DatasetVersion(project_id=project.id, name='v1')
+    broken = DatasetVersion(project_id=project.id, name='v2')
+    db.session.add_all([version, broken])
+    db.session.commit()
+    splits = {version.id: json.dumps({'train': [a, b, gone], 'val': [c], 'test': [a]}), broken.id: '{not json'}
+    for version_id, image_splits in splits.items():
+        db.session.execute(db.text("UPDATE dataset_version SET image_splits = :splits WHERE id = :id"),
+                           {'splits': image_splits, 'id': version_id})
+    db.session.commit()
+
+    dataset_version_membership()
+    db.session.commit()
+
+    db.session.expire_all()
+    members = {(row.image_id, row.split) for row in DatasetVersionImage.query.filter_by(version_id=version.id)}
+    # Deleted images are dropped and an image listed twice keeps its first split
+    assert members == {(a, 'train'), (b, 'train'), (c, 'val')}
+    version = db.session.get(DatasetVersion, version.id)
+    assert (version.train_count, version.val_count, version.test_count) == (2, 1, 0)
+    assert DatasetVersionImage.query.filter_by(version_id=broken.id).count() == 0
+    assert 'image_splits' not in {column['name'] for column in db.inspect(db.engine).get_columns('dataset_version')}
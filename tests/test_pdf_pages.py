@@ -0,0 +1,70 @@
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image as PILImage
+import pdf_pages
+from derivatives import sprite_paths
+from database import db
+from models import Image
+from test_ingest import wait_for_job
+
+
+def pdf_upload(pages, blue):
+    buffer = io.BytesIO()
+    images = [PILImage.new('RGB', (300, 400), (40 * page, 90, blue)) for page in range(pages)]
+    images[0].save(buffer, 'PDF', save_all=True, append_images=images[1:])
+    buffer.seek(0)
+    return buffer
+
+
+def lazy_pages(app, client, project, monkeypatch, blue, pages=3):
+    """Ingest a PDF lazily; blue sets its pages apart from other tests' (the page cache is by content)"""
+    monkeypatch.setitem(app.config, 'PDF_LAZY_MIN_PAGES', 2)
+    response = client.post(f'/api/projects/{project.id}/upload', data={'files': (pdf_upload(pages, blue), 'doc.pdf')},
+                           content_type='multipart/form-data')
+    assert wait_for_job(client, response.get_json()['job_id'])['status'] == 'completed'
+    images = Image.query.filter_by(project_id=project.id).order_by(Image.page_index).all()
+    assert [img.page_index for img in images] == list(range(pages))
+    return images
+
+
+def test_concurrent_requests_share_one_page_render(app, client, project, monkeypatch):
+    page = lazy_pages(app, client, project, monkeypatch, blue=160)[1]
+    submitted = []
+    render_file = pdf_pages.render_file
+
+    def counting_render_file(*args):
+        submitted.append(args)
+        return render_file(*args)
+
+    def request_page(image_id):
+        with app.app_context():
+            return pdf_pages.ensure_image_file(db.session.get(Image, image_id))
+
+    monkeypatch.setattr(pdf_pages, 'render_file', counting_render_file)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        paths = list(executor.map(request_page, [page.id] * 8))
+
+    assert paths == [page.filepath] * 8
+    assert len(submitted) == 1
+    with PILImage.open(page.filepath) as rendered:
+        assert rendered.size == (page.width, page.height)
+    assert not pdf_pages._rendering
+
+
+def test_sprite_leaves_out_unrendered_pages_and_starts_them(app, client, project, monkeypatch):
+    images = lazy_pages(app, client, project, monkeypatch, blue=200)
+    ids = ','.join(str(img.id) for img in images)
+
+    first = client.get(f'/api/projects/{project.id}/thumbnails/sprite?ids={ids}').get_json()
+
+    assert first['url'] is None and first['images'] == {}
+    assert first['pending'] == [img.id for img in images]
+    # The prefetch started by the sprite request is what the thumbnails wait on
+    for image in images:
+        assert pdf_pages.ensure_image_file(image) == image.filepath
+
+    second = client.get(f'/api/projects/{project.id}/thumbnails/sprite?ids={ids}').get_json()
+    assert second['pending'] == []
+    assert set(second['images']) == {str(img.id) for img in images}
+    assert os.path.exists(sprite_paths(second['key'])[0])
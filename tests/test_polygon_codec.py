@@ -0,0 +1,36 @@
+from polygon_codec import FLOAT32, HEADER, QUANTIZE_SCALE, QUANTIZED, decode_polygon, encode_polygon
+
+
+def encoding(data):
+    return HEADER.unpack_from(data)[0]
+
+
+def test_normalized_polygon_round_trips_through_uint16():
+    points = [[0.0, 0.0], [1.0, 0.0], [0.123456, 0.987654], [0.5, 1.0]]
+
+    data = encode_polygon(points)
+
+    assert encoding(data) == QUANTIZED
+    assert len(data) == HEADER.size + 2 * 2 * len(points)
+    # Within a uint16 step (half a step of quantizing plus the rounding to DECIMALS)
+    for (x, y), (dx, dy) in zip(points, decode_polygon(data)):
+        assert abs(x - dx) < 1 / QUANTIZE_SCALE and abs(y - dy) < 1 / QUANTIZE_SCALE
+    # Exact at the image edges
+    assert decode_polygon(data)[1] == [1.0, 0.0]
+
+
+def test_polygon_outside_the_image_round_trips_through_float32():
+    points = [[-0.25, 0.5], [1.5, 0.125], [0.3, 0.7]]
+
+    data = encode_polygon(points)
+
+    assert encoding(data) == FLOAT32
+    assert len(data) == HEADER.size + 4 * 2 * len(points)
+    for (x, y), (dx, dy) in zip(points, decode_polygon(data)):
+        assert abs(x - dx) < 1e-6 and abs(y - dy) < 1e-6
+
+
+def test_empty_polygon_is_stored_as_null():
+    assert encode_polygon([]) is None
+    assert encode_polygon(None) is None
+    assert decode_polygon(None) is None
@@ -0,0 +1,46 @@
+import os
+from datetime import datetime, timedelta
+import resumable_upload
+from database import db
+from models import ChunkedUpload
+
+
+def start_upload(client, project, size=10):
+    response = client.post(f'/api/projects/{project.id}/uploads', json={'filename': 'a.jpg', 'size': size})
+    assert response.status_code == 201, response.get_json()
+    return response.get_json()['upload_id']
+
+
+def put_chunk(client, upload_id, data, offset=0):
+    return client.put(f'/api/uploads/{upload_id}?offset={offset}', data=data)
+
+
+def test_completed_upload_releases_its_hasher_and_lock(client, project):
+    upload_id = start_upload(client, project)
+    assert put_chunk(client, upload_id, b'0123').status_code == 200
+    assert upload_id in resumable_upload._hashers
+
+    response = put_chunk(client, upload_id, b'456789', offset=4)
+
+    assert response.get_json()['status'] == 'complete'
+    assert upload_id not in resumable_upload._hashers
+    assert upload_id not in resumable_upload._upload_locks
+
+
+def test_abandoned_uploads_expire(app, client, project):
+    stale_id = start_upload(client, project)
+    assert put_chunk(client, stale_id, b'0123').status_code == 200
+    fresh_id = start_upload(client, project)
+    stale = db.session.get(ChunkedUpload, stale_id)
+    stale_path = stale.staged_path
+    stale.updated_at = datetime.utcnow() - timedelta(hours=app.config['CHUNKED_UPLOAD_TTL_HOURS'] + 1)
+    db.session.commit()
+
+    assert resumable_upload.expire_stale_uploads(force=True) == 1
+    db.session.commit()
+
+    assert db.session.get(ChunkedUpload, stale_id) is None
+    assert not os.path.exists(stale_path)
+    assert stale_id not in resumable_upload._hashers
+    assert stale_id not in resumable_upload._upload_locks
+    assert db.session.get(ChunkedUpload, fresh_id) is not None
@@ -0,0 +1,49 @@
+import os
+import sys
+import types
+from conftest import write_image
+from models import Image, Annotation, Class
+
+
+def fake_roboflow(export_dir_name='ds-1'):
+    """A roboflow module whose download() writes a small YOLO export into the working directory"""
+
+    class Version:
+        def download(self, model_format):
+            root = os.path.abspath(export_dir_name)
+            os.makedirs(root, exist_ok=True)
+            with open(os.path.join(root, 'data.yaml'), 'w') as f:
+                f.write("names: ['cat', 'dog']\n")
+            for split, color in (('train', (255, 0, 0)), ('valid', (0, 255, 0))):
+                write_image(os.path.join(root, split, 'images', f'{split}.jpg'), color=color)
+                os.makedirs(os.path.join(root, split, 'labels'), exist_ok=True)
+                with open(os.path.join(root, split, 'labels', f'{split}.txt'), 'w') as f:
+                    f.write("1 0.5 0.5 0.25 0.25\n")
+            return types.SimpleNamespace(location=root)
+
+    class Roboflow:
+        def __init__(self, api_key):
+            pass
+
+        def workspace(self, name):
+            return types.SimpleNamespace(project=lambda name: types.SimpleNamespace(version=lambda v: Version()))
+
+    return types.SimpleNamespace(Roboflow=Roboflow)
+
+
+def test_roboflow_import_stores_images_and_labels(client, project, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'roboflow', fake_roboflow())
+
+    response = client.post(f'/api/projects/{project.id}/import-roboflow', json={
+        'api_key': 'key', 'workspace': 'ws', 'project_name': 'ds', 'version': 1
+    })
+
+    assert response.status_code == 200, response.get_json()
+    assert response.get_json()['images_count'] == 2
+    images = Image.query.filter_by(project_id=project.id).order_by(Image.filename).all()
+    assert [image.filename for image in images] == ['train_train.jpg', 'valid_valid.jpg']
+    for image in images:
+        assert image.content_hash and os.path.exists(image.filepath)
+        assert (image.width, image.height) == (64, 48)
+    dog = Class.query.filter_by(project_id=project.id, name='dog').one()
+    assert Annotation.query.filter_by(class_id=dog.id).count() == 2
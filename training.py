@@ -1,6 +1,9 @@
 from flask import current_app
-from database import db
+from database import serialized_commit
 from models import Project, Image, Annotation, Class, DatasetVersion, TrainingJob
+from blob_store import link_or_copy
+from pdf_pages import ensure_image_file
+from dataset_versions import split_images
 import os
 import yaml
 import shutil
@@ -36,7 +39,7 @@ def train_yolo_model(job_id, socketio):
         try:
             job.status = 'training'
             job.started_at = datetime.utcnow()
-            db.session.commit()
+            serialized_commit()
             print(f"✅ Job status updated to 'training'")
             
             socketio.emit('training_update', {
@@ -204,6 +207,8 @@ def train_yolo_model(job_id, socketio):
             
             job.model_path = model_path
             job.metrics = json.dumps(metrics_data)
+            # Commit now so no write transaction stays open while the test set is evaluated
+            serialized_commit()
             
             # Evaluate on test set
             print(f"\n📊 Evaluating model on test set...")
@@ -270,7 +275,7 @@ def train_yolo_model(job_id, socketio):
             
             job.status = 'completed'
             job.completed_at = datetime.utcnow()
-            db.session.commit()
+            serialized_commit()
             print(f"✅ Job #{job.id} completed. Model saved to: {model_path}")
             
             socketio.emit('training_complete', {
@@ -289,7 +294,7 @@ def train_yolo_model(job_id, socketio):
         except Exception as e:
             job.status = 'failed'
             job.completed_at = datetime.utcnow()
-            db.session.commit()
+            serialized_commit()
             
             socketio.emit('training_error', {
                 'job_id': job.id,
@@ -322,11 +327,9 @@ def prepare_yolo_dataset(project, job, for_hf_jobs=False):
             test_images = annotated_images[val_idx:]
         else:
             print(f"📊 Dataset version found: {version.name}")
-            splits_data = json.loads(version.image_splits)
-            
-            train_images = [Image.query.get(img_id) for img_id in splits_data['train'] if Image.query.get(img_id)]
-            val_images = [Image.query.get(img_id) for img_id in splits_data['val'] if Image.query.get(img_id)]
-            test_images = [Image.query.get(img_id) for img_id in splits_data.get('test', []) if Image.query.get(img_id)]
+            train_images = split_images(version.id, 'train')
+            val_images = split_images(version.id, 'val')
+            test_images = split_images(version.id, 'test')
             
             print(f"   Split from version - Train: {len(train_images)}, Val: {len(val_images)}, Test: {len(test_images)}")
     else:
@@ -345,9 +348,14 @@ def prepare_yolo_dataset(project, job, for_hf_jobs=False):
     # Process images for all splits
     for split, images in [('train', train_images), ('val', val_images), ('test', test_images)]:
         for image in images:
-            # Copy image
+            # Lazy PDF pages are rendered here, the first time a dataset needs them
+            if not ensure_image_file(image):
+                print(f"⚠️ Image file missing for image {image.id}, skipping")
+                continue
+            
+            # Hardlink the stored image instead of copying it
             dest_image = os.path.join(dataset_path, 'images', split, f'{image.id}.jpg')
-            shutil.copy(image.filepath, dest_image)
+            link_or_copy(image.filepath, dest_image)
             
             # Create label file
             label_path = os.path.join(dataset_path, 'labels', split, f'{image.id}.txt')
@@ -416,7 +424,7 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
         try:
             job.status = 'training'
             job.started_at = datetime.utcnow()
-            db.session.commit()
+            serialized_commit()
             print(f"✅ Job status updated to 'training'")
             
             socketio.emit('training_update', {
@@ -518,7 +526,7 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
             # Save HF job ID and model repo
             job.hf_job_id = hf_job_info.id
             job.model_path = f"hf://{model_repo_id}/best.pt"  # Store HF Hub path
-            db.session.commit()
+            serialized_commit()
             
             print(f"✅ HF Job started: {hf_job_info.id}")
             print(f"   URL: {hf_job_info.url}")
@@ -641,6 +649,8 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
                             print(f"⚠️ results.csv not found at {results_csv}")
                         
                         print(f"✅ Model downloaded to {local_model_path}")
+                        # Commit now so no write transaction stays open while the test set is evaluated
+                        serialized_commit()
                         
                         # Evaluate on test set
                         print(f"\n📊 Evaluating model on test set...")
@@ -723,7 +733,7 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
                     print(f"   test_precision: {job.test_precision}")
                     print(f"   test_recall: {job.test_recall}")
                     
-                    db.session.commit()
+                    serialized_commit()
                     print(f"✅ Job committed to database")
                     
                     # Prepare completion data
@@ -756,7 +766,7 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
                     job.status = 'failed'
                     job.error_message = hf_job_status.status.message or "HF Job failed"
                     job.completed_at = datetime.utcnow()
-                    db.session.commit()
+                    serialized_commit()
                     
                     socketio.emit('training_error', {
                         'job_id': job.id,
@@ -773,7 +783,7 @@ def train_yolo_model_hf_jobs(job_id, hf_api_key, socketio):
             job.status = 'failed'
             job.error_message = str(e)
             job.completed_at = datetime.utcnow()
-            db.session.commit()
+            serialized_commit()
             
             socketio.emit('training_error', {
                 'job_id': job.id,